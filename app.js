@@ -40,12 +40,14 @@ document.addEventListener('DOMContentLoaded', () => {
     // Parsers
     const m3uParser = new M3UParser();
     const epgParser = new EPGParser();
+    const serverChannels = new ServerChannels();
 
     // State Variables
     window.currentHlsInstance = null;
     window.epgData = { channels: {}, programmes: {} }; 
     window.allChannels = []; 
     let currentSelectedChannelItem = null;
+    let m3uLoadCount = 0; // tells a stale server response from the current playlist's
 
     // Favorites State
     let favoriteChannelIds = new Set();
@@ -277,7 +279,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const url = m3uUrlInput.value.trim();
         if (file) {
             const reader = new FileReader();
-            reader.onload = (e) => processM3UContent(e.target.result);
+            reader.onload = (e) => processM3UContent(e.target.result, file.name);
             reader.onerror = () => showNotification('Error reading M3U file.', 'error');
             reader.readAsText(file);
         } else if (url) {
@@ -292,23 +294,43 @@ document.addEventListener('DOMContentLoaded', () => {
         showNotification(`Fetching M3U from ${url}...`, 'info', 1500);
         fetch(url)
             .then(response => response.ok ? response.text() : Promise.reject(`HTTP error! status: ${response.status}`))
-            .then(processM3UContent)
+            .then(content => processM3UContent(content, url))
             .catch(error => showNotification(`Error fetching M3U from URL: ${error}. Check CORS policy.`, 'error', 5000));
     }
 
 
-    function processM3UContent(content) {
+    function processM3UContent(content, sourceName) {
+        const loadId = ++m3uLoadCount;
+        // Stored on the server first, so that channels carry the URLs it serves them under
+        // (the relay, the logo cache); without a server the playlist is parsed here.
+        serverChannels.store(sourceName, content)
+            .catch(error => {
+                console.warn(`Playlist not stored on the server: ${error.message}`);
+                return null;
+            })
+            .then(channels => {
+                if (loadId !== m3uLoadCount) return;
+                if (channels && channels.length > 0) showM3UChannels(channels);
+                else parseM3UContent(content);
+            });
+    }
+
+    function parseM3UContent(content) {
         try {
-            window.allChannels = m3uParser.parse(content);
-            applyFilters(); 
-            showNotification(`M3U loaded: ${window.allChannels.length} channels.`, 'success');
-            displayRecentChannels(); 
+            showM3UChannels(m3uParser.parse(content));
         } catch (error) {
             showNotification(`Error parsing M3U: ${error.message}`, 'error');
             window.allChannels = [];
             applyFilters(); 
         }
     }
+
+    function showM3UChannels(channels) {
+        window.allChannels = channels;
+        applyFilters(); 
+        showNotification(`M3U loaded: ${window.allChannels.length} channels.`, 'success');
+        displayRecentChannels(); 
+    }
     
     // --- EPG File/URL processing (modified for single source handling & merging) ---
     async function fetchAndProcessSingleEpgUrl(url, clearPreviousGlobalEpg) {
@@ -549,10 +571,13 @@ document.addEventListener('DOMContentLoaded', () => {
                 const item = document.createElement('div');
                 item.className = 'channel-item';
                 const logo = document.createElement('img');
-                if (channel.tvg_logo) {
-                    logo.src = channel.tvg_logo;
+                // Channels from the server's store carry a logo_url served from its logo cache
+                const logoUrl = channel.logo_url ? `${channel.logo_url}?size=64` : channel.tvg_logo;
+                if (logoUrl) {
+                    logo.src = logoUrl;
                     logo.alt = "";
-                    logo.onerror = () => logo.style.display = 'none';
+                    logo.loading = 'lazy';
+                    logo.onerror = () => { logo.style.display = 'none'; };
                 } else {
                     logo.style.display = 'none';
                 }
@@ -602,10 +627,18 @@ document.addEventListener('DOMContentLoaded', () => {
         if (isHls && typeof Hls !== 'undefined' && Hls.isSupported()) {
             const hls = new Hls();
             window.currentHlsInstance = hls;
-            hls.loadSource(streamUrl);
+            // Channels loaded from the server carry a relay_url, so their viewers share one
+            // upstream fetch; other channels, or a relay that can't reach the stream, play directly.
+            let relayed = Boolean(channel.relay_url);
+            hls.loadSource(relayed ? channel.relay_url : streamUrl);
             hls.attachMedia(player);
             hls.on(Hls.Events.MANIFEST_PARSED, () => player.play().catch(e => showNotification(`Play error: ${e.message}`, 'error')));
             hls.on(Hls.Events.ERROR, (event, data) => {
+                if (relayed && data.details === Hls.ErrorDetails.MANIFEST_LOAD_ERROR) {
+                    relayed = false;
+                    hls.loadSource(streamUrl);
+                    return;
+                }
                 if (data.fatal) {
                     showNotification(`HLS Error: ${data.details || data.type}`, 'error', 5000);
                     if (data.type === Hls.ErrorTypes.MEDIA_ERROR) hls.recoverMediaError();
@@ -1,25 +1,115 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, g, redirect, render_template, request, jsonify, send_file, send_from_directory, stream_with_context
 import os
+import atexit
+import base64
+import hashlib
+import resource
+import socket
+import time
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import get_input_stream, wrap_file
 import xml.etree.ElementTree as ET
 import m3u8
 import json
 import requests
 import asyncio
-import aiohttp
-from concurrent.futures import ThreadPoolExecutor
 from flask import request, jsonify
+from epg_index import EPGIndex
+from epg_matcher import EPGMatcher
+from health_cache import HealthCache
+from hls_probe import is_hls_url
+from hls_relay import PLAYLIST_CONTENT_TYPE, HLSRelay, RelayError, load_secret
+from epg_parser import IngestProgress, XMLTVParser, open_decompressed
+from epg_pipeline import EPGPipeline
+from jobs import BackgroundLoop, Job, JobManager, ShuttingDown
+from link_checker import LinkChecker
+from logo_cache import LogoCache, thumbnail_size
+from m3u_parser import M3UParser
+from metrics import CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram, StageTimer
+from profiling import SamplingProfiler
+from records import Channel
+from response_cache import ResponseCache
+from sources import SOURCE_KINDS, SourceFetcher, SourceScheduler, guess_kind, source_name
+from storage import CHANNEL_ORDERS, CHANNELS_VERSION, EPG_VERSION, Store, epg_source_version
+from timestamps import format_timestamp, parse_iso_time, parse_xmltv_time
+from uploads import ChunkedUploads, UploadError
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Limit for streamed (PUT /api/upload/<filename>) and chunked uploads, which bypass MAX_CONTENT_LENGTH
+app.config['STREAM_UPLOAD_MAX_BYTES'] = 4 * 1024 * 1024 * 1024
+# Link checker limits
+app.config['LINK_CHECK_CONCURRENCY'] = 64  # checks in flight at once
+app.config['LINK_CHECK_PER_HOST'] = 8  # open connections per host
+app.config['LINK_CHECK_TIMEOUT'] = 10.0  # seconds per attempt
+app.config['LINK_CHECK_CONNECT_TIMEOUT'] = 5.0
+app.config['LINK_CHECK_RETRIES'] = 2
+app.config['LINK_CHECK_RANGE_FALLBACK'] = True  # ranged GET when HEAD is rejected
+# Link health cache
+app.config['HEALTH_CACHE_MAX_ENTRIES'] = 50000
+app.config['HEALTH_CACHE_ALIVE_TTL'] = 3600  # 1 hour
+app.config['HEALTH_CACHE_DEAD_TTL'] = 600  # dead links are re-checked sooner
+# EPG parsing: worker processes (None = one per core) and chunk size for large plain-XML guides
+app.config['EPG_PARSE_WORKERS'] = None
+app.config['EPG_CHUNK_BYTES'] = 16 * 1024 * 1024
+app.config['EPG_PARSE_MAX_INFLIGHT_BYTES'] = 128 * 1024 * 1024  # chunks being parsed per upload, whatever the cores
+# Programmes that ended longer ago than this are pruned when a guide is refreshed
+app.config['EPG_RETENTION_HOURS'] = 24
+# Remote playlists and guides refreshed on the server
+app.config['SOURCE_SCHEDULER'] = True
+app.config['SOURCE_REFRESH_INTERVAL'] = 6 * 3600  # default seconds between refreshes of a source
+app.config['SOURCE_POLL_INTERVAL'] = 60  # how often due sources are looked for
+app.config['SOURCE_FETCH_CONCURRENCY'] = 4
+app.config['SOURCE_MAX_BYTES'] = 1024 * 1024 * 1024
+# Pre-compressed responses of the large read endpoints
+app.config['RESPONSE_CACHE_GZIP_LEVEL'] = 6
+app.config['RESPONSE_CACHE_BROTLI_QUALITY'] = 5  # used when the brotli package is installed
+# Seconds a stopping worker waits for running link checks and source refreshes before cancelling them
+app.config['SHUTDOWN_DRAIN_TIMEOUT'] = 30
+# HLS relay (/relay/index.m3u8?url=): viewers of a channel share the upstream playlist and segment fetches
+app.config['RELAY_ENABLED'] = True
+app.config['RELAY_MEMORY_BYTES'] = 64 * 1024 * 1024  # small segments kept in memory, per process
+app.config['RELAY_DISK_BYTES'] = 1024 * 1024 * 1024  # segment cache on disk, shared by all processes
+app.config['RELAY_SECRET'] = None  # key relay URLs are signed with; generated on first start when None
+app.config['RELAY_ALLOW_PRIVATE'] = False  # let the relay fetch from loopback, link-local and private addresses
+# Channel logos (/logo/<id>, /logo?url=), fetched once into a disk cache shared by all processes
+app.config['LOGO_PREFETCH'] = True  # fetch a playlist's logos in the background after each ingest
+app.config['LOGO_FETCH_CONCURRENCY'] = 8
+app.config['LOGO_MAX_AGE'] = 7 * 86400  # seconds before a logo is revalidated with its origin
+app.config['LOGO_CLIENT_MAX_AGE'] = 86400  # seconds browsers use a logo before revalidating it by ETag
+# Allows profiling a single request by adding ?profile=1 (answers with collapsed stacks instead)
+app.config['PROFILING'] = False
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# In-memory storage for playlists (in production, use a database)
-playlists = {}
-epg_data = {}
+# Playlists, channels and EPG programmes are persisted in SQLite
+app.config.setdefault('DATABASE', os.path.join(app.config['UPLOAD_FOLDER'], 'iptv.db'))
+store = Store(app.config['DATABASE'])
+store.import_legacy_json(app.config['UPLOAD_FOLDER'])
+
+# Identifies this server process in the store (job owners, leases), as several may share the database
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+# Latest progress snapshot of each EPG ingest, one JSON file per ingest so
+# every server process sees them (the database is locked by the ingest itself)
+PROGRESS_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'progress')
+os.makedirs(PROGRESS_FOLDER, exist_ok=True)
+# Per-source programme indexes as (source version, EPGIndex), built at ingest
+# time and rebuilt when another process changes the source (see get_epg_index)
+epg_indexes = {}
+# Resumable uploads of large guides, assembled on disk chunk by chunk
+chunked_uploads = ChunkedUploads(os.path.join(app.config['UPLOAD_FOLDER'], 'partial'),
+                                 max_bytes=app.config['STREAM_UPLOAD_MAX_BYTES'])
+epg_pipeline = EPGPipeline(workers=app.config['EPG_PARSE_WORKERS'], chunk_bytes=app.config['EPG_CHUNK_BYTES'],
+                           max_inflight_bytes=app.config['EPG_PARSE_MAX_INFLIGHT_BYTES'])
+# Serialized, pre-compressed payloads of /api/channels and /api/epg/full,
+# rebuilt only when the store version they were built from changes
+response_cache = ResponseCache(
+    gzip_level=app.config['RESPONSE_CACHE_GZIP_LEVEL'],
+    brotli_quality=app.config['RESPONSE_CACHE_BROTLI_QUALITY'],
+)
 
 @app.route('/')
 def index():
@@ -43,39 +133,13 @@ def upload_file():
         # Create uploads directory if it doesn't exist
         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
         
+        if not is_playlist_file(filename) and not is_epg_file(filename):
+            return unsupported_file_type()
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         
-        # Process the file based on extension
-        if filename.lower().endswith(('.m3u', '.m3u8')):
-            result = process_m3u(filepath, filename)
-            if not result:
-                return jsonify({'status': 'error', 'message': 'Failed to process M3U file'}), 400
-            return jsonify({
-                'status': 'success',
-                'type': 'playlist',
-                'filename': filename,
-                'total_channels': len(result.get('channels', []))
-            })
-            
-        elif filename.lower().endswith(('.xml', '.xml.gz')):
-            result = process_epg(filepath, filename)
-            if result.get('status') == 'error':
-                return jsonify(result), 400
-                
-            return jsonify({
-                'status': 'success',
-                'type': 'epg',
-                'filename': filename,
-                'programs_count': result.get('programs_count', 0),
-                'channels': result.get('channels', [])
-            })
-            
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': 'Unsupported file type. Please upload .m3u, .m3u8, .xml, or .xml.gz files.'
-            }), 400
+        # mode=replace rebuilds a guide that was uploaded before instead of merging the changes
+        return process_upload(filename, filepath=filepath, mode=request.form.get('mode'))
             
     except Exception as e:
         error_msg = f"Error processing file: {str(e)}"
@@ -85,30 +149,231 @@ def upload_file():
             'message': error_msg
         }), 500
 
+PLAYLIST_EXTENSIONS = ('.m3u', '.m3u8', '.m3u.gz', '.m3u8.gz')
+EPG_EXTENSIONS = ('.xml', '.xml.gz')
+
+def is_playlist_file(filename):
+    return filename.lower().endswith(PLAYLIST_EXTENSIONS)
+
+def is_epg_file(filename):
+    return filename.lower().endswith(EPG_EXTENSIONS)
+
+def unsupported_file_type():
+    return jsonify({
+        'status': 'error',
+        'message': 'Unsupported file type. Please upload .m3u, .m3u8, .xml, or .xml.gz files.'
+    }), 400
+
+def process_upload(filename, filepath=None, fileobj=None, mode=None):
+    """
+    Ingests an uploaded playlist or guide, from a saved file or straight from a stream, and builds the response.
+
+    Streams (request bodies) are parsed as they arrive and never touch the
+    disk; gzip-compressed content is detected and decompressed on the fly.
+    """
+    if is_playlist_file(filename):
+        result = process_m3u(filepath, filename) if filepath else ingest_m3u(fileobj, filename)
+        if not result:
+            return jsonify({'status': 'error', 'message': 'Failed to process M3U file'}), 400
+        return jsonify({
+            'status': 'success',
+            'type': 'playlist',
+            'filename': filename,
+            'total_channels': result['total_channels']
+        })
+
+    elif is_epg_file(filename):
+        if filepath:
+            result = process_epg(filepath, filename, mode=mode)
+        else:
+            progress = IngestProgress(filename, total_bytes=request.content_length,
+                                      callback=progress_recorder(filename))
+            result = ingest_epg(XMLTVParser().iter_parse(fileobj, progress), filename, mode=mode)
+        if result.get('status') == 'error':
+            return jsonify(result), 400
+
+        return jsonify({
+            'status': 'success',
+            'type': 'epg',
+            'filename': filename,
+            'mode': result.get('mode'),
+            'programs_count': result.get('programs_count', 0),
+            'changes': result.get('changes'),
+            'channels': result.get('channels', [])
+        })
+
+    return unsupported_file_type()
+
+def request_body_stream():
+    """Returns the raw request body, bypassing MAX_CONTENT_LENGTH (large uploads use their own limit)."""
+    if request.content_length and request.content_length > app.config['STREAM_UPLOAD_MAX_BYTES']:
+        raise UploadError(f"Uploads are limited to {app.config['STREAM_UPLOAD_MAX_BYTES']} bytes", 413)
+    return get_input_stream(request.environ)
+
+@app.errorhandler(UploadError)
+def upload_error(e):
+    body = {'status': 'error', 'message': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return jsonify(body), e.status
+
+@app.route('/api/upload/<filename>', methods=['PUT'])
+def stream_upload(filename):
+    """
+    Ingests a playlist or guide sent as the raw request body (optionally gzip-compressed), while it is received.
+
+    Nothing is written to disk and MAX_CONTENT_LENGTH doesn't apply, so this is
+    the way to upload multi-hundred-MB guides in one request. Chunked transfer
+    encoding is supported. ?mode=replace works as for /upload.
+    """
+    filename = secure_filename(filename)
+    if not is_playlist_file(filename) and not is_epg_file(filename):
+        return unsupported_file_type()
+    return process_upload(filename, fileobj=request_body_stream(), mode=request.args.get('mode'))
+
+@app.route('/api/uploads', methods=['POST'])
+def create_chunked_upload():
+    """
+    Starts a resumable upload. JSON: filename, and size in bytes if known.
+
+    Chunks are then sent in order with PUT /api/uploads/<id>?offset=N (or a
+    Content-Range header); GET /api/uploads/<id> reports how many bytes
+    arrived, to resume after an interruption, and POST
+    /api/uploads/<id>/complete ingests the file.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    if not is_playlist_file(filename) and not is_epg_file(filename):
+        return unsupported_file_type()
+    size = data.get('size')
+    if size is not None and (not isinstance(size, int) or size < 0):
+        return jsonify({'status': 'error', 'message': 'size must be a number of bytes'}), 400
+    return jsonify({'status': 'success', 'upload': chunked_uploads.create(filename, size)}), 201
+
+def chunk_offset():
+    """Reads the offset of a chunk from ?offset= or a 'Content-Range: bytes start-end/total' header."""
+    content_range = request.headers.get('Content-Range', '')
+    if content_range.startswith('bytes '):
+        return int(content_range[len('bytes '):].split('-', 1)[0])
+    return int(request.args['offset'])
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def chunked_upload(upload_id):
+    if request.method == 'GET':
+        return jsonify({'status': 'success', 'upload': chunked_uploads.status(upload_id)})
+    if request.method == 'DELETE':
+        chunked_uploads.abort(upload_id)
+        return jsonify({'status': 'success'})
+    try:
+        offset = chunk_offset()
+    except (KeyError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Missing or invalid chunk offset'}), 400
+    return jsonify({'status': 'success', 'upload': chunked_uploads.append(upload_id, offset, request_body_stream())})
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    status = chunked_uploads.status(upload_id)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], status['filename'])
+    chunked_uploads.complete(upload_id, filepath)
+    data = request.get_json(silent=True) or {}
+    return process_upload(status['filename'], filepath=filepath, mode=data.get('mode'))
+
+# Query parameters that switch /api/channels to a paginated, filtered listing
+CHANNEL_PAGE_PARAMS = ('limit', 'offset', 'cursor', 'playlist', 'group', 'tvg_id', 'id', 'status', 'fields')
+
+def list_param(name):
+    """Returns a multi-valued query parameter, accepting both repeated and comma-separated values."""
+    return [v for value in request.args.getlist(name) for v in value.split(',') if v]
+
+def encode_cursor(channel):
+    return base64.urlsafe_b64encode(json.dumps([channel['playlist'], channel['position']]).encode()).decode()
+
+def decode_cursor(value):
+    playlist, position = json.loads(base64.urlsafe_b64decode(value.encode()))
+    return playlist, int(position)
+
+def version_etag(key, version=None):
+    """Builds an ETag from a store version counter and the query string of the request."""
+    digest = hashlib.md5(request.query_string).hexdigest()[:12]
+    return f'{key}-{store.version(key) if version is None else version}-{digest}'
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def cached_json_response(key, version_key, build):
+    """
+    Serves a JSON payload from the response cache.
+
+    The payload is built by `build()` and compressed only when the store version
+    changed since it was cached; a hit just picks the pre-compressed body that
+    matches Accept-Encoding. Conditional requests are answered with 304.
+    """
+    version = store.version(version_key)
+    etag = version_etag(version_key, version)
+    if etag in request.if_none_match:
+        return not_modified(etag)
+    entry = response_cache.get_or_build(key, version, build)
+    encoding = request.accept_encodings.best_match(entry.encodings) if entry.encodings else None
+    response = Response(entry.select(encoding), mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(etag)
+    return response
+
+def build_channels_payload(order='position'):
+    playlists = store.all_playlists(order)
+    for playlist in playlists.values():
+        for channel in playlist['channels']:
+            add_server_urls(channel)
+    return playlists if playlists else {'status': 'success', 'playlists': {}}
+
+def build_epg_full_payload():
+    sources = store.epg_sources()
+    if not sources:
+        return None
+    epg_key = sources[0]['name']
+    # All channels and programs as-is for browsing
+    return {'status': 'success', 'channels': store.epg_channels(epg_key),
+            'programs': [p.to_dict() for p in store.iter_programmes(epg_key)]}
+
+def warm_response_cache(version_key):
+    """Rebuilds the cached payloads that depend on `version_key` right after an upload changed them."""
+    if version_key == CHANNELS_VERSION:
+        response_cache.invalidate('channels:')
+        response_cache.get_or_build('channels:position', store.version(CHANNELS_VERSION), build_channels_payload)
+    elif version_key == EPG_VERSION:
+        response_cache.invalidate('epg:')
+        payload = build_epg_full_payload()
+        if payload is not None:
+            response_cache.put('epg:full', store.version(EPG_VERSION), payload)
+
 @app.route('/api/channels')
 def get_channels():
     try:
-        # First check in-memory playlists
-        if playlists:
-            return jsonify(playlists)
-            
-        # If no in-memory playlists, try to load from files
-        playlists_data = {}
-        for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-            if filename.endswith('.json') and filename != 'epg_data.json':
-                try:
-                    with open(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'r', encoding='utf-8') as f:
-                        playlist_name = os.path.splitext(filename)[0]
-                        playlists_data[playlist_name] = json.load(f)
-                        # Update in-memory cache
-                        playlists[filename] = playlists_data[playlist_name]
-                except Exception as e:
-                    print(f"Error loading playlist {filename}: {e}")
-        
-        if not playlists_data:
-            return jsonify({'status': 'success', 'playlists': {}})
-            
-        return jsonify(playlists_data)
+        etag = version_etag(CHANNELS_VERSION)
+        if etag in request.if_none_match:
+            return not_modified(etag)
+
+        # sort=startup|ttfb|bitrate orders channels by their deep-probe metrics
+        order = request.args.get('sort', 'position')
+        if order not in CHANNEL_ORDERS:
+            return jsonify({'status': 'error', 'message': f"Unsupported sort '{order}'"}), 400
+
+        if not any(name in request.args for name in CHANNEL_PAGE_PARAMS):
+            return cached_json_response(f'channels:{order}', CHANNELS_VERSION, lambda: build_channels_payload(order))
+
+        payload = get_channel_page(order)
+        if isinstance(payload, tuple):
+            return payload
+        response = jsonify(payload)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
         
     except Exception as e:
         error_msg = f"Error loading channels: {str(e)}"
@@ -118,204 +383,800 @@ def get_channels():
             'message': error_msg
         }), 500
 
+def get_channel_page(order):
+    """
+    Builds a page of channels from the filter, pagination and projection parameters.
+
+    Filters: playlist=, group=, tvg_id= (the ids favorites are stored by), id=,
+    status= (alive, dead, unknown or unchecked). Pagination: limit= (max 1000)
+    with offset= or the opaque cursor= returned as next_cursor. Projection:
+    fields=name,url,... ('id' and 'playlist' are always included).
+    """
+    try:
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        ids = [int(i) for i in list_param('id')]
+    except (ValueError, TypeError):
+        return jsonify({'status': 'error', 'message': 'Invalid pagination parameters'}), 400
+    if after is not None and order != 'position':
+        return jsonify({'status': 'error', 'message': 'cursor can only be used with the default sort'}), 400
+
+    channels, total = store.query_channels(
+        playlists=list_param('playlist'),
+        groups=list_param('group'),
+        tvg_ids=list_param('tvg_id'),
+        ids=ids,
+        statuses=list_param('status'),
+        order=order,
+        offset=offset,
+        limit=limit,
+        after=after,
+    )
+    next_cursor = encode_cursor(channels[-1]) if order == 'position' and len(channels) == limit else None
+    for channel in channels:
+        add_server_urls(channel)
+
+    fields = list_param('fields')
+    if fields:
+        keep = set(fields) | {'id', 'playlist'}
+        channels = [{key: value for key, value in channel.items() if key in keep} for channel in channels]
+    else:
+        for channel in channels:
+            del channel['position']
+
+    return {
+        'status': 'success',
+        'total': total,
+        'offset': offset if after is None else None,
+        'limit': limit,
+        'next_cursor': next_cursor,
+        'channels': channels
+    }
+
+# Link health results are shared across playlists and server processes and survive restarts
+health_cache = HealthCache(
+    max_entries=app.config['HEALTH_CACHE_MAX_ENTRIES'],
+    alive_ttl=app.config['HEALTH_CACHE_ALIVE_TTL'],
+    dead_ttl=app.config['HEALTH_CACHE_DEAD_TTL'],
+    path=os.path.join(app.config['UPLOAD_FOLDER'], 'link_health.json'),
+    store=store,
+)
+health_cache.load()
+atexit.register(health_cache.save)
+
+def make_link_checker():
+    return LinkChecker(
+        concurrency=app.config['LINK_CHECK_CONCURRENCY'],
+        per_host=app.config['LINK_CHECK_PER_HOST'],
+        timeout=app.config['LINK_CHECK_TIMEOUT'],
+        connect_timeout=app.config['LINK_CHECK_CONNECT_TIMEOUT'],
+        retries=app.config['LINK_CHECK_RETRIES'],
+        range_fallback=app.config['LINK_CHECK_RANGE_FALLBACK'],
+        cache=health_cache,
+    )
+
+# Link checks run as jobs on one long-lived event loop, sharing one checker
+# (and therefore one connection pool and concurrency limit) across jobs. Jobs
+# are saved to the store, so any server process can report on them.
+background = BackgroundLoop()
+jobs = JobManager(background, store=store)
+link_checker = make_link_checker()
+
+# Registered remote sources are downloaded (conditionally) and ingested by the
+# server, so clients only ever read the stored result.
+source_fetcher = SourceFetcher(
+    os.path.join(app.config['UPLOAD_FOLDER'], 'sources'),
+    concurrency=app.config['SOURCE_FETCH_CONCURRENCY'],
+    max_bytes=app.config['SOURCE_MAX_BYTES'],
+)
+
+def ingest_source(source, filepath):
+    if source['kind'] == 'playlist':
+        result = process_m3u(filepath, source['name'])
+        return {'status': 'success', **result} if result else {'status': 'error', 'message': 'Failed to process M3U file'}
+    return process_epg(filepath, source['name'])
+
+async def run_source_refresh(job):
+    name = job.params['name']
+    try:
+        source = await asyncio.to_thread(store.get_source, name)
+        if source is None:
+            raise ValueError(f'Source {name} is no longer registered')
+        result = await source_fetcher.fetch(source, force=job.params.get('force', False))
+        job.add_result({'name': name, **result})
+
+        ingest = None
+        if result['status'] == 'modified':
+            ingest = await asyncio.to_thread(ingest_source, source, result['path'])
+            if ingest.get('status') == 'error':
+                # Keep the old validators so the next refresh downloads the source again
+                result = {**result, 'status': 'error', 'error': ingest.get('message'),
+                          'etag': source['etag'], 'last_modified': source['last_modified']}
+        await asyncio.to_thread(store.record_fetch, name, result)
+        return {
+            'name': name,
+            'fetch': result['status'],
+            'http_status': result['http_status'],
+            'bytes': result['bytes'],
+            'error': result['error'],
+            'ingest': ingest
+        }
+    finally:
+        await asyncio.to_thread(source_scheduler.release, name)
+
+def refresh_source(source, force=False):
+    """Starts a job fetching `source` and ingesting it if it changed; None if it is already being refreshed."""
+    if not source_scheduler.claim(source['name']):
+        return None
+    job = Job('refresh-source', 1, {'name': source['name'], 'force': force})
+    try:
+        jobs.submit(job, run_source_refresh)
+    except ShuttingDown:
+        source_scheduler.release(source['name'])
+        raise
+    return job
+
+source_scheduler = SourceScheduler(store, background, refresh_source,
+                                   poll_interval=app.config['SOURCE_POLL_INTERVAL'], owner=WORKER_ID)
+if app.config['SOURCE_SCHEDULER']:
+    source_scheduler.start()
+
+hls_relay = HLSRelay(
+    background,
+    os.path.join(app.config['UPLOAD_FOLDER'], 'relay'),
+    secret=app.config['RELAY_SECRET'] or load_secret(os.path.join(app.config['UPLOAD_FOLDER'], 'relay.key')),
+    memory_bytes=app.config['RELAY_MEMORY_BYTES'],
+    disk_bytes=app.config['RELAY_DISK_BYTES'],
+    allow_private=app.config['RELAY_ALLOW_PRIVATE'],
+)
+# Stream URLs found in a stored playlist, with when to look again, so the
+# reloads of a live playlist don't query the store every few seconds
+RELAY_URL_TTL = 600
+relay_urls = {}
+
+def relayable_url(url):
+    now = time.monotonic()
+    if relay_urls.get(url, 0) > now:
+        return True
+    if not store.has_channel_url(url):
+        return False
+    if len(relay_urls) > 10000:
+        relay_urls.clear()
+    relay_urls[url] = now + RELAY_URL_TTL
+    return True
+
+@app.errorhandler(RelayError)
+def relay_error(e):
+    return jsonify({'status': 'error', 'message': str(e)}), e.status
+
+def relay_playlist_response(url):
+    return Response(hls_relay.playlist(url), mimetype=PLAYLIST_CONTENT_TYPE, headers={'Cache-Control': 'no-cache'})
+
+def is_http_url(url) -> bool:
+    return bool(url) and url.startswith(('http://', 'https://'))
+
+def add_server_urls(channel):
+    """
+    Adds the URLs this server serves a stored channel under: relay_url for
+    HLS streams, when the relay is on, and logo_url for http(s) logos.
+    """
+    if app.config['RELAY_ENABLED'] and is_hls_url(channel.get('url') or ''):
+        channel['relay_url'] = f"/relay/index.m3u8?channel={channel['id']}"
+    if is_http_url(channel.get('logo')):
+        channel['logo_url'] = f"/logo/{channel['id']}"
+    return channel
+
+@app.route('/relay/index.m3u8')
+def relay_channel():
+    """
+    Plays a channel through the relay: ?channel=<id>, or ?url= with the stream URL of a stored channel.
+
+    Answers with the channel's playlist, rewritten so that everything it
+    references is fetched through the relay too.
+    """
+    if not app.config['RELAY_ENABLED']:
+        return jsonify({'status': 'error', 'message': 'The relay is disabled'}), 404
+    channel_id = request.args.get('channel', type=int)
+    url = store.channel_url(channel_id) if channel_id is not None else request.args.get('url', '')
+    if not url or not relayable_url(url):
+        return jsonify({'status': 'error', 'message': 'Channel not found'}), 404
+    return relay_playlist_response(url)
+
+@app.route('/relay/<token>/<path:name>')
+def relay(token, name):
+    """Serves a playlist or segment referenced by a relayed playlist; `name` is only there for players and logs."""
+    if not app.config['RELAY_ENABLED']:
+        return jsonify({'status': 'error', 'message': 'The relay is disabled'}), 404
+    resolved = hls_relay.resolve(token)
+    if resolved is None:
+        return jsonify({'status': 'error', 'message': 'Invalid relay URL signature'}), 403
+    kind, url, ttl = resolved
+    if kind == 'p':
+        return relay_playlist_response(url)
+    source, content_type, body, length = hls_relay.segment(url, ttl)
+    headers = {'Cache-Control': f'public, max-age={ttl}'}
+    if length is not None:
+        headers['Content-Length'] = str(length)
+    if source == 'disk':
+        body = wrap_file(request.environ, body)
+    # Segments still being downloaded are streamed to every viewer as the bytes arrive
+    return Response(body, content_type=content_type, headers=headers, direct_passthrough=source != 'memory')
+
+logo_cache = LogoCache(
+    store,
+    background,
+    os.path.join(app.config['UPLOAD_FOLDER'], 'logos'),
+    concurrency=app.config['LOGO_FETCH_CONCURRENCY'],
+    max_age=app.config['LOGO_MAX_AGE'],
+)
+
+async def run_logo_prefetch(job):
+    urls = await asyncio.to_thread(store.playlist_logos, job.params['playlist'])
+    job.total = len(urls)
+
+    def on_result(result):
+        job.add_result({key: result[key] for key in ('url', 'status', 'error', 'bytes')})
+
+    counts = await logo_cache.prefetch(urls, on_result=on_result)
+    # Logos of channels that were replaced by this ingest are no longer needed
+    removed = await asyncio.to_thread(logo_cache.prune)
+    return {'total': len(urls), **counts, 'removed_files': removed}
+
+def prefetch_logos(playlist):
+    """Starts a job fetching the logos of a playlist into the logo cache; returns it, or None when disabled."""
+    if not app.config['LOGO_PREFETCH']:
+        return None
+    job = Job('prefetch-logos', 0, {'playlist': playlist})
+    try:
+        jobs.submit(job, run_logo_prefetch)
+    except ShuttingDown:
+        return None
+    return job
+
+def logo_response(url):
+    """
+    Serves a cached logo (optionally ?size=<pixels> as a thumbnail, when Pillow is installed).
+
+    Responses carry the content digest as ETag and may be cached by browsers
+    for LOGO_CLIENT_MAX_AGE seconds, after which they revalidate cheaply. A
+    logo not cached yet is answered with a redirect to its origin right away.
+    """
+    if not is_http_url(url):
+        return jsonify({'status': 'error', 'message': 'Logo not available'}), 404
+    row = logo_cache.lookup(url)
+    if row is None:
+        # Not cached (yet): lookup() started fetching it, so send this browser to the origin meanwhile
+        response = redirect(url, 302)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    path = logo_cache.path_for(row['digest'])
+    content_type = row['content_type']
+    etag = row['digest'][:32]
+    size = request.args.get('size', type=int)
+    if size:
+        size = thumbnail_size(size)
+        thumbnail = logo_cache.thumbnail(row['digest'], size)
+        if thumbnail is not None:
+            path, content_type, etag = thumbnail, 'image/png', f'{etag}-{size}'
+    # send_file resolves relative paths against the app root, not the working directory
+    response = send_file(os.path.abspath(path), mimetype=content_type, etag=etag, max_age=app.config['LOGO_CLIENT_MAX_AGE'],
+                         conditional=True)
+    response.headers['Cache-Control'] += ', stale-while-revalidate=604800'
+    # SVG logos may contain scripts; they must not run with this origin's rights
+    response.headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+@app.route('/logo/<int:channel_id>')
+def channel_logo(channel_id):
+    """Serves the logo of a stored channel (by its id in /api/channels)."""
+    return logo_response(store.channel_logo(channel_id))
+
+@app.route('/logo')
+def logo():
+    """Serves a logo by ?url=, which must be the logo of a stored channel."""
+    url = request.args.get('url')
+    # Logos already in the cache are looked up by primary key; others are checked against the channels
+    if not url or (store.get_logo(url) is None and not store.has_channel_logo(url)):
+        return jsonify({'status': 'error', 'message': 'Unknown logo'}), 404
+    return logo_response(url)
+
+# Metrics, exposed on /metrics in the Prometheus text format. They are kept
+# per server process; Prometheus tells the workers apart by their instance.
+REQUEST_SECONDS = Histogram('iptv_http_request_duration_seconds', 'Time to handle HTTP requests, by route',
+                            ('method', 'route', 'status'))
+INGEST_STAGE_SECONDS = Histogram('iptv_ingest_stage_seconds', 'Time spent in each stage of playlist and guide ingests',
+                                 ('kind', 'stage'), buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+INGEST_ENTRIES = Counter('iptv_ingest_entries_total', 'Channels and programmes ingested', ('kind',))
+
+def cache_lookups():
+    counts = {}
+    for name, cache in (('response', response_cache), ('link_health', health_cache)):
+        counts[(name, 'hit')] = cache.hits
+        counts[(name, 'miss')] = cache.misses
+    return counts
+
+def cache_hit_ratios():
+    return {name: cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0
+            for name, cache in (('response', response_cache), ('link_health', health_cache))}
+
+def memory_usage():
+    usage = {'peak': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    try:
+        with open('/proc/self/statm') as f:
+            usage['resident'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    return usage
+
+def database_size():
+    return sum(os.path.getsize(path) for path in (store.path, f'{store.path}-wal') if os.path.exists(path))
+
+Counter('iptv_cache_lookups_total', 'Lookups of the in-memory caches', ('cache', 'result'), function=cache_lookups)
+Gauge('iptv_cache_hit_ratio', 'Share of cache lookups that were hits', ('cache',), function=cache_hit_ratios)
+Gauge('iptv_link_health_cache_entries', 'Link health results held in memory', function=lambda: health_cache.stats()['size'])
+Gauge('iptv_response_cache_bytes', 'Size of the cached API payloads, uncompressed',
+      function=lambda: sum(entry['bytes'] for entry in response_cache.stats()['entries'].values()))
+Gauge('iptv_epg_indexes', 'Programme indexes held in memory', function=lambda: len(epg_indexes))
+Gauge('iptv_jobs_active', 'Background jobs running in this process', function=lambda: len(jobs.active()))
+Gauge('iptv_process_memory_bytes', 'Resident memory of this process (peak: highest so far)', ('kind',),
+      function=memory_usage)
+Gauge('iptv_database_bytes', 'Size of the database file and its write-ahead log', function=database_size)
+Gauge('iptv_relay_cache_bytes', 'Segments cached by the HLS relay (disk: as last counted by this process)',
+      ('tier',), function=lambda: {tier: hls_relay.stats()[f'{tier}_bytes'] for tier in ('memory', 'disk')})
+Gauge('iptv_relay_segments_fetching', 'Segments the relay is downloading', function=lambda: hls_relay.stats()['segments_fetching'])
+Gauge('iptv_logo_cache_bytes', 'Size of the logo cache on disk, thumbnails included', function=lambda: logo_cache.stats()['bytes'])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if app.config['PROFILING'] and request.args.get('profile'):
+        g.profiler = SamplingProfiler().start()
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed responses are timed until their first byte
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_started,
+                            method=request.method, route=route, status=response.status_code)
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.stop()
+    header = (f"# {profiler.samples} samples over {profiler.duration * 1000:.1f} ms "
+              f"(status {response.status_code}); collapsed stacks for flamegraph.pl or speedscope\n")
+    return Response(header + profiler.collapsed(), mimetype='text/plain')
+
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+async def run_link_check(job):
+    channels = await asyncio.to_thread(store.get_channels, job.params['playlist'])
+    job.total = len(channels)
+    # Pick up the results other server processes checked since
+    await asyncio.to_thread(health_cache.refresh)
+    await link_checker.open()
+
+    def on_result(channel, result):
+        job.add_result({
+            'id': channel['id'],
+            'name': channel.get('name'),
+            'url': channel.get('url'),
+            **result
+        })
+
+    deep = job.params.get('deep', False)
+    results = await link_checker.check_many(channels, on_result=on_result,
+                                            use_cache=not job.params.get('refresh'), deep=deep)
+    
+    # Update the playlist with status (and stream metrics for deep probes)
+    if deep:
+        await asyncio.to_thread(store.set_probe_results, [(ch['id'], ch['status'], ch) for ch in results])
+    else:
+        await asyncio.to_thread(store.set_channel_statuses, [(ch['id'], ch['status']) for ch in results])
+    await asyncio.to_thread(health_cache.save)
+    
+    # Count dead/alive
+    dead = sum(1 for ch in results if ch.get('status') == 'dead')
+    return {
+        'total': len(results),
+        'alive': len(results) - dead,
+        'dead': dead
+    }
+
 @app.route('/api/check-links', methods=['POST'])
 def check_links():
     try:
         data = request.json
         playlist_name = data.get('playlist')
-        if not playlist_name or playlist_name not in playlists:
+        if not playlist_name or not store.has_playlist(playlist_name):
             return jsonify({'error': 'Playlist not found'}), 404
             
-        # Create a copy of channels to avoid modifying during iteration
-        channels = playlists[playlist_name]['channels'].copy()
-        
-        # Check links in parallel
-        async def check_channel(channel):
-            url = channel.get('url', '')
-            if not url:
-                return {**channel, 'status': 'dead'}
-                
-            try:
-                # For m3u8, check if the playlist is accessible
-                if url.endswith('.m3u8'):
-                    async with aiohttp.ClientSession() as session:
-                        async with session.head(url, timeout=5) as response:
-                            if response.status == 200:
-                                return {**channel, 'status': 'alive'}
-                            else:
-                                return {**channel, 'status': 'dead'}
-                # For direct streams, check if the URL is accessible
-                else:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.head(url, timeout=5) as response:
-                            if response.status in (200, 206):
-                                return {**channel, 'status': 'alive'}
-                            else:
-                                return {**channel, 'status': 'dead'}
-            except:
-                return {**channel, 'status': 'dead'}
-        
-        async def check_all():
-            tasks = [check_channel(channel) for channel in channels]
-            return await asyncio.gather(*tasks)
-            
-        # Run the async checks
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        results = loop.run_until_complete(check_all())
-        
-        # Update the playlist with status
-        playlists[playlist_name]['channels'] = results
-        
-        # Count dead/alive
-        dead_links = [ch for ch in results if ch.get('status') == 'dead']
+        params = {'playlist': playlist_name, 'refresh': bool(data.get('refresh')), 'deep': bool(data.get('deep'))}
+        job = Job('deep-probe' if params['deep'] else 'check-links', store.count_channels(playlist_name), params)
+        jobs.submit(job, run_link_check)
         
         return jsonify({
-            'total': len(results),
-            'alive': len(results) - len(dead_links),
-            'dead': len(dead_links),
-            'dead_links': dead_links
-        })
+            'job_id': job.id,
+            'status_url': f'/api/jobs/{job.id}',
+            'results_url': f'/api/jobs/{job.id}/results'
+        }), 202
         
+    except ShuttingDown:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/health-cache', methods=['GET', 'DELETE'])
+def link_health_cache_stats():
+    if request.method == 'DELETE':
+        health_cache.clear()
+        health_cache.save()
+    return jsonify({'status': 'success', 'cache': health_cache.stats()})
+
+@app.route('/api/response-cache', methods=['GET', 'DELETE'])
+def response_cache_stats():
+    if request.method == 'DELETE':
+        response_cache.invalidate()
+    return jsonify({'status': 'success', 'cache': response_cache.stats()})
+
+def source_summary(source, refreshing):
+    return {**source, 'refreshing': source['name'] in refreshing}
+
+@app.route('/api/sources', methods=['GET', 'POST'])
+def sources():
+    """
+    Lists the registered remote sources, or registers one (JSON: url, and optionally
+    name, kind 'playlist'/'epg', interval in seconds and enabled) and refreshes it right away.
+    """
+    if request.method == 'GET':
+        refreshing = source_scheduler.refreshing()
+        return jsonify({'status': 'success', 'sources': [source_summary(s, refreshing) for s in store.list_sources()]})
+
+    data = request.get_json(silent=True) or {}
+    url = (data.get('url') or '').strip()
+    if not url.startswith(('http://', 'https://')):
+        return jsonify({'status': 'error', 'message': 'A http(s) url is required'}), 400
+    kind = data.get('kind') or guess_kind(url)
+    if kind not in SOURCE_KINDS:
+        return jsonify({'status': 'error', 'message': f"kind must be one of {', '.join(SOURCE_KINDS)}"}), 400
+    try:
+        interval = max(int(data.get('interval') or app.config['SOURCE_REFRESH_INTERVAL']), 60)
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'interval must be a number of seconds'}), 400
+
+    name = source_name(url, data.get('name'))
+    store.upsert_source(name, kind, url, interval, enabled=data.get('enabled', True))
+    source = store.get_source(name)
+    job = refresh_source(source) if source['enabled'] else None
+    return jsonify({
+        'status': 'success',
+        'source': source_summary(source, source_scheduler.refreshing()),
+        'job_id': job.id if job else None,
+        'status_url': f'/api/jobs/{job.id}' if job else None
+    }), 201
+
+@app.route('/api/sources/<name>', methods=['DELETE'])
+def delete_source(name):
+    """Unregisters a source; what it last ingested stays available."""
+    if not store.delete_source(name):
+        return jsonify({'status': 'error', 'message': 'Source not found'}), 404
+    return jsonify({'status': 'success'})
+
+@app.route('/api/sources/<name>/refresh', methods=['POST'])
+def refresh_source_now(name):
+    """Refreshes a source now; force=true downloads it even if the server reports it unchanged."""
+    source = store.get_source(name)
+    if source is None:
+        return jsonify({'status': 'error', 'message': 'Source not found'}), 404
+    data = request.get_json(silent=True) or {}
+    job = refresh_source(source, force=bool(data.get('force')))
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Source is already being refreshed'}), 409
+    return jsonify({'job_id': job.id, 'status_url': f'/api/jobs/{job.id}'}), 202
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/api/jobs/<job_id>/results')
+def stream_job_results(job_id):
+    """Streams per-channel results as NDJSON, or as server-sent events if requested."""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    use_sse = request.accept_mimetypes.best == 'text/event-stream' or request.args.get('format') == 'sse'
+    start = request.args.get('offset', 0, type=int)
+
+    def generate():
+        for result in job.iter_results(start):
+            if result is None:
+                yield ': keep-alive\n\n' if use_sse else '\n'
+            elif use_sse:
+                yield f"data: {json.dumps(result)}\n\n"
+            else:
+                yield json.dumps(result) + '\n'
+        if use_sse:
+            yield f"event: done\ndata: {json.dumps(job.snapshot())}\n\n"
+
+    mimetype = 'text/event-stream' if use_sse else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/remove-dead-links', methods=['POST'])
 def remove_dead_links():
     try:
         data = request.json
         playlist_name = data.get('playlist')
-        if not playlist_name or playlist_name not in playlists:
+        if not playlist_name or not store.has_playlist(playlist_name):
             return jsonify({'error': 'Playlist not found'}), 404
             
         # Filter out dead links
-        original_count = len(playlists[playlist_name]['channels'])
-        playlists[playlist_name]['channels'] = [
-            ch for ch in playlists[playlist_name]['channels'] 
-            if ch.get('status') != 'dead'
-        ]
-        removed = original_count - len(playlists[playlist_name]['channels'])
+        removed = store.delete_channels_with_status(playlist_name, 'dead')
         
         return jsonify({
             'removed': removed,
-            'remaining': len(playlists[playlist_name]['channels'])
+            'remaining': store.count_channels(playlist_name)
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def build_epg_index(epg_key):
+    # The version is read first: a change committed while building triggers another rebuild
+    version = store.version(epg_source_version(epg_key))
+    index = EPGIndex(store.iter_programmes(epg_key, order_by_channel=True))
+    epg_indexes[epg_key] = (version, index)
+    return index
+
+def get_epg_index(epg_key):
+    """
+    Returns the EPGIndex of a source, building it from the store on first use after a cold start.
+
+    The index is also rebuilt when the source's version counter shows that
+    another server process has changed the source since.
+    """
+    cached = epg_indexes.get(epg_key)
+    if cached is None or cached[0] != store.version(epg_source_version(epg_key)):
+        return build_epg_index(epg_key)
+    return cached[1]
+
+def parse_time_param(value):
+    """
+    Converts a time query value to the stored UTC epoch seconds.
+
+    Accepts epoch seconds, XMLTV ('YYYYMMDDhhmmss', optionally followed by an
+    offset such as '+0100') and ISO-8601; times without an offset are UTC.
+
+    A bare run of 8-14 digits starting with '20' is an XMLTV time, possibly
+    truncated to the date, hour or minute ('20260105', '2026010512'); other
+    digits, up to 10 of them, are epoch seconds (which only start with '20'
+    from 2033 on).
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit() and not (8 <= len(value) <= 14 and value.startswith('20')):
+        if len(value) > 10:
+            raise ValueError(f"invalid time {value!r}")
+        return int(value)
+    if value[:8].isdigit():
+        seconds = parse_xmltv_time(value)
+        if seconds is None:
+            raise ValueError(f"invalid XMLTV time {value!r}")
+        return seconds
+    return parse_iso_time(value)
+
+def program_summary(program):
+    return {
+        'title': program.title,
+        'start': format_timestamp(program.start),
+        'stop': format_timestamp(program.stop),
+        'description': program.description
+    }
+
 @app.route('/api/epg')
 def get_epg():
     try:
-        epg_json_path = os.path.join(app.config['UPLOAD_FOLDER'], 'epg_data.json')
-        data = None
-        if epg_data:
-            data = epg_data
-        elif os.path.exists(epg_json_path):
-            with open(epg_json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        if not data:
+        sources = store.epg_sources()
+        if not sources:
             return jsonify({'status': 'error','message': 'No EPG data available. Please upload an EPG file first.'}), 404
-        epg_key = next(iter(data.keys())) if data else None
-        epg = data[epg_key] if epg_key else {}
+        epg_key = sources[0]['name']
+        index = get_epg_index(epg_key)
+
+        # Optional filters: channel=a,b (or repeated), from=/to= window, now=1 for now/next
+        channel_ids = [c for value in request.args.getlist('channel') for c in value.split(',') if c]
+        try:
+            window_start = parse_time_param(request.args.get('from'))
+            window_end = parse_time_param(request.args.get('to'))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': f"Invalid time parameter: {str(e)}"}), 400
+        now_only = request.args.get('now') == '1'
+
+        if not channel_ids:
+            channel_ids = index.channels()
         response = {'status': 'success', 'data': {'channels': {}, 'programs': {}}}
-        for program in epg.get('programs', []):
-            channel_id = program.get('channel')
-            if not channel_id:
+        if now_only:
+            at = window_start if window_start is not None else int(time.time())
+            response['data']['now'] = {}
+            response['data']['next'] = {}
+        for channel_id in channel_ids:
+            if channel_id not in index:
                 continue
-            if channel_id not in response['data']['channels']:
-                response['data']['channels'][channel_id] = {'id': channel_id, 'name': channel_id}
-            if channel_id not in response['data']['programs']:
-                response['data']['programs'][channel_id] = []
-            response['data']['programs'][channel_id].append({
-                'title': program.get('title', 'No Title'),
-                'start': program.get('start', ''),
-                'stop': program.get('stop', ''),
-                'description': program.get('description', '')
-            })
+            response['data']['channels'][channel_id] = {'id': channel_id, 'name': channel_id}
+            if now_only:
+                current, upcoming = index.now_next(channel_id, at)
+                programs = [p for p in (current, upcoming) if p]
+                response['data']['now'][channel_id] = program_summary(current) if current else None
+                response['data']['next'][channel_id] = program_summary(upcoming) if upcoming else None
+            else:
+                programs = index.window(channel_id, window_start, window_end)
+            response['data']['programs'][channel_id] = [program_summary(p) for p in programs]
         return jsonify(response)
     except Exception as e:
         error_msg = f"Error loading EPG data: {str(e)}"
         print(error_msg)
         return jsonify({'status': 'error','message': error_msg}), 500
 
+@app.route('/api/epg/matches')
+def get_epg_matches():
+    """Lists which guide channel each channel of a playlist was linked to, and how."""
+    playlist_name = request.args.get('playlist')
+    if not playlist_name or not store.has_playlist(playlist_name):
+        return jsonify({'status': 'error', 'message': 'Playlist not found'}), 404
+    matches = store.epg_matches(playlist_name)
+    methods = {}
+    for match in matches:
+        methods[match['method']] = methods.get(match['method'], 0) + 1
+    return jsonify({
+        'status': 'success',
+        'total_channels': store.count_channels(playlist_name),
+        'matched': len(matches),
+        'methods': methods,
+        'matches': matches
+    })
+
+@app.route('/api/now-playing')
+def get_now_playing():
+    """Returns the current and next programme of every guide-linked channel of a playlist."""
+    playlist_name = request.args.get('playlist')
+    if not playlist_name or not store.has_playlist(playlist_name):
+        return jsonify({'status': 'error', 'message': 'Playlist not found'}), 404
+    try:
+        at = parse_time_param(request.args.get('at'))
+        if at is None:
+            at = int(time.time())
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f"Invalid time parameter: {str(e)}"}), 400
+    return jsonify({'status': 'success', 'at': format_timestamp(at), 'channels': store.now_playing(playlist_name, at)})
+
+# Kinds of results /api/search can return
+SEARCH_TYPES = ('channels', 'programmes')
+
+@app.route('/api/search')
+def search():
+    """
+    Ranked full-text search over channel names and groups and programme titles, descriptions and categories.
+
+    q= is matched word by word, the last word as a prefix, so it can be called
+    on every keystroke. Optional: type=channels|programmes (default both),
+    playlist= and source= to narrow the results, from= to only return
+    programmes airing at or after a time, and limit= (max 100) per type.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'status': 'error', 'message': 'Missing search query (q=)'}), 400
+    kinds = list_param('type') or list(SEARCH_TYPES)
+    if any(kind not in SEARCH_TYPES for kind in kinds):
+        return jsonify({'status': 'error', 'message': f"type must be one of {', '.join(SEARCH_TYPES)}"}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    try:
+        after = parse_time_param(request.args.get('from'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f"Invalid time parameter: {str(e)}"}), 400
+
+    response = {'status': 'success', 'query': query}
+    if 'channels' in kinds:
+        response['channels'] = store.search_channels(query, playlists=list_param('playlist'), limit=limit)
+    if 'programmes' in kinds:
+        response['programmes'] = store.search_programmes(query, sources=list_param('source'), after=after,
+                                                         limit=limit)
+    return jsonify(response)
+
+@app.route('/api/epg/ingest', methods=['POST'])
+def ingest_epg_files():
+    """
+    Ingests several XMLTV guides at once (e.g. regional guides) as one merged EPG source.
+
+    Takes multipart 'file' parts, in priority order, and an optional 'name'
+    for the merged source. The guides are parsed in parallel and overlapping
+    programmes are de-duplicated per channel.
+    """
+    files = [f for f in request.files.getlist('file') if f and f.filename]
+    if not files:
+        return jsonify({'status': 'error', 'message': 'No files provided'}), 400
+    filepaths = []
+    for file in files:
+        filename = secure_filename(file.filename)
+        if not filename.lower().endswith(('.xml', '.xml.gz')):
+            return jsonify({'status': 'error', 'message': f'{filename} is not an .xml or .xml.gz guide'}), 400
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        file.save(filepath)
+        filepaths.append(filepath)
+
+    name = secure_filename(request.form.get('name', '')) or 'merged.xml'
+    result = process_epg_sources(filepaths, name)
+    if result.get('status') == 'error':
+        return jsonify(result), 400
+    return jsonify({'type': 'epg', **result})
+
+@app.route('/api/epg/progress')
+def get_epg_progress():
+    ingests = {}
+    for entry in sorted(os.scandir(PROGRESS_FOLDER), key=lambda entry: entry.stat().st_mtime):
+        if entry.name.endswith('.json'):
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    ingests[entry.name[:-len('.json')]] = json.load(f)
+            except (OSError, ValueError):
+                continue
+    return jsonify({'status': 'success', 'ingests': ingests})
+
 # New endpoint for full EPG browsing (channels and all programs)
 @app.route('/api/epg/full')
 def get_epg_full():
     try:
-        epg_json_path = os.path.join(app.config['UPLOAD_FOLDER'], 'epg_data.json')
-        data = None
-        if epg_data:
-            data = epg_data
-        elif os.path.exists(epg_json_path):
-            with open(epg_json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        if not data:
+        if not store.epg_sources():
             return jsonify({'status': 'error','message': 'No EPG data available. Please upload an EPG file first.'}), 404
-        epg_key = next(iter(data.keys())) if data else None
-        epg = data[epg_key] if epg_key else {}
-        # Return all channels and programs as-is for browsing
-        return jsonify({'status': 'success','channels': epg.get('channels', []),'programs': epg.get('programs', [])})
+        return cached_json_response('epg:full', EPG_VERSION, build_epg_full_payload)
     except Exception as e:
         error_msg = f"Error loading full EPG data: {str(e)}"
         print(error_msg)
         return jsonify({'status': 'error','message': error_msg}), 500
 
+def update_epg_matches(playlists=None):
+    """Links the channels of `playlists` (all by default) to the guide; runs after every upload."""
+    matcher = EPGMatcher(store.all_epg_channels())
+    for name in playlists or store.playlist_names():
+        store.replace_epg_matches(name, matcher.match_all(store.get_channels(name)) if len(matcher) else ())
+
 def process_m3u(filepath, filename):
     try:
-        playlists[filename] = {
-            'name': filename,
-            'channels': []
-        }
-        
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()
-            
-        channel = {}
-        for line in lines:
-            line = line.strip()
-            if line.startswith('#EXTINF'):
-                # Parse channel info from EXTINF line
-                # Example: #EXTINF:-1 tvg-id="" tvg-name="24/7 The Simpsons 1" tvg-logo="https://i.imgur.com/XfkbTrU.png" group-title="General",24/7 The Simpsons 1
-                channel = {}
-                # Extract channel name (after the last comma)
-                if ',' in line:
-                    channel['name'] = line.split(',')[-1].strip()
-                else:
-                    channel['name'] = 'Unnamed Channel'
-                
-                # Try to extract logo if available
-                if 'tvg-logo=' in line:
-                    logo_start = line.find('tvg-logo=') + 10  # +10 to skip 'tvg-logo="'
-                    logo_end = line.find('"', logo_start)
-                    if logo_end > logo_start:
-                        channel['logo'] = line[logo_start:logo_end]
-                
-                # Try to extract group title if available
-                if 'group-title=' in line:
-                    group_start = line.find('group-title=') + 13  # +13 to skip 'group-title="'
-                    group_end = line.find('"', group_start)
-                    if group_end > group_start:
-                        channel['group'] = line[group_start:group_end]
-            
-            elif line and not line.startswith('#') and not line.startswith('http'):
-                # Skip empty lines and comments, but handle non-URL lines (like group names)
-                continue
-                
-            elif line.startswith('http'):
-                # This is a stream URL, add the channel
-                channel['url'] = line.strip()
-                if 'name' not in channel:
-                    channel['name'] = f'Channel {len(playlists[filename]["channels"]) + 1}'
-                playlists[filename]['channels'].append(channel)
-                channel = {}
-        
-        # Save EPG data to a JSON file for persistence
-        playlists_json_path = os.path.join(app.config['UPLOAD_FOLDER'], 'playlists.json')
-        with open(playlists_json_path, 'w', encoding='utf-8') as f:
-            json.dump(playlists, f, ensure_ascii=False, indent=2)
+        with open(filepath, 'rb') as f:
+            return ingest_m3u(f, filename)
+    except OSError as e:
+        print(f"Error reading M3U file: {e}")
+        return None
+
+def ingest_m3u(fileobj, filename):
+    try:
+        # Entries are parsed once, while the file is read line by line, and
+        # streamed into the store as compact Channel records. Every URL scheme
+        # is kept (udp://, rtmp://, ...), not only http(s). Gzip-compressed
+        # playlists (e.g. fetched with gzip content-encoding) are decompressed
+        # on the fly.
+        timer = StageTimer(INGEST_STAGE_SECONDS, kind='m3u')
+        parser = M3UParser()
+        channels = timer.iterate((Channel.from_stream(stream)
+                                  for stream in parser.iter_parse(open_decompressed(fileobj))), 'parse')
+        # Only this playlist's rows are rewritten; the #EXTM3U attributes (x-tvg-url, ...) are kept with it
+        with timer.stage('persist', excluding=('parse',)):
+            total = store.replace_playlist(filename, channels, parser.header_attributes)
+        with timer.stage('match'):
+            update_epg_matches([filename])
+        with timer.stage('cache'):
+            warm_response_cache(CHANNELS_VERSION)
+        INGEST_ENTRIES.inc(total, kind='m3u')
+        # Logos are fetched in the background, so the ingest doesn't wait for their origins
+        logo_job = prefetch_logos(filename)
         
-        return playlists[filename]
+        return {'name': filename, 'total_channels': total, 'attributes': dict(parser.header_attributes),
+                'timings': timer.observe(), 'logo_job': logo_job.id if logo_job else None}
                 
     except Exception as e:
         print(f"Error processing M3U file: {e}")
@@ -323,112 +1184,58 @@ def process_m3u(filepath, filename):
         traceback.print_exc()
         return None
 
-def process_epg(filepath, filename):
+def progress_recorder(name):
+    path = os.path.join(PROGRESS_FOLDER, f'{secure_filename(name) or "ingest"}.json')
+
+    def record_progress(snapshot):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+    return record_progress
+
+def process_epg(filepath, filename, mode=None):
+    # Large plain-XML guides are parsed in chunks on every core
+    return ingest_epg(epg_pipeline.iter_file(filepath, progress_callback=progress_recorder(filename)),
+                      filename, mode=mode)
+
+def ingest_epg(events, filename, mode=None):
     try:
-        # Handle gzipped XML files
-        if filepath.endswith('.gz'):
-            import gzip
-            with gzip.open(filepath, 'rb') as f:
-                tree = ET.parse(f)
-        else:
-            tree = ET.parse(filepath)
-            
-        root = tree.getroot()
-        
-        # Basic EPG processing
-        programs = []
-        channels = {}
-        
-        # First, extract channel information if available
-        for channel in root.findall('.//channel'):
-            try:
-                channel_id = channel.get('id')
-                if not channel_id:
-                    continue
-                    
-                # Get display name (can be in a <display-name> tag)
-                display_name = channel.findtext('display-name', '').strip()
-                if not display_name:
-                    display_name = channel_id
-                    
-                channels[channel_id] = {
-                    'id': channel_id,
-                    'name': display_name,
-                    'icon': channel.findtext('icon/src', '')  # Some EPGs include channel icons
-                }
-            except Exception as e:
-                print(f"Error parsing channel: {e}")
-                continue
-        
-        # Then parse programs
-        for program in root.findall('.//programme'):
-            try:
-                channel_id = program.get('channel', '')
-                if not channel_id:
-                    continue
-                    
-                # If we don't have channel info yet, add a basic entry
-                if channel_id not in channels:
-                    channels[channel_id] = {
-                        'id': channel_id,
-                        'name': channel_id,
-                        'icon': ''
-                    }
-                
-                # Parse start and stop times
-                start_time = program.get('start', '')
-                stop_time = program.get('stop', '')
-                
-                # Try to parse the time if it's in a standard format
-                # This helps with sorting and display in the frontend
-                from datetime import datetime
-                try:
-                    if start_time and len(start_time) >= 14:  # At least YYYYMMDDHHMMSS
-                        start_dt = datetime.strptime(start_time[:14], '%Y%m%d%H%M%S')
-                        start_time = start_dt.isoformat()
-                    if stop_time and len(stop_time) >= 14:
-                        stop_dt = datetime.strptime(stop_time[:14], '%Y%m%d%H%M%S')
-                        stop_time = stop_dt.isoformat()
-                except:
-                    pass  # If parsing fails, keep the original string
-                
-                program_data = {
-                    'start': start_time,
-                    'stop': stop_time,
-                    'channel': channel_id,
-                    'title': program.findtext('title', 'No Title').strip(),
-                    'description': program.findtext('desc', '').strip(),
-                    'category': program.findtext('category', '').strip(),
-                    'episode': program.findtext('episode-num', '').strip()
-                }
-                programs.append(program_data)
-            except Exception as e:
-                print(f"Error parsing program: {e}")
-                continue
-        
-        # Sort programs by start time
-        programs.sort(key=lambda x: x.get('start', ''))
-        
-        # Store the EPG data with channels and programs
-        epg_data[filename] = {
-            'name': filename,
-            'channels': list(channels.values()),
-            'programs': programs,
-            'total_programs': len(programs),
-            'total_channels': len(channels),
-            'last_updated': datetime.now().isoformat()
-        }
-        
-        # Save EPG data to a JSON file for persistence
-        epg_json_path = os.path.join(app.config['UPLOAD_FOLDER'], 'epg_data.json')
-        with open(epg_json_path, 'w', encoding='utf-8') as f:
-            json.dump(epg_data, f, ensure_ascii=False, indent=2)
+        # Stream the guide element by element (gzip is detected automatically)
+        # straight into the store, so neither the XML tree nor the programme
+        # list is ever held in memory.
+        # A refresh of a known guide only writes what changed and prunes expired programmes
+        incremental = mode != 'replace' and store.has_epg_source(filename)
+        # Reading and parsing are timed together as 'parse', as the store pulls events from the parser
+        timer = StageTimer(INGEST_STAGE_SECONDS, kind='epg')
+        events = timer.iterate(events, 'parse')
+        with timer.stage('persist', excluding=('parse',)):
+            if incremental:
+                counts = store.merge_epg(filename, events, retention_hours=app.config['EPG_RETENTION_HOURS'])
+                changed = any(counts['changes'][key] for key in ('inserted', 'updated', 'deleted', 'pruned', 'channels'))
+            else:
+                counts = store.replace_epg(filename, events)
+                changed = True
+        if changed or filename not in epg_indexes:
+            with timer.stage('index'):
+                build_epg_index(filename)
+        if changed:
+            with timer.stage('match'):
+                update_epg_matches()
+            with timer.stage('cache'):
+                warm_response_cache(EPG_VERSION)
+        INGEST_ENTRIES.inc(counts['programs_count'], kind='epg')
             
         return {
             'status': 'success', 
             'filename': filename, 
-            'programs_count': len(programs),
-            'channels_count': len(channels)
+            'mode': 'incremental' if incremental else 'replace',
+            'programs_count': counts['programs_count'],
+            'channels_count': counts['channels_count'],
+            'changes': counts.get('changes'),
+            # The guide ended before the retention window (an archived or lagging feed)
+            'stale': counts.get('stale', False),
+            'timings': timer.observe()
         }
         
     except ET.ParseError as e:
@@ -440,5 +1247,73 @@ def process_epg(filepath, filename):
         print(error_msg)
         return {'status': 'error', 'message': error_msg}
 
+def process_epg_sources(filepaths, name):
+    """
+    Parses several guides in parallel and stores them merged as one EPG source called `name`.
+
+    Guides listed first take precedence where their schedules overlap.
+    """
+    try:
+        events, summary = epg_pipeline.ingest(filepaths, progress_callback=progress_recorder(name))
+        counts = store.replace_epg(name, events)
+        build_epg_index(name)
+        update_epg_matches()
+        warm_response_cache(EPG_VERSION)
+
+        return {
+            'status': 'success',
+            'filename': name,
+            'programs_count': counts['programs_count'],
+            'channels_count': counts['channels_count'],
+            **summary
+        }
+
+    except ET.ParseError as e:
+        error_msg = f"Invalid XML file: {str(e)}"
+        print(error_msg)
+        return {'status': 'error', 'message': error_msg}
+    except Exception as e:
+        error_msg = f"Error processing EPG files: {str(e)}"
+        print(error_msg)
+        return {'status': 'error', 'message': error_msg}
+
+@app.errorhandler(ShuttingDown)
+def shutting_down(e):
+    return jsonify({'status': 'error', 'message': str(e)}), 503, {'Retry-After': '5'}
+
+_shut_down = False
+
+def shutdown(timeout=None):
+    """
+    Stops this process's background work gracefully.
+
+    New jobs are refused, running link checks and source refreshes get up to
+    SHUTDOWN_DRAIN_TIMEOUT seconds to finish (and are cancelled after that),
+    then the shared HTTP sessions are closed, the link health cache is saved
+    and the background event loop is stopped. Runs at most once; it is called
+    by the gunicorn worker_exit hook (see gunicorn.conf.py) and at exit.
+    """
+    global _shut_down
+    if _shut_down:
+        return
+    _shut_down = True
+    if timeout is None:
+        timeout = app.config['SHUTDOWN_DRAIN_TIMEOUT']
+    source_scheduler.stop()
+    active = len(jobs.active())
+    cancelled = jobs.drain(timeout)
+    if active:
+        print(f"Drained {active - len(cancelled)} background jobs, cancelled {len(cancelled)}")
+    for client in (link_checker, source_fetcher, hls_relay, logo_cache):
+        try:
+            background.submit(client.close()).result(5)
+        except Exception as e:
+            print(f"Error closing HTTP session: {e}")
+    health_cache.save()
+    background.stop(5)
+
+atexit.register(shutdown)
+
 if __name__ == '__main__':
+    # Development server; see gunicorn.conf.py for production serving
     app.run(debug=True)
@@ -0,0 +1,149 @@
+"""
+Synthetic M3U playlists and XMLTV guides for the benchmarks.
+
+Channels are derived from the bundled playlist.m3u (names, groups, logos,
+tvg-ids and attributes), repeated with numbered variants to reach the
+requested size, so the generated files look like real provider playlists.
+Guides cover the generated channels' tvg-ids with hourly-ish programmes in
+a mix of timezone offsets. Output is deterministic for a given seed.
+
+    python benchmarks/generate.py --entries 100000 --out benchmarks/data
+"""
+import argparse
+import gzip
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape, quoteattr
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from m3u_parser import M3UParser  # noqa: E402
+
+SEED_PLAYLIST = os.path.join(ROOT, 'playlist.m3u')
+# Guides start here, so generated files don't depend on the current date
+GUIDE_START = datetime(2026, 1, 1)
+OFFSETS = ('+0000', '+0100', '+0200', '-0500', '+0530')
+WORDS = ('news', 'live', 'world', 'sport', 'morning', 'show', 'movie', 'night', 'weather', 'music', 'kids',
+         'documentary', 'report', 'special', 'classic', 'family', 'business', 'magazine', 'talk', 'series')
+CATEGORIES = ('News', 'Sports', 'Movies', 'Kids', 'Documentary', 'Music', 'Entertainment', 'Series')
+
+
+def load_seed_channels(path: str = SEED_PLAYLIST) -> list:
+    """Returns the streams of the seed playlist (see M3UParser.parse)."""
+    with open(path, 'rb') as f:
+        return list(M3UParser().iter_parse(f))
+
+
+def synthetic_channels(count: int, seed_channels: list, stream_base: str = None) -> list:
+    """
+    Returns `count` channel dicts (name, tvg_id, logo, group, url, attributes) built from the seed channels.
+
+    The first pass uses the seed channels as they are; later passes add a
+    numbered variant suffix to names and ids. With `stream_base`
+    (e.g. 'http://127.0.0.1:8081'), URLs point at the benchmark stub server
+    instead of the original origins.
+    """
+    channels = []
+    for i in range(count):
+        source = seed_channels[i % len(seed_channels)]
+        variant = i // len(seed_channels)
+        name = source['name'] or source['tvg_name'] or f'Channel {i}'
+        tvg_id = source['tvg_id'] or f'channel{i}.xx'
+        if variant:
+            name = f'{name} {variant + 1}'
+            base, _, country = tvg_id.partition('.')
+            tvg_id = f'{base}{variant + 1}.{country}' if country else f'{tvg_id}{variant + 1}'
+        url = f'{stream_base}/live/{i}/index.m3u8' if stream_base else source['url']
+        channels.append({
+            'name': name,
+            'tvg_id': tvg_id,
+            'logo': source['tvg_logo'],
+            'group': source['group_title'],
+            'url': url,
+            'attributes': source.get('attributes') or {},
+        })
+    return channels
+
+
+def write_m3u(path: str, channels: list):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('#EXTM3U\n')
+        for channel in channels:
+            attributes = {'tvg-id': channel['tvg_id'], 'tvg-logo': channel['logo'],
+                          'group-title': channel['group'], **channel['attributes']}
+            attrs = ' '.join(f'{key}="{value}"' for key, value in attributes.items() if value)
+            f.write(f"#EXTINF:-1 {attrs},{channel['name']}\n{channel['url']}\n")
+
+
+def write_xmltv(path: str, channels: list, programmes: int, seed: int = 0):
+    """
+    Writes a guide with `programmes` programmes spread over `channels` (gzip-compressed if `path` ends in .gz).
+
+    Every channel gets a contiguous schedule of 30 to 120 minute programmes;
+    each channel uses one of a few timezone offsets.
+    """
+    rng = random.Random(seed)
+    per_channel, extra = divmod(programmes, max(len(channels), 1))
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<tv generator-info-name="iptv-benchmarks">\n')
+        for channel in channels:
+            f.write(f"<channel id={quoteattr(channel['tvg_id'])}><display-name>{escape(channel['name'])}"
+                    f"</display-name><icon src={quoteattr(channel['logo'] or '')}/></channel>\n")
+        for index, channel in enumerate(channels):
+            offset = OFFSETS[index % len(OFFSETS)]
+            start = GUIDE_START
+            channel_id = quoteattr(channel['tvg_id'])
+            for number in range(per_channel + (index < extra)):
+                stop = start + timedelta(minutes=rng.choice((30, 60, 60, 90, 120)))
+                title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+                desc = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 30)))
+                f.write(f'<programme start="{start:%Y%m%d%H%M%S} {offset}" stop="{stop:%Y%m%d%H%M%S} {offset}" '
+                        f'channel={channel_id}><title>{title}</title><desc>{desc}</desc>'
+                        f'<category>{rng.choice(CATEGORIES)}</category>'
+                        f'<episode-num system="onscreen">E{number + 1}</episode-num></programme>\n')
+                start = stop
+        f.write('</tv>\n')
+
+
+def generate(entries: int, out: str, seed: int = 0, stream_base: str = None, gzip_guide: bool = False) -> dict:
+    """
+    Writes playlist-<entries>.m3u and guide-<entries>.xml(.gz) into `out` and returns their paths.
+
+    The playlist has `entries` channels; the guide has `entries` programmes
+    over one channel per 24 programmes (at least one, at most the playlist's).
+    """
+    os.makedirs(out, exist_ok=True)
+    channels = synthetic_channels(entries, load_seed_channels(), stream_base)
+    playlist = os.path.join(out, f'playlist-{entries}.m3u')
+    write_m3u(playlist, channels)
+    guide = os.path.join(out, f"guide-{entries}.xml{'.gz' if gzip_guide else ''}")
+    write_xmltv(guide, channels[:max(entries // 24, 1)], entries, seed)
+    return {'playlist': playlist, 'guide': guide}
+
+
+def parse_size(value: str) -> int:
+    """'10k' -> 10000, '1M' -> 1000000."""
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * multiplier)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', default='10k', help='channels and programmes per file, e.g. 10k, 100k, 1M')
+    parser.add_argument('--out', default=os.path.join(ROOT, 'benchmarks', 'data'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stream-base', help='point stream URLs at this server (e.g. the stub server)')
+    parser.add_argument('--gzip', action='store_true', help='gzip-compress the guide')
+    args = parser.parse_args()
+    paths = generate(parse_size(args.entries), args.out, args.seed, args.stream_base, args.gzip)
+    for path in paths.values():
+        print(f"{path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
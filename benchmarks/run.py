@@ -0,0 +1,321 @@
+"""
+Benchmarks for playlist/guide parsing and ingest and for the API hot paths.
+
+    python benchmarks/run.py                         # 10k entries, all suites
+    python benchmarks/run.py --scale 10k,100k,1M --suite ingest
+    python benchmarks/run.py --save-baseline         # record the current numbers
+
+Suites:
+  parse   M3UParser.parse and XMLTVParser over generated files
+  ingest  process_m3u and process_epg into a fresh store: throughput and peak RSS
+  api     latency percentiles of /api/channels, /api/epg and /api/check-links,
+          the latter against a local stub stream server (see stub_server.py)
+
+Every benchmark runs in a fresh process (and a scratch working directory, so
+the app's uploads folder and database start empty). Results are compared with
+benchmarks/baselines.json; a metric more than --tolerance worse than its
+baseline is reported as a regression and makes the run exit with status 1.
+Timings are only comparable between runs on the same machine.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from generate import generate, parse_size, synthetic_channels, load_seed_channels, write_m3u  # noqa: E402
+
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baselines.json')
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+SUITES = {
+    'parse': ('parse_m3u', 'parse_xmltv'),
+    'ingest': ('process_m3u', 'process_epg'),
+    'api': ('endpoints',),
+}
+# Requests per endpoint in the api suite, and link-check runs
+API_REQUESTS = 50
+CHECK_RUNS = 3
+# Link checks go to the stub server, so their count is capped independently of the scale
+MAX_CHECKED_CHANNELS = 5000
+STUB_DELAY = 0.02
+RESULT_PREFIX = 'RESULT '
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process and its finished children (e.g. EPG parse workers), in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(max(own, children) / scale, 1)
+
+
+def percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+
+    def at(fraction):
+        return round(samples[min(int(fraction * len(samples)), len(samples) - 1)] * 1000, 2)
+    return {'p50_ms': at(0.5), 'p90_ms': at(0.9), 'p99_ms': at(0.99)}
+
+
+def timed(entries: int, run) -> dict:
+    """Runs `run()` once and returns its duration, throughput and the RSS it added."""
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - started
+    peak = peak_rss_mb()
+    return {
+        'seconds': round(seconds, 3),
+        'entries_per_sec': round(entries / seconds),
+        'peak_rss_mb': peak,
+        'rss_growth_mb': round(peak - rss_before, 1),
+    }
+
+
+# Benchmarks, each run by a child process (see run_child)
+
+def bench_parse_m3u(files: dict, entries: int) -> dict:
+    from m3u_parser import M3UParser
+    with open(files['playlist'], 'r', encoding='utf-8') as f:
+        content = f.read()
+    return timed(entries, lambda: M3UParser().parse(content))
+
+
+def bench_parse_xmltv(files: dict, entries: int) -> dict:
+    from epg_parser import XMLTVParser
+
+    def run():
+        for _ in XMLTVParser().parse_file(files['guide']):
+            pass
+    return timed(entries, run)
+
+
+def bench_process_m3u(files: dict, entries: int) -> dict:
+    import app
+    # Logos of the generated channels point at real CDNs; fetching them isn't part of the ingest
+    app.app.config['LOGO_PREFETCH'] = False
+    result = {}
+
+    def run():
+        result.update(app.process_m3u(files['playlist'], 'playlist.m3u') or {})
+    metrics = timed(entries, run)
+    assert result.get('total_channels') == entries, result
+    return metrics
+
+
+def bench_process_epg(files: dict, entries: int) -> dict:
+    import app
+    result = {}
+
+    def run():
+        result.update(app.process_epg(files['guide'], 'guide.xml'))
+    metrics = timed(entries, run)
+    assert result.get('programs_count') == entries, result
+    return metrics
+
+
+def bench_endpoints(files: dict, entries: int) -> dict:
+    import threading
+
+    import requests
+    from werkzeug.serving import make_server
+
+    import app
+    from stub_server import StubServer
+
+    app.app.config['LOGO_PREFETCH'] = False
+
+    stub = StubServer(delay=STUB_DELAY)
+    stub_url = stub.start()
+    checked = os.path.join(os.getcwd(), 'checked.m3u')
+    write_m3u(checked, synthetic_channels(min(entries, MAX_CHECKED_CHANNELS), load_seed_channels(), stub_url))
+    app.process_m3u(files['playlist'], 'playlist.m3u')
+    app.process_m3u(checked, 'checked.m3u')
+    app.process_epg(files['guide'], 'guide.xml')
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    session = requests.Session()
+
+    def latencies(path):
+        samples = []
+        for _ in range(API_REQUESTS):
+            started = time.perf_counter()
+            response = session.get(base + path)
+            response.raise_for_status()
+            samples.append(time.perf_counter() - started)
+        return percentiles(samples)
+
+    metrics = {
+        'channels': latencies('/api/channels'),
+        'channels_page': latencies('/api/channels?limit=100&offset=100'),
+        'epg': latencies('/api/epg'),
+        'epg_now': latencies('/api/epg?now=1&from=20260101120000'),
+    }
+
+    posts = []
+    durations = []
+    for _ in range(CHECK_RUNS):
+        started = time.perf_counter()
+        response = session.post(base + '/api/check-links', json={'playlist': 'checked.m3u', 'refresh': True})
+        posts.append(time.perf_counter() - started)
+        job_id = response.json()['job_id']
+        while session.get(f'{base}/api/jobs/{job_id}').json()['state'] not in ('done', 'failed'):
+            time.sleep(0.05)
+        durations.append(time.perf_counter() - started)
+    checks = min(entries, MAX_CHECKED_CHANNELS)
+    metrics['check_links'] = {
+        **percentiles(posts),
+        'job_p50_ms': percentiles(durations)['p50_ms'],
+        'checks_per_sec': round(checks / sorted(durations)[len(durations) // 2]),
+    }
+    metrics['peak_rss_mb'] = peak_rss_mb()
+    server.shutdown()
+    stub.stop()
+    return metrics
+
+
+BENCHMARKS = {
+    'parse_m3u': bench_parse_m3u,
+    'parse_xmltv': bench_parse_xmltv,
+    'process_m3u': bench_process_m3u,
+    'process_epg': bench_process_epg,
+    'endpoints': bench_endpoints,
+}
+
+
+def run_child(name: str, files: dict, entries: int):
+    metrics = BENCHMARKS[name](files, entries)
+    print(RESULT_PREFIX + json.dumps(metrics), flush=True)
+
+
+def run_benchmark(name: str, files: dict, entries: int) -> dict:
+    command = [sys.executable, os.path.abspath(__file__), '--child', name, '--files', json.dumps(files),
+               '--entries-count', str(entries)]
+    with tempfile.TemporaryDirectory(prefix='iptv-bench-') as workdir:
+        completed = subprocess.run(command, capture_output=True, text=True, cwd=workdir)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Benchmark {name} failed:\n{completed.stderr[-4000:]}")
+
+
+# Baselines
+
+def flatten(metrics: dict, prefix: str = '') -> dict:
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith(('_per_sec', 'rps'))
+
+
+def best_of(runs: list) -> dict:
+    """Combines the metrics of repeated runs, keeping the best value of each."""
+    best = {}
+    for key, value in runs[0].items():
+        values = [run[key] for run in runs]
+        if isinstance(value, dict):
+            best[key] = best_of(values)
+        else:
+            best[key] = max(values) if higher_is_better(key) else min(values)
+    return best
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Prints every metric next to its baseline and returns the ones that regressed beyond `tolerance`."""
+    regressions = []
+    for name, metrics in results.items():
+        base = flatten(baseline.get(name, {}))
+        for metric, value in flatten(metrics).items():
+            reference = base.get(metric)
+            if not reference:
+                print(f"  {name:28s} {metric:28s} {value:>12}")
+                continue
+            change = (value - reference) / reference
+            worse = -change if higher_is_better(metric) else change
+            flag = ''
+            if worse > tolerance:
+                flag = '  REGRESSION'
+                regressions.append((name, metric, reference, value))
+            print(f"  {name:28s} {metric:28s} {value:>12} (baseline {reference}, {change:+.0%}){flag}")
+    return regressions
+
+
+def machine_info() -> dict:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default='10k', help='comma-separated entry counts, e.g. 10k,100k,1M')
+    parser.add_argument('--suite', default=','.join(SUITES), help=f"comma-separated: {', '.join(SUITES)}")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before flagging, 0.25 = 25%%')
+    parser.add_argument('--repeat', type=int, default=1, help='run each benchmark this often and keep the best values')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--files', help=argparse.SUPPRESS)
+    parser.add_argument('--entries-count', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, json.loads(args.files), args.entries_count)
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+
+    results = {}
+    for scale in args.scale.split(','):
+        entries = parse_size(scale)
+        files = generate(entries, DATA_DIR)
+        for suite in args.suite.split(','):
+            for name in SUITES[suite]:
+                key = f'{suite}.{name}[{scale}]'
+                print(f"Running {key}...", flush=True)
+                results[key] = best_of([run_benchmark(name, files, entries) for _ in range(max(args.repeat, 1))])
+
+    print()
+    regressions = compare(results, baseline, args.tolerance)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'machine': machine_info(), 'results': results}, f, indent=2)
+    if args.save_baseline:
+        merged = {**baseline, **results}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'machine': machine_info(), 'results': merged}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nSaved baselines to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
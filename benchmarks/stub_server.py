@@ -0,0 +1,94 @@
+"""
+Local stand-in for IPTV origins: serves HLS playlists and segments with a configurable delay.
+
+    python benchmarks/stub_server.py --port 8081 --delay 0.02
+
+/live/<n>/index.m3u8 is a media playlist of a few segments and
+/live/<n>/seg<k>.ts a segment of `segment_bytes` bytes; every tenth stream
+(n divisible by 10) answers 404, so link checks see some dead links.
+"""
+import argparse
+import asyncio
+import threading
+
+from aiohttp import web
+
+SEGMENT_SECONDS = 6
+SEGMENTS_PER_PLAYLIST = 5
+
+
+class StubServer:
+    """Runs the stub origin on its own event loop in a daemon thread; `base_url` is set once started."""
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, delay: float = 0.0, segment_bytes: int = 188 * 1000):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.segment_bytes = segment_bytes
+        self.requests = 0
+        self.base_url = None
+        self._loop = asyncio.new_event_loop()
+        self._runner = None
+        self._ready = threading.Event()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route('*', '/live/{stream}/index.m3u8', self.playlist)
+        app.router.add_route('*', '/live/{stream}/{segment}.ts', self.segment)
+        return app
+
+    async def _delay(self, request):
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        stream = request.match_info['stream']
+        if stream.isdigit() and int(stream) % 10 == 0:
+            raise web.HTTPNotFound()
+
+    async def playlist(self, request):
+        await self._delay(request)
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}',
+                 '#EXT-X-MEDIA-SEQUENCE:0']
+        for k in range(SEGMENTS_PER_PLAYLIST):
+            lines += [f'#EXTINF:{SEGMENT_SECONDS}.0,', f'seg{k}.ts']
+        return web.Response(text='\n'.join(lines) + '\n', content_type='application/vnd.apple.mpegurl')
+
+    async def segment(self, request):
+        await self._delay(request)
+        body = b'G' + bytes(self.segment_bytes - 1)
+        if request.method == 'HEAD':
+            return web.Response(headers={'Content-Length': str(len(body)), 'Content-Type': 'video/mp2t'})
+        return web.Response(body=body, content_type='video/mp2t')
+
+    def start(self) -> str:
+        threading.Thread(target=self._run, name='stub-server', daemon=True).start()
+        self._ready.wait()
+        return self.base_url
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        port = self._runner.addresses[0][1]
+        self.base_url = f'http://{self.host}:{port}'
+        self._ready.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds before each response')
+    args = parser.parse_args()
+    web.run_app(StubServer(delay=args.delay).app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
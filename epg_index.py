@@ -0,0 +1,75 @@
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+
+
+class EPGIndex:
+    """
+    Per-channel index of records.Programme objects supporting time-window lookups by bisection.
+
+    Programmes are grouped by channel id once, when the index is built, and each
+    channel's list is kept sorted by start time alongside a parallel list of start
+    keys. A window or now/next lookup then costs O(log n) per channel instead of a
+    scan over every programme in the guide.
+
+    Start and stop are UTC epoch seconds, as stored by the ingest, so every
+    comparison is an integer one; a stop of None means the programme is open-ended.
+    """
+    def __init__(self, programmes=()):
+        self._programmes = {}
+        self._starts = {}
+        for programme in programmes:
+            self._programmes.setdefault(programme.channel, []).append(programme)
+        for channel_id, items in self._programmes.items():
+            items.sort(key=attrgetter('start'))
+            self._starts[channel_id] = [p.start for p in items]
+
+    def __contains__(self, channel_id) -> bool:
+        return channel_id in self._programmes
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._programmes.values())
+
+    def channels(self) -> list:
+        """Returns the ids of all channels that have at least one programme."""
+        return list(self._programmes)
+
+    def programmes(self, channel_id) -> list:
+        """Returns every programme of a channel, sorted by start time."""
+        return self._programmes.get(channel_id, [])
+
+    def window(self, channel_id, start=None, end=None) -> list:
+        """
+        Returns the programmes of a channel that overlap the half-open window [start, end).
+
+        Either bound may be None to leave that side of the window open.
+        """
+        items = self._programmes.get(channel_id)
+        if not items:
+            return []
+        starts = self._starts[channel_id]
+
+        hi = len(items) if end is None else bisect_left(starts, end)
+        if start is None:
+            return items[:hi]
+
+        # The programme that started most recently before `start` may still be airing.
+        lo = max(bisect_right(starts, start) - 1, 0)
+        while lo < hi and items[lo].stop is not None and items[lo].stop <= start:
+            lo += 1
+        return items[lo:hi]
+
+    def now_next(self, channel_id, at) -> tuple:
+        """
+        Returns (now, next) for a channel at time `at`.
+
+        `now` is the programme airing at `at` (or None) and `next` is the first
+        programme starting after `at` (or None).
+        """
+        items = self._programmes.get(channel_id)
+        if not items:
+            return None, None
+        starts = self._starts[channel_id]
+        i = bisect_right(starts, at)
+        current = items[i - 1] if i and (items[i - 1].stop is None or items[i - 1].stop > at) else None
+        upcoming = items[i] if i < len(items) else None
+        return current, upcoming
@@ -0,0 +1,165 @@
+import logging
+import re
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+
+logger = logging.getLogger(__name__)
+
+# '1TV.af@SD' -> '1TV.af': playlists tag feed variants after an '@'
+ID_SUFFIX_PATTERN = re.compile(r'@[^@]*$')
+# '(720p)', '[Geo-blocked]' and similar annotations in channel names
+NAME_ANNOTATION_PATTERN = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+# Name tokens describing the feed rather than the channel
+QUALITY_TOKENS = frozenset(('sd', 'hd', 'fhd', 'uhd', '4k', '8k', 'hevc', 'h264', 'h265',
+                            '480p', '576p', '720p', '1080i', '1080p', '2160p', 'backup'))
+
+# Minimum SequenceMatcher ratio for a fuzzy display-name match
+FUZZY_THRESHOLD = 0.85
+# Fuzzy candidates are only gathered through tokens shared by at most this many
+# guide channels, and only the best-overlapping few are scored, which keeps the
+# matching roughly linear in the size of the playlist.
+MAX_TOKEN_POSTINGS = 200
+MAX_FUZZY_CANDIDATES = 20
+
+# Match methods, in the order they are tried
+EXACT, NORMALIZED_ID, NAME, FUZZY = 'exact', 'id', 'name', 'fuzzy'
+
+
+def normalize_id(tvg_id: str) -> str:
+    """Returns the lookup key of a tvg-id / XMLTV channel id: without its '@' variant suffix, lower-cased."""
+    return ID_SUFFIX_PATTERN.sub('', tvg_id or '').strip().lower()
+
+
+def country_of(tvg_id: str) -> str:
+    """Returns the country suffix of an id like '1TV.af@SD' ('af'), or ''."""
+    base = normalize_id(tvg_id)
+    return base.rsplit('.', 1)[1] if '.' in base else ''
+
+
+def name_tokens(name: str) -> list:
+    """Splits a channel name into lower-case ASCII tokens, dropping annotations and quality markers."""
+    if not name:
+        return []
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    name = NAME_ANNOTATION_PATTERN.sub(' ', name.lower()).replace('&', ' and ')
+    return [token for token in TOKEN_PATTERN.findall(name) if token not in QUALITY_TOKENS]
+
+
+def normalize_name(name: str) -> str:
+    """Returns the lookup key of a channel name: 'Das Erste HD' and 'das-erste' both become 'daserste'."""
+    return ''.join(name_tokens(name))
+
+
+def _same_country(country: str, epg_channel_id: str) -> bool:
+    other = country_of(epg_channel_id)
+    return not country or not other or other == country
+
+
+class EPGMatcher:
+    """
+    Links playlist channels to guide channels.
+
+    A channel is matched on its exact tvg-id first, then on its normalized id
+    (see normalize_id), then on its normalized name or tvg-name against the
+    guide's display names, and finally on a fuzzy display-name match. All keys
+    of the guide are computed once into hash maps when the matcher is built, so
+    each of the first three steps is a dictionary lookup; fuzzy matching only
+    scores a bounded number of candidates sharing a reasonably rare name token.
+
+    Guide channels are dicts with 'source', 'id' and 'name'. When several sources
+    carry the same channel, the first one given wins.
+    """
+    def __init__(self, epg_channels, threshold: float = FUZZY_THRESHOLD):
+        self.threshold = threshold
+        self._ids = {}
+        self._normalized_ids = {}
+        self._names = {}
+        self._postings = {}
+        for channel in epg_channels:
+            target = (channel['source'], channel['id'])
+            self._ids.setdefault(channel['id'], target)
+            self._normalized_ids.setdefault(normalize_id(channel['id']), target)
+            tokens = name_tokens(channel.get('name'))
+            key = ''.join(tokens)
+            if not key:
+                continue
+            if key not in self._names:
+                self._names[key] = target
+                for token in set(tokens):
+                    self._postings.setdefault(token, []).append(key)
+        # Ids double as names when a guide has no display name for a channel ('1AlmereTV.nl' -> '1almeretv')
+        for key, target in self._normalized_ids.items():
+            self._names.setdefault(normalize_name(key.rsplit('.', 1)[0]), target)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def match(self, channel) -> tuple:
+        """
+        Returns (source, epg_channel_id, method, score) for a playlist channel, or None.
+
+        `channel` is a dict (or records.Channel) with 'tvg_id', 'name' and
+        'tvg_name'. `score` is 1.0 for all but fuzzy matches.
+        """
+        tvg_id = channel.get('tvg_id')
+        if tvg_id:
+            target = self._ids.get(tvg_id)
+            if target is not None:
+                return (*target, EXACT, 1.0)
+            target = self._normalized_ids.get(normalize_id(tvg_id))
+            if target is not None:
+                return (*target, NORMALIZED_ID, 1.0)
+
+        # A tvg-id naming another country rules out a name match ('1TV.ge' is not '1TV.af')
+        country = country_of(tvg_id)
+        names = [name for name in (channel.get('tvg_name'), channel.get('name')) if name]
+        for name in names:
+            target = self._names.get(normalize_name(name))
+            if target is not None and _same_country(country, target[1]):
+                return (*target, NAME, 1.0)
+        for name in names:
+            result = self._fuzzy(name_tokens(name), country)
+            if result is not None:
+                return result
+        return None
+
+    def _fuzzy(self, tokens: list, country: str):
+        key = ''.join(tokens)
+        if not key:
+            return None
+        overlap = Counter()
+        for token in set(tokens):
+            keys = self._postings.get(token, ())
+            if len(keys) <= MAX_TOKEN_POSTINGS:
+                overlap.update(keys)
+
+        best = None
+        best_score = 0.0
+        for candidate, _ in overlap.most_common(MAX_FUZZY_CANDIDATES):
+            score = SequenceMatcher(None, key, candidate).ratio()
+            if score < self.threshold:
+                continue
+            target = self._names[candidate]
+            if score > best_score and _same_country(country, target[1]):
+                best, best_score = (*target, FUZZY, round(score, 3)), score
+        return best
+
+    def match_all(self, channels):
+        """
+        Yields (channel_id, source, epg_channel_id, method, score) for each channel that matches.
+
+        Channels are dicts carrying their store 'id' as returned by Store.get_channels.
+        """
+        methods = Counter()
+        total = 0
+        for channel in channels:
+            total += 1
+            result = self.match(channel)
+            if result is None:
+                continue
+            methods[result[2]] += 1
+            yield (channel['id'], *result)
+        logger.info("Matched %d of %d channels to the guide (%s)", sum(methods.values()), total,
+                    ', '.join(f'{method}: {count}' for method, count in methods.items()) or 'none')
@@ -0,0 +1,245 @@
+import gzip
+import io
+import logging
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from records import Programme
+from timestamps import parse_xmltv_time
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class CountingReader(io.RawIOBase):
+    """
+    Wraps a binary file object and counts how many bytes have been read from it.
+
+    Used underneath the gzip layer (if any) so the byte count reflects progress
+    through the source file rather than through the decompressed XML. It is a
+    raw binary stream itself, so it can be wrapped in io.TextIOWrapper and read
+    from non-seekable sources such as a request body.
+    """
+    def __init__(self, fileobj):
+        super().__init__()
+        self._fileobj = fileobj
+        self._pending = b''
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        pending, self._pending = self._pending, b''
+        if size is None or size < 0:
+            data = self._fileobj.read()
+        elif size > len(pending):
+            data = self._fileobj.read(size - len(pending))
+        else:
+            self._pending = pending[size:]
+            return pending[:size]
+        self.bytes_read += len(data)
+        return pending + data
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def peek(self, size=1):
+        """Returns up to `size` upcoming bytes without consuming them."""
+        if len(self._pending) < size:
+            data = self._fileobj.read(size - len(self._pending))
+            self.bytes_read += len(data)
+            self._pending += data
+        return self._pending[:size]
+
+
+def open_decompressed(fileobj):
+    """
+    Returns a binary stream reading `fileobj`, gunzipping it on the fly if it starts with the gzip magic bytes.
+
+    Works on non-seekable streams; the returned stream is a CountingReader or a
+    GzipFile reading through one.
+    """
+    reader = fileobj if isinstance(fileobj, CountingReader) else CountingReader(fileobj)
+    if reader.peek(2) == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=reader, mode='rb')
+    return reader
+
+
+class IngestProgress:
+    """
+    Tracks a streaming EPG ingest and reports elements/sec and bytes read.
+
+    A report is logged (and handed to `callback`, if given) at most once every
+    `interval` seconds while parsing, and once more when the ingest finishes.
+    """
+    def __init__(self, name: str, total_bytes: int = None, callback=None, interval: float = 2.0):
+        self.name = name
+        self.total_bytes = total_bytes
+        self.callback = callback
+        self.interval = interval
+        self.channels = 0
+        self.programmes = 0
+        self.bytes_read = 0
+        self.done = False
+        self._started = time.monotonic()
+        self._last_report = self._started
+
+    @property
+    def elements(self) -> int:
+        return self.channels + self.programmes
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    def update(self, bytes_read: int):
+        """Records the current byte offset and reports if the interval has elapsed."""
+        self.bytes_read = bytes_read
+        now = time.monotonic()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def finish(self, bytes_read: int):
+        self.bytes_read = bytes_read
+        self.done = True
+        self.report()
+
+    def snapshot(self) -> dict:
+        elapsed = self.elapsed
+        return {
+            'name': self.name,
+            'channels': self.channels,
+            'programmes': self.programmes,
+            'elements_per_sec': round(self.elements / elapsed, 1) if elapsed > 0 else 0.0,
+            'bytes_read': self.bytes_read,
+            'total_bytes': self.total_bytes,
+            'elapsed': round(elapsed, 3),
+            'done': self.done,
+        }
+
+    def report(self):
+        snapshot = self.snapshot()
+        if self.total_bytes:
+            percent = f" ({100.0 * self.bytes_read / self.total_bytes:.1f}%)"
+        else:
+            percent = ""
+        logger.info(
+            "EPG ingest %s: %d elements, %.0f elements/sec, %d bytes read%s",
+            self.name, self.elements, snapshot['elements_per_sec'], self.bytes_read, percent
+        )
+        if self.callback:
+            self.callback(snapshot)
+
+
+def _findtext(element, path: str, default: str = '') -> str:
+    text = element.findtext(path)
+    return text.strip() if text else default
+
+
+class XMLTVParser:
+    """
+    Incrementally parses XMLTV guides (plain or gzipped) without building a DOM.
+
+    Each <channel> and <programme> element is converted to a record as soon as
+    its end tag is seen and is then cleared from the tree, so memory use stays
+    bounded by the size of a single element regardless of the guide size.
+    """
+    def iter_parse(self, fileobj, progress: IngestProgress = None):
+        """
+        Yields ('channel', dict) and ('programme', Programme) tuples in document order.
+
+        Args:
+            fileobj: A binary file object positioned at the start of the guide.
+                Gzip compression is detected from the magic bytes.
+            progress: Optional IngestProgress updated as elements are parsed.
+
+        Raises:
+            xml.etree.ElementTree.ParseError: If the XML is malformed.
+        """
+        # Progress is counted in bytes of the source file, beneath the gzip layer
+        reader = fileobj if isinstance(fileobj, CountingReader) else CountingReader(fileobj)
+        source = open_decompressed(reader)
+
+        root = None
+        for event, element in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                continue
+
+            if element.tag == 'programme':
+                programme = self._parse_programme(element)
+                if programme is not None:
+                    if progress:
+                        progress.programmes += 1
+                    yield 'programme', programme
+            elif element.tag == 'channel':
+                channel = self._parse_channel(element)
+                if channel is not None:
+                    if progress:
+                        progress.channels += 1
+                    yield 'channel', channel
+            else:
+                continue
+
+            # Drop the converted element and detach it from the root so the tree
+            # never holds more than the element currently being parsed.
+            element.clear()
+            if root is not None:
+                root.clear()
+            if progress:
+                progress.update(reader.bytes_read)
+
+        if progress:
+            progress.finish(reader.bytes_read)
+
+    def parse_file(self, filepath: str, progress_callback=None, interval: float = 2.0):
+        """
+        Opens `filepath` and yields the same events as iter_parse.
+
+        Args:
+            filepath: Path to a .xml or .xml.gz guide.
+            progress_callback: Optional callable receiving IngestProgress snapshots.
+            interval: Minimum number of seconds between progress reports.
+        """
+        progress = IngestProgress(
+            os.path.basename(filepath),
+            total_bytes=os.path.getsize(filepath),
+            callback=progress_callback,
+            interval=interval,
+        )
+        with open(filepath, 'rb') as f:
+            yield from self.iter_parse(f, progress)
+
+    def _parse_channel(self, element) -> dict:
+        channel_id = element.get('id')
+        if not channel_id:
+            return None
+        icon = element.find('icon')
+        return {
+            'id': channel_id,
+            'name': _findtext(element, 'display-name') or channel_id,
+            'icon': icon.get('src', '') if icon is not None else '',
+        }
+
+    def _parse_programme(self, element) -> Programme:
+        channel_id = element.get('channel', '')
+        # Times are stored as UTC epoch seconds; a programme without a valid start can't be placed
+        start = parse_xmltv_time(element.get('start'))
+        if not channel_id or start is None:
+            return None
+        return Programme(
+            channel_id,
+            start,
+            parse_xmltv_time(element.get('stop')),
+            _findtext(element, 'title', 'No Title'),
+            _findtext(element, 'desc'),
+            _findtext(element, 'category'),
+            _findtext(element, 'episode-num'),
+        )
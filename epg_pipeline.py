@@ -0,0 +1,274 @@
+import io
+import logging
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+from epg_parser import GZIP_MAGIC, IngestProgress, XMLTVParser
+from records import Programme
+
+logger = logging.getLogger(__name__)
+
+# Plain-XML guides are split into chunks of roughly this many bytes
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+# Bytes of chunks iter_file() has in flight at once, however many cores there are:
+# each chunk is read into memory whole and comes back as fully built lists
+DEFAULT_MAX_INFLIGHT_BYTES = 128 * 1024 * 1024
+# Bytes scanned at a time when looking for the next <programme> boundary
+SCAN_BYTES = 1024 * 1024
+ROOT_PATTERN = re.compile(rb'<tv[\s>/]')
+DECLARATION_PATTERN = re.compile(rb'^\s*<\?xml[^>]*\?>')
+PROGRAMME_TAG = b'<programme'
+
+
+def _mp_context():
+    # The pool is created inside a multithreaded server process (request
+    # threads, the background event loop), where a forked child can inherit a
+    # lock some other thread held and deadlock. Workers are forked from a fork
+    # server instead: a fresh single-threaded process that preloads only this
+    # module (the workers just run _parse_range), not the web app.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def split_guide(path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> list:
+    """
+    Splits a plain-XML guide into byte ranges that each hold whole elements.
+
+    Every boundary falls at the start of a <programme> element, so each range
+    can be parsed independently once wrapped in a <tv> root (see _parse_range).
+    Returns a list of (start, end, prefix, suffix) tuples; a single range
+    covering the whole file means the guide is too small or has no usable
+    boundaries.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(min(size, SCAN_BYTES))
+        declaration = DECLARATION_PATTERN.match(head)
+        declaration = declaration.group(0).strip() if declaration else b''
+        root = ROOT_PATTERN.search(head)
+        if root is None:
+            return [(0, size, b'', b'')]
+        body_start = head.index(b'>', root.start()) + 1
+
+        bounds = [0]
+        position = max(body_start, chunk_bytes)
+        while position < size:
+            f.seek(position)
+            boundary = None
+            # Overlap successive reads so a tag split across two reads is still found
+            while boundary is None:
+                data = f.read(SCAN_BYTES + len(PROGRAMME_TAG))
+                if not data:
+                    break
+                index = data.find(PROGRAMME_TAG)
+                if index >= 0:
+                    boundary = position + index
+                else:
+                    position += SCAN_BYTES
+                    f.seek(position)
+            if boundary is None:
+                break
+            bounds.append(boundary)
+            position = boundary + chunk_bytes
+        bounds.append(size)
+
+    ranges = []
+    last = len(bounds) - 2
+    for i in range(len(bounds) - 1):
+        prefix = b'' if i == 0 else declaration + b'<tv>'
+        suffix = b'' if i == last else b'</tv>'
+        ranges.append((bounds[i], bounds[i + 1], prefix, suffix))
+    return ranges
+
+
+def _parse_range(path: str, start: int, end: int, prefix: bytes, suffix: bytes) -> tuple:
+    """
+    Worker: parses one byte range of a guide (or a whole file when the range covers it).
+
+    Returns (channels, programmes, bytes) where programmes are plain tuples in
+    Programme.FIELDS order, which are much cheaper to send back to the parent
+    process than records.
+    """
+    if start == 0 and prefix == b'' and suffix == b'' and end == os.path.getsize(path):
+        fileobj = open(path, 'rb')
+    else:
+        with open(path, 'rb') as f:
+            f.seek(start)
+            fileobj = io.BytesIO(prefix + f.read(end - start) + suffix)
+    channels = []
+    programmes = []
+    with fileobj:
+        for kind, item in XMLTVParser().iter_parse(fileobj):
+            if kind == 'channel':
+                channels.append(item)
+            else:
+                programmes.append((item.channel, item.start, item.stop, item.title, item.description,
+                                   item.category, item.episode))
+    return channels, programmes, end - start
+
+
+def merge_programmes(sources) -> tuple:
+    """
+    Merges per-source programme lists into one guide.
+
+    `sources` is a list of programme lists in priority order. Per channel,
+    programmes are swept in start order: a programme starting at the same time
+    as the last one kept is a duplicate, and one from a different source that
+    starts before the last kept programme has ended overlaps it; both are
+    dropped, so on equal starts the higher-priority source wins.
+
+    Returns (programmes, duplicates, overlaps), with programmes grouped by
+    channel and sorted by start.
+    """
+    by_channel = {}
+    for priority, programmes in enumerate(sources):
+        for programme in programmes:
+            by_channel.setdefault(programme.channel, []).append((programme.start, priority, programme))
+
+    merged = []
+    duplicates = overlaps = 0
+    for items in by_channel.values():
+        items.sort(key=itemgetter(0, 1))
+        last = last_priority = None
+        for start, priority, programme in items:
+            if last is not None:
+                if start == last.start:
+                    duplicates += 1
+                    continue
+                if priority != last_priority and last.stop is not None and start < last.stop:
+                    overlaps += 1
+                    continue
+            merged.append(programme)
+            last, last_priority = programme, priority
+    return merged, duplicates, overlaps
+
+
+class EPGPipeline:
+    """
+    Parses XMLTV guides on several cores.
+
+    Plain-XML guides are split into chunks at <programme> boundaries (see
+    split_guide) and every chunk, or every gzipped file as a whole, is parsed in
+    a process pool. iter_file() streams one guide back in document order, with
+    at most `max_inflight_bytes` of chunks in flight at once, so its memory use
+    doesn't grow with the number of cores; ingest() parses several guides at
+    the same time and merges them into one (see merge_programmes).
+    """
+    def __init__(self, workers: int = None, chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                 max_inflight_bytes: int = DEFAULT_MAX_INFLIGHT_BYTES):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_bytes = chunk_bytes
+        self.max_inflight_bytes = max_inflight_bytes
+
+    def max_inflight(self) -> int:
+        """Returns how many chunks iter_file() keeps in flight: a couple per worker, within the byte budget."""
+        return max(1, min(2 * self.workers, self.max_inflight_bytes // self.chunk_bytes))
+
+    def _tasks(self, path: str) -> list:
+        with open(path, 'rb') as f:
+            compressed = f.read(2) == GZIP_MAGIC
+        if compressed:
+            return [(path, 0, os.path.getsize(path), b'', b'')]
+        return [(path, *chunk) for chunk in split_guide(path, self.chunk_bytes)]
+
+    def _executor(self, workers: int = None) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=workers or self.workers, mp_context=_mp_context())
+
+    def iter_file(self, path: str, progress_callback=None, interval: float = 2.0):
+        """
+        Yields ('channel', dict) and ('programme', Programme) events for one guide, like XMLTVParser.parse_file.
+
+        Small or gzipped guides, or a pipeline with a single worker (or a byte
+        budget of a single chunk), are parsed in this process with the streaming parser.
+        """
+        tasks = self._tasks(path)
+        max_inflight = self.max_inflight()
+        if len(tasks) == 1 or self.workers == 1 or max_inflight == 1:
+            yield from XMLTVParser().parse_file(path, progress_callback=progress_callback, interval=interval)
+            return
+
+        progress = IngestProgress(os.path.basename(path), total_bytes=os.path.getsize(path),
+                                  callback=progress_callback, interval=interval)
+        done_bytes = 0
+        # More workers than chunks in flight would sit idle
+        with self._executor(min(self.workers, max_inflight)) as pool:
+            pending = deque()
+            remaining = iter(tasks)
+            # Results are consumed in order, and each one consumed makes room for the next chunk
+            for task in remaining:
+                pending.append(pool.submit(_parse_range, *task))
+                if len(pending) >= max_inflight:
+                    break
+            while pending:
+                channels, programmes, size = pending.popleft().result()
+                task = next(remaining, None)
+                if task is not None:
+                    pending.append(pool.submit(_parse_range, *task))
+                progress.channels += len(channels)
+                progress.programmes += len(programmes)
+                for channel in channels:
+                    yield 'channel', channel
+                for values in programmes:
+                    yield 'programme', Programme(*values)
+                done_bytes += size
+                progress.update(done_bytes)
+        progress.finish(done_bytes)
+
+    def ingest(self, paths, progress_callback=None) -> tuple:
+        """
+        Parses several guides in parallel and merges them into one.
+
+        `paths` are in priority order: where guides disagree about a channel's
+        schedule, the earlier guide wins. Channels are merged by id, keeping the
+        first definition. Returns (events, summary): `events` is a list of
+        ('channel', dict) / ('programme', Programme) tuples ready for
+        Store.replace_epg, and `summary` describes each guide and the merge.
+        """
+        started = time.monotonic()
+        tasks = [(priority, task) for priority, path in enumerate(paths) for task in self._tasks(path)]
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        progress = IngestProgress(', '.join(os.path.basename(path) for path in paths), total_bytes=total_bytes,
+                                  callback=progress_callback)
+
+        channels = {}
+        programmes = [[] for _ in paths]
+        guides = [{'name': os.path.basename(path), 'channels': 0, 'programmes': 0} for path in paths]
+        done_bytes = 0
+        with self._executor() as pool:
+            futures = [(priority, pool.submit(_parse_range, *task)) for priority, task in tasks]
+            # Chunks of one guide are collected in document order
+            for priority, future in futures:
+                chunk_channels, chunk_programmes, size = future.result()
+                for channel in chunk_channels:
+                    channels.setdefault(channel['id'], channel)
+                programmes[priority].extend(Programme(*values) for values in chunk_programmes)
+                guides[priority]['channels'] += len(chunk_channels)
+                guides[priority]['programmes'] += len(chunk_programmes)
+                progress.channels += len(chunk_channels)
+                progress.programmes += len(chunk_programmes)
+                done_bytes += size
+                progress.update(done_bytes)
+
+        merged, duplicates, overlaps = merge_programmes(programmes)
+        progress.finish(done_bytes)
+        events = [('channel', channel) for channel in channels.values()]
+        events += [('programme', programme) for programme in merged]
+        summary = {
+            'guides': guides,
+            'duplicates': duplicates,
+            'overlaps': overlaps,
+            'workers': self.workers,
+            'chunks': len(tasks),
+            'parse_seconds': round(time.monotonic() - started, 3),
+        }
+        logger.info("Merged %d guides into %d programmes (%d duplicates, %d overlaps dropped) in %.1fs",
+                    len(paths), len(merged), duplicates, overlaps, summary['parse_seconds'])
+        return events, summary
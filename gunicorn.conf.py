@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for production serving:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Every worker process imports the app itself (no preloading), so each one
+owns its SQLite connections and a single long-lived event loop for outbound
+I/O (link checks, source downloads). Views are synchronous and run on a pool
+of threads per worker. Settings can be overridden with the IPTV_* environment
+variables below, or on the command line.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('IPTV_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('IPTV_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+# Streaming responses (job results, large uploads) hold a thread for their duration
+threads = int(os.environ.get('IPTV_THREADS', 8))
+# Seconds a worker has after SIGTERM before it is killed: in-flight requests
+# finish first, then background jobs are drained in worker_exit for up to the
+# app's SHUTDOWN_DRAIN_TIMEOUT (30s), so keep this above both together
+graceful_timeout = int(os.environ.get('IPTV_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+accesslog = os.environ.get('IPTV_ACCESS_LOG')
+
+
+def worker_exit(server, worker):
+    from app import shutdown
+    shutdown()
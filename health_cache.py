@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# refresh() re-reads results stored this many seconds before its previous run,
+# so a result committed while that run was reading is not missed
+SYNC_OVERLAP = 5.0
+
+
+def normalize_url(url: str) -> str:
+    """
+    Returns a canonical form of `url` used as the cache key.
+
+    Scheme and host are lower-cased, default ports and fragments are dropped, and an
+    empty path becomes '/'. The query string is kept since it often selects the stream.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower()
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    netloc = host
+    if parts.username:
+        netloc = f"{parts.username}{':' + parts.password if parts.password else ''}@{netloc}"
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+class HealthCache:
+    """
+    Size-bounded LRU cache of link-check results keyed by normalized URL.
+
+    Alive and dead results expire after separate TTLs, so dead links are negatively
+    cached (usually for less time than live ones). Entries carry absolute wall-clock
+    expiry times, which lets the cache be saved to disk and reloaded after a
+    restart without re-checking every link.
+
+    It is saved either to a JSON file at `path` or, given a storage.Store, to
+    the database, which several server processes can share: save() then only
+    writes the results that changed, and refresh() picks up the ones other
+    processes saved.
+    """
+    def __init__(self, max_entries: int = 50000, alive_ttl: float = 3600.0, dead_ttl: float = 600.0,
+                 path: str = None, store=None):
+        self.max_entries = max_entries
+        self.alive_ttl = alive_ttl
+        self.dead_ttl = dead_ttl
+        self.path = path
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._changed = set()
+        self._synced_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, url: str) -> dict:
+        """Returns the cached result for `url`, or None if it is missing or expired."""
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, url: str, result: dict):
+        """Caches a result; only 'alive' and 'dead' results are stored."""
+        status = result.get('status')
+        if status == 'alive':
+            ttl = self.alive_ttl
+        elif status == 'dead':
+            ttl = self.dead_ttl
+        else:
+            return
+        key = normalize_url(url)
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, result)
+            self._entries.move_to_end(key)
+            self._evict()
+            self._dirty = True
+            self._changed.add(key)
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._changed.clear()
+            self._dirty = True
+        if self.store is not None:
+            self.store.clear_link_health()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'alive_ttl': self.alive_ttl,
+                'dead_ttl': self.dead_ttl,
+            }
+
+    def refresh(self):
+        """Merges in the results other processes saved to the store since the last load or refresh."""
+        if self.store is None:
+            return
+        since = self._synced_at - SYNC_OVERLAP
+        self._synced_at = time.time()
+        entries = self.store.link_health(since)
+        with self._lock:
+            for key, expires, result in entries:
+                if key not in self._changed:
+                    self._entries[key] = (expires, result)
+                    self._entries.move_to_end(key)
+            self._evict()
+
+    def load(self):
+        """
+        Loads unexpired entries from the store or `path`, keeping their least-recently-used order.
+
+        With a store, a file at `path` (written by earlier versions) is imported
+        into it once, while the store has no entries yet.
+        """
+        if self.store is not None:
+            self._synced_at = 0.0
+            self.refresh()
+            if not self._entries:
+                self._load_file()
+                with self._lock:
+                    self._changed.update(self._entries)
+                self.save()
+            logger.info("Loaded %d link health entries from the database", len(self._entries))
+            return
+        self._load_file()
+
+    def _load_file(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable health cache %s: %s", self.path, e)
+            return
+        now = time.time()
+        with self._lock:
+            for key, expires, result in entries[-self.max_entries:]:
+                if expires > now:
+                    self._entries[key] = (expires, result)
+            self._dirty = False
+        logger.info("Loaded %d link health entries from %s", len(self._entries), self.path)
+
+    def save(self):
+        """Writes unexpired entries to `path`, or the changed ones to the store, if anything changed since the last save."""
+        if self.store is not None:
+            with self._lock:
+                entries = [(key, *self._entries[key]) for key in self._changed if key in self._entries]
+                self._changed.clear()
+                self._dirty = False
+            if entries:
+                self.store.put_link_health(entries)
+            return
+        if not self.path or not self._dirty:
+            return
+        now = time.time()
+        with self._lock:
+            entries = [[key, expires, result] for key, (expires, result) in self._entries.items() if expires > now]
+            self._dirty = False
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+import m3u8
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on bytes read from a playlist or segment during a probe.
+MAX_PLAYLIST_BYTES = 2 * 1024 * 1024
+MAX_SEGMENT_BYTES = 16 * 1024 * 1024
+# Live players start this many segments from the end of a media playlist.
+LIVE_EDGE_SEGMENTS = 3
+
+
+def is_hls_url(url: str) -> bool:
+    return url.split('?', 1)[0].lower().endswith(('.m3u8', '.m3u'))
+
+
+async def _fetch(session: aiohttp.ClientSession, url: str, limit: int) -> tuple:
+    """
+    Downloads up to `limit` bytes of `url`.
+
+    Returns (status, body, first_byte_seconds, total_seconds); the timings are
+    measured from when the request is sent.
+    """
+    started = time.monotonic()
+    first_byte = None
+    chunks = []
+    size = 0
+    async with session.get(url, allow_redirects=True) as response:
+        async for chunk in response.content.iter_any():
+            if first_byte is None:
+                first_byte = time.monotonic() - started
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= limit:
+                break
+        status = response.status
+    total = time.monotonic() - started
+    return status, b''.join(chunks), first_byte if first_byte is not None else total, total
+
+
+def _pick_variant(playlist, policy: str):
+    """Returns the variant to probe: 'lowest' bandwidth (fastest start), 'highest', or 'first'."""
+    variants = [v for v in playlist.playlists if v.uri]
+    if not variants or policy == 'first':
+        return variants[0] if variants else None
+    key = lambda v: v.stream_info.bandwidth or 0
+    return max(variants, key=key) if policy == 'highest' else min(variants, key=key)
+
+
+def _pick_segment(playlist):
+    segments = playlist.segments
+    if not segments:
+        return None
+    if playlist.is_endlist:
+        return segments[0]
+    return segments[max(len(segments) - LIVE_EDGE_SEGMENTS, 0)]
+
+
+async def probe_hls(session: aiohttp.ClientSession, url: str, variant_policy: str = 'lowest') -> dict:
+    """
+    Probes an HLS stream the way a player starts it.
+
+    Fetches the (master) playlist, picks a variant, fetches its media playlist and
+    downloads the segment a player would start with. Returns a dict with
+    'status' ('alive' or 'dead'), 'http_status', 'error', 'ttfb_ms' (first byte
+    of the playlist), 'startup_ms' (request start until the first segment is
+    fully downloaded), 'bitrate' (advertised bandwidth, else measured from the
+    segment size and duration, in bits/sec), 'variant_count' and 'segment_ms'.
+    """
+    result = {
+        'status': 'dead', 'http_status': None, 'error': None, 'ttfb_ms': None,
+        'startup_ms': None, 'bitrate': None, 'variant_count': 0, 'segment_ms': None,
+    }
+    started = time.monotonic()
+    try:
+        status, body, first_byte, _ = await _fetch(session, url, MAX_PLAYLIST_BYTES)
+        result['http_status'] = status
+        result['ttfb_ms'] = int(first_byte * 1000)
+        if status >= 400:
+            result['error'] = f'playlist returned HTTP {status}'
+            return result
+
+        playlist = m3u8.loads(body.decode('utf-8', errors='ignore'), uri=url)
+        if playlist.is_variant:
+            result['variant_count'] = len(playlist.playlists)
+            variant = _pick_variant(playlist, variant_policy)
+            if variant is None:
+                result['error'] = 'master playlist has no variants'
+                return result
+            result['bitrate'] = variant.stream_info.bandwidth
+            status, body, _, _ = await _fetch(session, variant.absolute_uri, MAX_PLAYLIST_BYTES)
+            if status >= 400:
+                result['error'] = f'media playlist returned HTTP {status}'
+                return result
+            playlist = m3u8.loads(body.decode('utf-8', errors='ignore'), uri=variant.absolute_uri)
+        else:
+            result['variant_count'] = 1
+
+        segment = _pick_segment(playlist)
+        if segment is None:
+            result['error'] = 'media playlist has no segments'
+            return result
+        status, body, _, seconds = await _fetch(session, segment.absolute_uri, MAX_SEGMENT_BYTES)
+        if status >= 400:
+            result['error'] = f'segment returned HTTP {status}'
+            return result
+
+        result['segment_ms'] = int(seconds * 1000)
+        result['startup_ms'] = int((time.monotonic() - started) * 1000)
+        if not result['bitrate'] and segment.duration:
+            result['bitrate'] = int(len(body) * 8 / segment.duration)
+        result['status'] = 'alive'
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        result['error'] = str(e) or type(e).__name__
+    return result
@@ -0,0 +1,617 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import ipaddress
+import logging
+import mimetypes
+import os
+import re
+import secrets
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit
+
+import aiohttp
+import aiohttp.abc
+
+from hls_probe import MAX_PLAYLIST_BYTES
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_CONTENT_TYPE = 'application/vnd.apple.mpegurl'
+# Upstream responses larger than this are cut off rather than relayed
+MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+CHUNK_BYTES = 64 * 1024
+# Cached segments live this many segment durations: long enough for viewers a
+# few segments behind the live edge, short enough that the cache stays small
+SEGMENT_TTL_FACTOR = 3
+MIN_SEGMENT_TTL = 10
+MAX_SEGMENT_TTL = 3600
+DEFAULT_SEGMENT_SECONDS = 6.0
+# Seconds a fetched playlist is reused: master and finished (VOD) playlists
+# don't change, live media playlists are re-fetched twice per target duration
+MASTER_PLAYLIST_TTL = 60
+VOD_PLAYLIST_TTL = 300
+MAX_LIVE_PLAYLIST_TTL = 5
+# Seconds a reader waits for the next bytes of a segment being fetched
+READ_TIMEOUT = 30
+# Leftover partial files older than this are removed by the disk cleanup
+STALE_PART_SECONDS = 3600
+# Redirects followed per upstream request; each hop is checked like the first URL
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+URI_ATTRIBUTE = re.compile(r'URI="([^"]*)"')
+# Tags whose URI attribute points at another playlist rather than at media
+PLAYLIST_URI_TAGS = ('#EXT-X-MEDIA:', '#EXT-X-I-FRAME-STREAM-INF:')
+SEGMENT_CONTENT_TYPES = {'.ts': 'video/mp2t', '.aac': 'audio/aac', '.m4s': 'video/iso.segment',
+                         '.mp4': 'video/mp4', '.vtt': 'text/vtt'}
+
+RELAY_REQUESTS = Counter('iptv_relay_requests_total', 'Relayed playlist and segment requests by how they were served',
+                         ('kind', 'result'))
+RELAY_UPSTREAM_BYTES = Counter('iptv_relay_upstream_bytes_total', 'Bytes the relay downloaded from stream origins')
+
+
+class RelayError(Exception):
+    """An upstream fetch failed; `status` is the HTTP status to answer with."""
+    def __init__(self, message: str, status: int = 502):
+        super().__init__(message)
+        self.status = status
+
+
+def load_secret(path: str) -> bytes:
+    """Returns the key relay URLs are signed with, creating it on first use (shared by every worker)."""
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another worker may still be writing it
+        for _ in range(50):
+            with open(path, 'rb') as f:
+                secret = f.read()
+            if secret:
+                return secret
+            time.sleep(0.01)
+        raise RuntimeError(f"Relay key {path} is empty")
+    secret = secrets.token_hex(32).encode()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secret)
+    return secret
+
+
+def is_public_address(host: str) -> bool:
+    """Tells whether an IP address is one on the internet, not e.g. loopback, link-local or private."""
+    address = ipaddress.ip_address(host.split('%', 1)[0])
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+class PublicResolver(aiohttp.abc.AbstractResolver):
+    """
+    Resolves host names to their public addresses only.
+
+    Used by the relay's connector so that a playlist can't make the server
+    fetch (and hand out) internal resources, whatever its URIs resolve to.
+    """
+    def __init__(self):
+        self._resolver = aiohttp.DefaultResolver()
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        addresses = [address for address in await self._resolver.resolve(host, port, family)
+                     if is_public_address(address['host'])]
+        if not addresses:
+            raise OSError(f'{host} has no public address')
+        return addresses
+
+    async def close(self):
+        await self._resolver.close()
+
+
+def segment_content_type(url: str) -> str:
+    extension = os.path.splitext(urlsplit(url).path)[1].lower()
+    return SEGMENT_CONTENT_TYPES.get(extension) or mimetypes.guess_type(urlsplit(url).path)[0] or 'video/mp2t'
+
+
+class SegmentCache:
+    """
+    Recently relayed segments, in memory and on disk.
+
+    Every cached segment is a file named after the hash of its URL, whose
+    modification time is set to when it expires, so all server processes
+    share the files and agree on their freshness without an index. Small
+    segments are also kept in an in-memory LRU of at most `memory_bytes`. The
+    folder is trimmed to `disk_bytes` (expired files first, then those
+    expiring soonest) whenever this process's writes may have exceeded it.
+    """
+    def __init__(self, folder: str, memory_bytes: int = 64 * 1024 * 1024, disk_bytes: int = 1024 * 1024 * 1024):
+        self.folder = folder
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        # Segments over an eighth of the memory budget only go to disk
+        self.max_memory_item = memory_bytes // 8
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._disk_used = self._cleanup()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.folder, key)
+
+    def get(self, key: str):
+        """
+        Returns ('memory', content_type, body), ('disk', None, open file) or None.
+
+        The file is opened here, so it stays readable even if another process
+        evicts it meanwhile.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires, content_type, body = entry
+                if expires > now:
+                    self._memory.move_to_end(key)
+                    return 'memory', content_type, body
+                del self._memory[key]
+                self._memory_used -= len(body)
+        try:
+            f = open(self.path_for(key), 'rb')
+        except FileNotFoundError:
+            return None
+        if os.fstat(f.fileno()).st_mtime <= now:
+            f.close()
+            return None
+        return 'disk', None, f
+
+    def put(self, key: str, expires: float, content_type: str, body: bytes = None):
+        """
+        Records a segment moved to path_for(key) (see SegmentFill.commit) that expires at `expires`.
+
+        `body` is its content if small enough to also keep in memory.
+        """
+        size = os.path.getsize(self.path_for(key))
+        with self._lock:
+            if body is not None and len(body) <= self.max_memory_item:
+                previous = self._memory.pop(key, None)
+                if previous is not None:
+                    self._memory_used -= len(previous[2])
+                self._memory[key] = (expires, content_type, body)
+                self._memory_used += len(body)
+                while self._memory_used > self.memory_bytes:
+                    _, (_, _, evicted) = self._memory.popitem(last=False)
+                    self._memory_used -= len(evicted)
+            self._disk_used += size
+            trim = self._disk_used > self.disk_bytes
+        if trim:
+            used = self._cleanup()
+            with self._lock:
+                self._disk_used = used
+
+    def _cleanup(self) -> int:
+        """Deletes expired and excess files and returns the bytes left in the folder."""
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.folder):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith('.part'):
+                if stat.st_mtime < now - STALE_PART_SECONDS:
+                    self._remove(entry.path)
+                continue
+            if stat.st_mtime <= now:
+                self._remove(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        used = sum(size for _, size, _ in files)
+        # Trim to 90% so a full cache isn't scanned again on the very next write
+        if used > self.disk_bytes:
+            for _, size, path in sorted(files):
+                if used <= self.disk_bytes * 0.9:
+                    break
+                self._remove(path)
+                used -= size
+        return used
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'memory_entries': len(self._memory), 'memory_bytes': self._memory_used,
+                    'disk_bytes': self._disk_used}
+
+
+class SegmentFill:
+    """
+    One upstream segment download, readable by any number of viewers while it is in progress.
+
+    The body is written to a partial file as it arrives; readers follow the
+    file, waiting for more bytes as needed, so a segment is streamed to
+    every viewer without being buffered whole and is fetched only once.
+    """
+    def __init__(self, key: str, url: str, folder: str):
+        self.key = key
+        self.url = url
+        self.path = os.path.join(folder, f'{key}.{os.getpid()}.{id(self):x}.part')
+        self.file = open(self.path, 'wb')
+        self.status = None
+        self.content_type = None
+        self.content_length = None
+        self.size = 0
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+        self._ready = threading.Event()
+
+    def start(self, status: int, content_type: str, content_length: int):
+        self.status = status
+        self.content_type = content_type
+        self.content_length = content_length
+        self._ready.set()
+
+    def append(self, chunk: bytes):
+        self.file.write(chunk)
+        self.file.flush()
+        with self._cond:
+            self.size += len(chunk)
+            self._cond.notify_all()
+
+    def commit(self, path: str, expires: float):
+        """Moves the finished file to `path`, with its modification time set to `expires` (see SegmentCache)."""
+        self.file.close()
+        with self._cond:
+            os.utime(self.path, (expires, expires))
+            os.replace(self.path, path)
+            self.path = path
+
+    def open(self):
+        """Opens the body for reading; the file stays readable wherever it is moved or even if deleted."""
+        with self._cond:
+            return open(self.path, 'rb')
+
+    def finish(self, error: Exception = None):
+        self.file.close()
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+        self._ready.set()
+
+    def wait_ready(self, timeout: float = READ_TIMEOUT):
+        """Waits for the upstream response headers; raises RelayError if there are none."""
+        if not self._ready.wait(timeout):
+            raise RelayError('Upstream did not answer in time', 504)
+        if self.status is None:
+            if isinstance(self.error, RelayError):
+                raise RelayError(str(self.error), self.error.status)
+            raise RelayError(f'Upstream request failed: {self.error}')
+
+    def iter_body(self, f, timeout: float = READ_TIMEOUT):
+        """Yields the body from a file of open() as it arrives, until the download is complete."""
+        with f:
+            offset = 0
+            while True:
+                with self._cond:
+                    while self.size <= offset and not self.done:
+                        if not self._cond.wait(timeout):
+                            raise RelayError('Upstream stalled', 504)
+                    available, error = self.size, self.error
+                if available > offset:
+                    data = f.read(available - offset)
+                    offset += len(data)
+                    yield data
+                    continue
+                if error is not None:
+                    # Headers are already sent, so the viewer sees a truncated segment and retries
+                    raise RelayError(f'Upstream transfer failed: {error}')
+                return
+
+
+class HLSRelay:
+    """
+    Relays HLS streams so that any number of viewers of a channel share one upstream fetch.
+
+    Playlists are fetched, cached briefly and rewritten so that every
+    variant, segment, key and init-section URI points back at the relay.
+    Rewritten URIs carry the upstream URL and the segment's cache lifetime,
+    signed with `secret`, so the relay only ever fetches URLs that came out
+    of a playlist it relayed itself. Concurrent requests for the same segment
+    join one SegmentFill; finished segments are served from a SegmentCache
+    for a few segment durations.
+
+    Upstream requests run on the shared background event loop; Flask views
+    call playlist() and segment() from their own threads. Unless
+    `allow_private` is set, upstream hosts (redirect targets included) must
+    have public addresses, so a hostile playlist can't point the relay at
+    loopback, link-local (cloud metadata) or private network services.
+    """
+    def __init__(self, background, folder: str, secret: bytes, prefix: str = '/relay',
+                 memory_bytes: int = 64 * 1024 * 1024, disk_bytes: int = 1024 * 1024 * 1024,
+                 concurrency: int = 32, timeout: float = 15.0, connect_timeout: float = 5.0,
+                 user_agent: str = 'Mozilla/5.0 (IPTV relay)', allow_private: bool = False):
+        self.background = background
+        self.allow_private = allow_private
+        self.secret = secret
+        self.prefix = prefix.rstrip('/')
+        self.cache = SegmentCache(folder, memory_bytes, disk_bytes)
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=timeout)
+        self.headers = {'User-Agent': user_agent}
+        self._session = None
+        self._lock = threading.Lock()
+        self._fills = {}
+        self._playlists = {}
+        self._playlist_fetches = {}
+
+    async def open(self):
+        if self._session is None:
+            resolver = None if self.allow_private else PublicResolver()
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300, resolver=resolver)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, headers=self.headers)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def check_upstream_url(self, url: str):
+        """
+        Refuses upstream URLs the relay mustn't fetch.
+
+        Host names are checked by PublicResolver when connecting; IP
+        addresses in URLs never reach a resolver, so they are checked here.
+
+        Raises:
+            RelayError: If `url` isn't http(s) or points at a non-public address.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise RelayError(f'Not a http(s) URL: {url}', 403)
+        if self.allow_private:
+            return
+        try:
+            public = is_public_address(parts.hostname)
+        except ValueError:
+            return
+        if not public:
+            raise RelayError(f'Refusing to relay {parts.hostname}: not a public address', 403)
+
+    async def _get(self, url: str) -> aiohttp.ClientResponse:
+        """GETs `url`, following redirects here so that every hop goes through check_upstream_url()."""
+        for _ in range(MAX_REDIRECTS + 1):
+            self.check_upstream_url(url)
+            response = await self._session.get(url, allow_redirects=False)
+            location = response.headers.get('Location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                return response
+            response.release()
+            url = urljoin(str(response.url), location)
+        raise RelayError('Too many redirects')
+
+    # Signed relay URLs
+
+    def _signature(self, payload: bytes) -> str:
+        digest = hmac.new(self.secret, payload, hashlib.sha256).digest()[:16]
+        return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+    def relay_url(self, kind: str, url: str, ttl: int = 0) -> str:
+        """Returns the relay path for an upstream URL: kind 'p' for playlists, 's' for segments cached `ttl` seconds."""
+        payload = f'{kind}{ttl}:{url}'.encode()
+        token = base64.urlsafe_b64encode(payload).decode().rstrip('=')
+        name = os.path.basename(urlsplit(url).path) or 'index'
+        return f'{self.prefix}/{token}.{self._signature(payload)}/{name}'
+
+    def resolve(self, token: str) -> tuple:
+        """Returns (kind, url, ttl) for a token of relay_url(), or None if it isn't one of ours."""
+        encoded, _, signature = token.partition('.')
+        try:
+            payload = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        except ValueError:
+            return None
+        # Compared as bytes: compare_digest rejects str with non-ASCII characters, which a client can send
+        if not hmac.compare_digest(signature.encode(), self._signature(payload).encode()):
+            return None
+        header, _, url = payload.decode().partition(':')
+        return header[:1], url, int(header[1:] or 0)
+
+    # Playlists
+
+    def playlist(self, url: str) -> str:
+        """
+        Returns the rewritten playlist at `url`, fetching it at most once per cache lifetime.
+
+        Raises:
+            RelayError: If the upstream answers with an error or isn't reachable.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._playlists.get(url)
+            if cached is not None and cached[0] > now:
+                RELAY_REQUESTS.inc(kind='playlist', result='hit')
+                return cached[1]
+            future = self._playlist_fetches.get(url)
+            leader = future is None
+            if leader:
+                future = self.background.submit(self._fetch_playlist(url))
+                self._playlist_fetches[url] = future
+        RELAY_REQUESTS.inc(kind='playlist', result='miss' if leader else 'coalesced')
+        try:
+            body, ttl = future.result(self.timeout.sock_read + 5)
+            if leader:
+                with self._lock:
+                    self._playlists[url] = (time.monotonic() + ttl, body)
+                    # Drop expired playlists of channels nobody watches any more
+                    if len(self._playlists) > 1000:
+                        self._playlists = {key: value for key, value in self._playlists.items() if value[0] > now}
+            return body
+        except RelayError:
+            raise
+        except Exception as e:
+            raise RelayError(f'Upstream request failed: {e}') from e
+        finally:
+            if leader:
+                with self._lock:
+                    self._playlist_fetches.pop(url, None)
+
+    async def _fetch_playlist(self, url: str) -> tuple:
+        """Fetches and rewrites a playlist; returns rewrite()'s (playlist, seconds to cache it)."""
+        await self.open()
+        async with await self._get(url) as response:
+            if response.status != 200:
+                raise RelayError(f'Upstream answered {response.status}', response.status if response.status < 500 else 502)
+            body = await response.content.read(MAX_PLAYLIST_BYTES + 1)
+            final_url = str(response.url)
+        if len(body) > MAX_PLAYLIST_BYTES:
+            raise RelayError('Playlist too large')
+        RELAY_UPSTREAM_BYTES.inc(len(body))
+        text = body.decode('utf-8', errors='replace')
+        if not text.lstrip('\ufeff \r\n').startswith('#EXTM3U'):
+            raise RelayError('Not an HLS playlist', 415)
+        return self.rewrite(text, final_url)
+
+    def rewrite(self, text: str, base_url: str) -> tuple:
+        """
+        Points every URI of a playlist at the relay; returns (playlist, seconds to cache it).
+
+        Segment URIs carry their cache lifetime, derived from their #EXTINF duration.
+        """
+        target = DEFAULT_SEGMENT_SECONDS
+        master = '#EXT-X-STREAM-INF' in text
+        finished = '#EXT-X-ENDLIST' in text
+        match = re.search(r'#EXT-X-TARGETDURATION:\s*([\d.]+)', text)
+        if match:
+            target = float(match.group(1))
+
+        def segment_ttl(seconds):
+            if finished:
+                return MAX_SEGMENT_TTL
+            return int(min(max(seconds * SEGMENT_TTL_FACTOR, MIN_SEGMENT_TTL), MAX_SEGMENT_TTL))
+
+        lines = []
+        duration = target
+        next_is_playlist = False
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped:
+                lines.append(line)
+            elif stripped.startswith('#'):
+                if stripped.startswith('#EXTINF:'):
+                    try:
+                        duration = float(stripped[8:].split(',', 1)[0])
+                    except ValueError:
+                        duration = target
+                elif stripped.startswith('#EXT-X-STREAM-INF'):
+                    next_is_playlist = True
+                if 'URI="' in stripped:
+                    kind = 'p' if stripped.startswith(PLAYLIST_URI_TAGS) else 's'
+                    ttl = 0 if kind == 'p' else segment_ttl(target)
+                    stripped = URI_ATTRIBUTE.sub(
+                        lambda m: f'URI="{self.relay_url(kind, urljoin(base_url, m.group(1)), ttl)}"', stripped)
+                lines.append(stripped)
+            else:
+                absolute = urljoin(base_url, stripped)
+                if next_is_playlist:
+                    lines.append(self.relay_url('p', absolute))
+                else:
+                    lines.append(self.relay_url('s', absolute, segment_ttl(duration)))
+                next_is_playlist = False
+                duration = target
+        if master:
+            ttl = MASTER_PLAYLIST_TTL
+        elif finished:
+            ttl = VOD_PLAYLIST_TTL
+        else:
+            ttl = min(max(target / 2, 1), MAX_LIVE_PLAYLIST_TTL)
+        return '\n'.join(lines) + '\n', ttl
+
+    # Segments
+
+    def segment(self, url: str, ttl: int):
+        """
+        Returns the segment at `url` as (source, content_type, body, length), where body is:
+
+        - bytes for source 'memory' and an open file for 'disk' (both from the cache)
+        - for 'fill' (a download in progress), an iterator over the body that
+          follows the download; length is None when the upstream didn't send one
+
+        Raises:
+            RelayError: If the upstream answers with an error or isn't reachable.
+        """
+        key = hashlib.sha256(url.encode()).hexdigest()
+        with self._lock:
+            fill = self._fills.get(key)
+            leader = fill is None
+            if leader:
+                hit = self.cache.get(key)
+                if hit is not None:
+                    RELAY_REQUESTS.inc(kind='segment', result=f'{hit[0]}_hit')
+                    source, content_type, body = hit
+                    length = len(body) if source == 'memory' else os.fstat(body.fileno()).st_size
+                    return source, content_type or segment_content_type(url), body, length
+                fill = SegmentFill(key, url, self.cache.folder)
+                self._fills[key] = fill
+            # Opened while the fill is registered, before its file can be cleaned up
+            f = fill.open()
+        RELAY_REQUESTS.inc(kind='segment', result='miss' if leader else 'coalesced')
+        if leader:
+            self.background.submit(self._fetch_segment(fill, ttl))
+        try:
+            fill.wait_ready()
+            if fill.status != 200:
+                raise RelayError(f'Upstream answered {fill.status}', fill.status if fill.status < 500 else 502)
+        except RelayError:
+            f.close()
+            raise
+        return 'fill', fill.content_type or segment_content_type(url), fill.iter_body(f), fill.content_length
+
+    async def _fetch_segment(self, fill: SegmentFill, ttl: int):
+        chunks = []
+        error = None
+        try:
+            await self.open()
+            async with await self._get(fill.url) as response:
+                # A compressed body is decompressed on the way, so its length doesn't apply
+                length = None if response.headers.get('Content-Encoding') else response.content_length
+                fill.start(response.status, response.headers.get('Content-Type'), length)
+                if response.status != 200:
+                    return
+                async for chunk in response.content.iter_chunked(CHUNK_BYTES):
+                    fill.append(chunk)
+                    RELAY_UPSTREAM_BYTES.inc(len(chunk))
+                    if fill.size > MAX_SEGMENT_BYTES:
+                        raise RelayError('Segment too large')
+                    if chunks is not None:
+                        chunks.append(chunk)
+                        if fill.size > self.cache.max_memory_item:
+                            chunks = None
+            if ttl:
+                expires = time.time() + ttl
+                fill.commit(self.cache.path_for(fill.key), expires)
+                self.cache.put(fill.key, expires, fill.content_type, b''.join(chunks) if chunks is not None else None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, RelayError, OSError) as e:
+            logger.warning("Relay fetch of %s failed: %s", fill.url, e)
+            error = e
+        finally:
+            fill.finish(error)
+            with self._lock:
+                self._fills.pop(fill.key, None)
+            if fill.path.endswith('.part'):
+                # Not cached (failed, or kept only while it was being read)
+                SegmentCache._remove(fill.path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            fetching = len(self._fills)
+            playlists = len(self._playlists)
+        return {**self.cache.stats(), 'segments_fetching': fetching, 'playlists_cached': playlists}
@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ShuttingDown(RuntimeError):
+    """Raised by JobManager.submit() once the manager is draining for shutdown."""
+
+
+class BackgroundLoop:
+    """
+    Runs a single long-lived asyncio event loop in a daemon thread.
+
+    Sync code (Flask views) hands coroutines to it with submit() instead of
+    creating and tearing down an event loop per request, which also lets
+    connection pools live across requests.
+    """
+    def __init__(self, name: str = 'background-loop'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                self._thread.start()
+                self._started = True
+
+    def submit(self, coro):
+        """Schedules `coro` on the loop and returns a concurrent.futures.Future for its result."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self, timeout: float = None):
+        if self._started:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
+
+
+class Job:
+    """
+    Progress and results of one background task.
+
+    Results are appended from the worker side and can be consumed incrementally by
+    any number of readers through iter_results(), which blocks until more results
+    arrive or the job finishes.
+    """
+    def __init__(self, kind: str, total: int, params: dict = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params or {}
+        self.total = total
+        self.completed = 0
+        self.counts = {}
+        self.state = 'queued'
+        self.error = None
+        self.summary = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.future = None
+        self._results = []
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ('done', 'failed')
+
+    def start(self):
+        with self._cond:
+            self.state = 'running'
+
+    def add_result(self, result: dict):
+        with self._cond:
+            self._results.append(result)
+            self.completed += 1
+            status = result.get('status')
+            if status:
+                self.counts[status] = self.counts.get(status, 0) + 1
+            self._cond.notify_all()
+
+    def finish(self, summary: dict = None, error: str = None):
+        with self._cond:
+            self.state = 'failed' if error else 'done'
+            self.summary = summary
+            self.error = error
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Blocks until the job has finished or `timeout` seconds have passed; returns whether it finished."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished, timeout)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'params': self.params,
+                'state': self.state,
+                'total': self.total,
+                'completed': self.completed,
+                'counts': dict(self.counts),
+                'summary': self.summary,
+                'error': self.error,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+            }
+
+    def results_since(self, start: int) -> list:
+        with self._cond:
+            return self._results[start:]
+
+    def iter_results(self, start: int = 0, poll: float = 15.0):
+        """
+        Yields results from index `start` onwards as they become available.
+
+        Yields None after `poll` seconds without new results so streaming
+        responses can emit a keep-alive, and returns once the job has finished
+        and every result has been yielded.
+        """
+        position = start
+        while True:
+            with self._cond:
+                if position >= len(self._results) and not self.finished:
+                    self._cond.wait(poll)
+                pending = self._results[position:]
+                finished = self.finished
+            if pending:
+                position += len(pending)
+                yield from pending
+            elif finished:
+                return
+            else:
+                yield None
+
+
+class StoredJob:
+    """
+    Read-only view of a job run by another process, read back from the store.
+
+    Offers the same snapshot() and iter_results() as Job, polling the store
+    for new results instead of waiting on a condition.
+    """
+    def __init__(self, store, job_id: str, poll_interval: float = 0.5):
+        self.store = store
+        self.id = job_id
+        self.poll_interval = poll_interval
+
+    def snapshot(self) -> dict:
+        return self.store.get_job(self.id)
+
+    def iter_results(self, start: int = 0, poll: float = 15.0):
+        position = start
+        idle = 0.0
+        while True:
+            snapshot = self.snapshot()
+            finished = snapshot is None or snapshot['state'] in ('done', 'failed')
+            pending = self.store.job_results(self.id, position)
+            if pending:
+                position += len(pending)
+                idle = 0.0
+                yield from pending
+            elif finished:
+                return
+            else:
+                time.sleep(self.poll_interval)
+                idle += self.poll_interval
+                if idle >= poll:
+                    idle = 0.0
+                    yield None
+
+
+class JobManager:
+    """
+    Creates jobs, runs their coroutines on a BackgroundLoop and keeps the most recent ones.
+
+    At most `max_jobs` jobs are retained; the oldest finished jobs are dropped first.
+    drain() stops accepting jobs and waits for the running ones, for a graceful
+    shutdown.
+
+    Given a storage.Store, jobs are also written to the database (their
+    snapshot and new results every `flush_interval` seconds while they run),
+    so every server process can report on and stream any job, whichever
+    process runs it.
+    """
+    def __init__(self, background: BackgroundLoop, max_jobs: int = 100, store=None, flush_interval: float = 1.0):
+        self.background = background
+        self.max_jobs = max_jobs
+        self.store = store
+        self.flush_interval = flush_interval
+        self.closed = False
+        self._jobs = OrderedDict()
+        self._persisted = {}
+        self._lock = threading.Lock()
+        # Serializes flushes so a periodic one can't overwrite the final snapshot
+        self._flush_lock = threading.Lock()
+
+    def get(self, job_id: str):
+        """Returns the Job with `job_id`, a StoredJob if another process runs it, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None and self.store.get_job(job_id) is not None:
+            return StoredJob(self.store, job_id)
+        return job
+
+    def active(self) -> list:
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.finished]
+
+    def submit(self, job: Job, coro_factory):
+        """
+        Registers `job` and runs `coro_factory(job)` on the background loop.
+
+        The coroutine reports progress through job.add_result() and its return
+        value becomes the job summary; an exception marks the job as failed.
+        """
+        with self._lock:
+            if self.closed:
+                raise ShuttingDown('The server is shutting down')
+            self._jobs[job.id] = job
+            self._evict()
+        if self.store is not None:
+            self._persisted[job.id] = 0
+            self.store.save_job(job.snapshot())
+            self.store.prune_jobs(self.max_jobs)
+
+        async def run():
+            job.start()
+            flusher = asyncio.ensure_future(self._flush_periodically(job)) if self.store is not None else None
+            try:
+                summary = await coro_factory(job)
+            except asyncio.CancelledError:
+                job.finish(error='cancelled')
+                raise
+            except Exception as e:
+                logger.exception("Job %s (%s) failed", job.id, job.kind)
+                job.finish(error=str(e))
+            else:
+                job.finish(summary=summary)
+            finally:
+                if flusher is not None:
+                    flusher.cancel()
+                    await asyncio.to_thread(self._flush, job)
+                    self._persisted.pop(job.id, None)
+
+        job.future = self.background.submit(run())
+        return job.future
+
+    async def _flush_periodically(self, job: Job):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.to_thread(self._flush, job)
+
+    def _flush(self, job: Job):
+        """Writes the job's new results and current snapshot to the store."""
+        with self._flush_lock:
+            start = self._persisted.get(job.id, 0)
+            results = job.results_since(start)
+            try:
+                if results:
+                    self.store.add_job_results(job.id, start, results)
+                    self._persisted[job.id] = start + len(results)
+                self.store.save_job(job.snapshot())
+            except Exception:
+                logger.exception("Could not save job %s", job.id)
+
+    def drain(self, timeout: float = None) -> list:
+        """
+        Stops accepting jobs and waits up to `timeout` seconds for the active ones to finish.
+
+        Jobs still running after that are cancelled; they are returned.
+        """
+        with self._lock:
+            self.closed = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        unfinished = []
+        for job in self.active():
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not job.wait(remaining):
+                unfinished.append(job)
+        for job in unfinished:
+            logger.warning("Cancelling job %s (%s) at shutdown", job.id, job.kind)
+            if job.future is not None:
+                job.future.cancel()
+        return unfinished
+
+    def _evict(self):
+        overflow = len(self._jobs) - self.max_jobs
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:max(overflow, 0)]:
+            del self._jobs[job_id]
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from health_cache import normalize_url
+from hls_probe import is_hls_url, probe_hls
+from metrics import Counter, Gauge, Histogram, Summary
+
+logger = logging.getLogger(__name__)
+
+# Statuses that are worth retrying; anything else is a definitive answer.
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# Statuses returned by servers that don't implement HEAD for the resource.
+HEAD_UNSUPPORTED_STATUSES = {400, 403, 405, 501}
+
+CHECKS_IN_FLIGHT = Gauge('iptv_link_checks_in_flight', 'Link checks currently holding a concurrency slot')
+CHECK_SECONDS = Histogram('iptv_link_check_duration_seconds', 'Duration of link checks, including retries',
+                          ('result',), buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+HOST_SECONDS = Summary('iptv_link_check_host_seconds', 'Duration of single probe requests per stream host',
+                       ('host',))
+PROBE_ERRORS = Counter('iptv_link_check_errors_total', 'Probe requests that failed without an HTTP status',
+                       ('reason',))
+
+
+class LinkChecker:
+    """
+    Checks stream URLs for liveness with bounded concurrency.
+
+    All requests share one aiohttp session whose connector caps the total number of
+    open connections and the number per host, and a global semaphore bounds how
+    many checks are in flight at once. Transient failures (timeouts, connection
+    errors, 5xx/429) are retried with exponential backoff, and servers that reject
+    HEAD can optionally be probed with a one-byte ranged GET instead.
+
+    With a HealthCache, recent results are reused across playlists and jobs, and
+    concurrent checks of the same normalized URL share a single request.
+
+    In deep mode, HLS URLs are probed like a player would start them (see
+    hls_probe.probe_hls) instead of with a HEAD request.
+
+    Use as an async context manager, or call check_many() which opens and closes a
+    session itself when none is active.
+    """
+    def __init__(self, concurrency: int = 64, per_host: int = 8, timeout: float = 10.0,
+                 connect_timeout: float = 5.0, retries: int = 2, backoff: float = 0.5,
+                 range_fallback: bool = True, user_agent: str = 'Mozilla/5.0 (IPTV link checker)',
+                 cache=None, variant_policy: str = 'lowest'):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.range_fallback = range_fallback
+        self.headers = {'User-Agent': user_agent}
+        self.cache = cache
+        self.variant_policy = variant_policy
+        self._session = None
+        self._semaphore = None
+        self._inflight = {}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host,
+                                             ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                  headers=self.headers)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        # Shared checks are shielded from their waiters, so they are cancelled here
+        pending = list(self._inflight.values())
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self._session
+
+    async def check_url(self, url: str, use_cache: bool = True, deep: bool = False) -> dict:
+        """
+        Checks a single URL and returns a dict with 'status' ('alive', 'dead' or
+        'unknown' for non-HTTP schemes), 'http_status', 'error' and 'elapsed_ms'.
+
+        Results served from the cache additionally carry 'cached': True. With
+        deep=True, HLS URLs are always probed and the result also carries the
+        stream metrics returned by probe_hls.
+        """
+        if not url:
+            return {'status': 'dead', 'http_status': None, 'error': 'missing url', 'elapsed_ms': 0}
+        if not url.startswith(('http://', 'https://')):
+            return {'status': 'unknown', 'http_status': None, 'error': 'unsupported scheme', 'elapsed_ms': 0}
+
+        if deep and is_hls_url(url):
+            return await self._deep_probe(url)
+
+        if use_cache and self.cache is not None:
+            cached = self.cache.get(url)
+            if cached is not None:
+                return {**cached, 'cached': True}
+
+        key = normalize_url(url)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._check(url))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so one cancelled waiter doesn't cancel the check for the others
+        return dict(await asyncio.shield(task))
+
+    async def _check(self, url: str) -> dict:
+        host = urlsplit(url).hostname or ''
+        async with self._semaphore:
+            CHECKS_IN_FLIGHT.inc()
+            started = time.monotonic()
+            http_status = None
+            error = None
+            try:
+                for attempt in range(self.retries + 1):
+                    if attempt:
+                        delay = self.backoff * (2 ** (attempt - 1))
+                        await asyncio.sleep(delay + random.uniform(0, delay / 2))
+                    attempt_started = time.monotonic()
+                    try:
+                        http_status = await self._probe(url)
+                        error = None
+                        if http_status not in RETRY_STATUSES:
+                            break
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        error = str(e) or type(e).__name__
+                        http_status = None
+                        PROBE_ERRORS.inc(reason='timeout' if isinstance(e, asyncio.TimeoutError) else 'connection')
+                    finally:
+                        HOST_SECONDS.observe(time.monotonic() - attempt_started, host=host)
+            finally:
+                CHECKS_IN_FLIGHT.dec()
+
+            elapsed_ms = int((time.monotonic() - started) * 1000)
+        alive = http_status is not None and 200 <= http_status < 400
+        CHECK_SECONDS.observe(elapsed_ms / 1000, result='alive' if alive else 'dead')
+        result = {
+            'status': 'alive' if alive else 'dead',
+            'http_status': http_status,
+            'error': error,
+            'elapsed_ms': elapsed_ms,
+        }
+        if self.cache is not None:
+            self.cache.put(url, result)
+        return result
+
+    async def _deep_probe(self, url: str) -> dict:
+        async with self._semaphore:
+            CHECKS_IN_FLIGHT.inc()
+            started = time.monotonic()
+            try:
+                result = await probe_hls(self._session, url, self.variant_policy)
+            finally:
+                CHECKS_IN_FLIGHT.dec()
+            result['elapsed_ms'] = int((time.monotonic() - started) * 1000)
+        CHECK_SECONDS.observe(result['elapsed_ms'] / 1000, result=result['status'])
+        if self.cache is not None:
+            self.cache.put(url, {key: result[key] for key in ('status', 'http_status', 'error', 'elapsed_ms')})
+        return result
+
+    async def _probe(self, url: str) -> int:
+        async with self._session.head(url, allow_redirects=True) as response:
+            status = response.status
+        if self.range_fallback and status in HEAD_UNSUPPORTED_STATUSES:
+            async with self._session.get(url, headers={'Range': 'bytes=0-0'}) as response:
+                status = response.status
+        return status
+
+    async def check_many(self, channels, on_result=None, use_cache: bool = True, deep: bool = False) -> list:
+        """
+        Checks every channel (dicts with a 'url' key) and returns them merged with their results.
+
+        Results are returned in input order; `on_result(channel, result)` is called
+        as each check completes, in completion order. Pass use_cache=False to
+        ignore cached results (fresh results are still stored), and deep=True to
+        probe HLS streams in depth.
+        """
+        owns_session = self._session is None
+        if owns_session:
+            await self.open()
+        try:
+            async def run(channel):
+                result = await self.check_url(channel.get('url', ''), use_cache, deep)
+                if on_result:
+                    on_result(channel, result)
+                return {**channel, **result}
+
+            return await asyncio.gather(*(run(channel) for channel in channels))
+        finally:
+            if owns_session:
+                await self.close()
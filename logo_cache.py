@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import aiohttp
+
+try:
+    from PIL import Image
+except ImportError:  # optional; without it logos are only served at their original size
+    Image = None
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+CHUNK_BYTES = 64 * 1024
+# Sizes (pixels, square) thumbnails are made in; requested sizes are rounded up to one of these
+THUMBNAIL_SIZES = (32, 48, 64, 96, 128, 256)
+# Files no logo refers to are only deleted once this old, so a fetch that
+# just wrote one but hasn't recorded it yet doesn't lose it
+UNUSED_FILE_SECONDS = 3600
+# Magic bytes of the image types served; other bodies (e.g. an HTML error
+# page answered with 200) are treated as failed fetches
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'\x00\x00\x01\x00', 'image/x-icon'),
+    (b'BM', 'image/bmp'),
+)
+
+LOGO_FETCHES = Counter('iptv_logo_fetches_total', 'Logo fetches from their origins, by outcome', ('result',))
+
+
+def sniff_image_type(body: bytes):
+    """Returns the content type of an image by its leading bytes, or None if it isn't one we serve."""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if body.startswith(signature):
+            return content_type
+    if body[:4] == b'RIFF' and body[8:12] == b'WEBP':
+        return 'image/webp'
+    head = body[:1024].lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if head.startswith((b'<svg', b'<?xml')) and b'<svg' in head:
+        return 'image/svg+xml'
+    return None
+
+
+def thumbnail_size(size: int) -> int:
+    """Rounds a requested thumbnail size up to one of THUMBNAIL_SIZES."""
+    for candidate in THUMBNAIL_SIZES:
+        if size <= candidate:
+            return candidate
+    return THUMBNAIL_SIZES[-1]
+
+
+class LogoCache:
+    """
+    Channel logos fetched once and served from a local, content-addressed disk cache.
+
+    Every logo URL has a row in the store (its validators, when it was last
+    checked and the sha256 digest of its content), and the content is a file
+    named after the digest, so channels sharing a logo, even under different
+    URLs, share one file, and every server process shares both. Logos are
+    revalidated with conditional requests (If-None-Match / If-Modified-Since)
+    once older than `max_age`; a failed fetch keeps serving the last good copy
+    and is retried after `retry_after` seconds, doubling per failure.
+
+    Fetches run on the shared background event loop, at most `concurrency` at
+    a time; concurrent requests for one URL share a single fetch.
+    """
+    def __init__(self, store, background, folder: str, concurrency: int = 8, timeout: float = 10.0,
+                 connect_timeout: float = 5.0, max_bytes: int = 1024 * 1024, max_age: float = 7 * 86400,
+                 retry_after: float = 3600, user_agent: str = 'Mozilla/5.0 (IPTV logo cache)'):
+        self.store = store
+        self.background = background
+        self.folder = folder
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.retry_after = retry_after
+        self.headers = {'User-Agent': user_agent, 'Accept': 'image/*'}
+        self._session = None
+        self._semaphore = None
+        # Fetches in progress by URL; only touched on the event loop
+        self._fetches = {}
+        os.makedirs(folder, exist_ok=True)
+        # Files and bytes in the folder, kept up to date as they change so /metrics doesn't scan it
+        self._lock = threading.Lock()
+        self._files, self._bytes = self._count()
+
+    async def open(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, headers=self.headers)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def path_for(self, digest: str, size: int = None) -> str:
+        return os.path.join(self.folder, f'{digest}-{size}.png' if size else digest)
+
+    def is_fresh(self, row: dict, now: float) -> bool:
+        """Tells whether a logo row was checked recently enough not to be fetched again yet."""
+        if row is None:
+            return False
+        if row['failures']:
+            return row['checked_at'] + min(self.retry_after * 2 ** (row['failures'] - 1), self.max_age) > now
+        return row['checked_at'] + self.max_age > now
+
+    # Fetching
+
+    async def refresh(self, url: str, row: dict = None) -> dict:
+        """Fetches a logo, joining a fetch of the same URL already in progress; see fetch()."""
+        task = self._fetches.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self.fetch(url, row))
+            self._fetches[url] = task
+            task.add_done_callback(lambda _: self._fetches.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def fetch(self, url: str, row: dict = None) -> dict:
+        """
+        Fetches a logo (conditionally, given the `row` of its last fetch) and records the outcome in the store.
+
+        Returns a dict with 'url', 'status' ('modified', 'not_modified' or
+        'error'), 'error', 'digest' and 'content_type' (of the last good copy,
+        if any, after an error), 'etag', 'last_modified', 'bytes' and 'checked_at'.
+        """
+        await self.open()
+        if row is None:
+            row = await asyncio.to_thread(self.store.get_logo, url)
+        result = {'url': url, 'status': 'error', 'error': None, 'digest': None, 'content_type': None,
+                  'etag': None, 'last_modified': None, 'bytes': 0}
+        headers = {}
+        if row is not None and row['digest']:
+            result.update(digest=row['digest'], content_type=row['content_type'],
+                          etag=row['etag'], last_modified=row['last_modified'])
+            # Validators only apply while we still have the content they validate
+            if os.path.exists(self.path_for(row['digest'])):
+                if row['etag']:
+                    headers['If-None-Match'] = row['etag']
+                if row['last_modified']:
+                    headers['If-Modified-Since'] = row['last_modified']
+        async with self._semaphore:
+            try:
+                async with self._session.get(url, headers=headers, allow_redirects=True) as response:
+                    if response.status == 304 and headers:
+                        result['status'] = 'not_modified'
+                    elif response.status != 200:
+                        result['error'] = f'HTTP {response.status}'
+                    else:
+                        body = await response.content.read(self.max_bytes + 1)
+                        if len(body) > self.max_bytes:
+                            raise ValueError(f'logo is larger than {self.max_bytes} bytes')
+                        content_type = sniff_image_type(body)
+                        if content_type is None:
+                            raise ValueError('not an image')
+                        digest = hashlib.sha256(body).hexdigest()
+                        self._write(digest, body)
+                        result.update(status='modified', digest=digest, content_type=content_type, bytes=len(body),
+                                      etag=response.headers.get('ETag'),
+                                      last_modified=response.headers.get('Last-Modified'))
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+                result['error'] = str(e) or type(e).__name__
+        result['checked_at'] = time.time()
+        LOGO_FETCHES.inc(result=result['status'])
+        await asyncio.to_thread(self.store.record_logo, url, result)
+        return result
+
+    def _write(self, digest: str, body: bytes):
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            # Same content, e.g. one logo under several URLs; just mark it as in use
+            os.utime(path)
+            return
+        tmp_path = f'{path}.{os.getpid()}.part'
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        self._counted(1, len(body))
+
+    async def prefetch(self, urls: list, on_result=None) -> dict:
+        """
+        Fetches the logos among `urls` that were never fetched or are due for revalidation.
+
+        `on_result(result)` is called with the result of every fetch. Returns
+        the number of logos per fetch status, and of those still 'fresh'.
+        """
+        rows = await asyncio.to_thread(self.store.get_logos, urls)
+        now = time.time()
+        due = [url for url in urls if not self.is_fresh(rows.get(url), now)]
+        counts = {'fresh': len(urls) - len(due)}
+
+        async def fetch_one(url):
+            result = await self.refresh(url, rows.get(url))
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            if on_result is not None:
+                on_result(result)
+        # Each fetch waits for the semaphore, so at most `concurrency` run at once
+        await asyncio.gather(*(fetch_one(url) for url in due))
+        return counts
+
+    # Serving
+
+    def lookup(self, url: str) -> dict:
+        """
+        Returns the logo row of `url` if its content is cached, or None.
+
+        Never waits for the origin: a logo never fetched (or whose file has
+        gone) is fetched in the background for later requests, and a stale
+        one is returned as it is and revalidated in the background.
+        """
+        row = self.store.get_logo(url)
+        now = time.time()
+        cached = row is not None and row['digest'] and os.path.exists(self.path_for(row['digest']))
+        if (row is not None and row['digest'] and not cached) or not self.is_fresh(row, now):
+            # Concurrent requests for one logo share the fetch (see refresh())
+            self.background.submit(self.refresh(url, row))
+        return row if cached else None
+
+    def thumbnail(self, digest: str, size: int):
+        """
+        Returns the path of a PNG of the logo scaled down to fit `size`×`size` pixels, made on first use.
+
+        Returns None without Pillow, or for a logo it can't decode (e.g. SVG).
+        """
+        if Image is None:
+            return None
+        path = self.path_for(digest, size)
+        if os.path.exists(path):
+            return path
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+        try:
+            with Image.open(self.path_for(digest)) as image:
+                image.thumbnail((size, size))
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA')
+                image.save(tmp_path, 'PNG', optimize=True)
+            os.replace(tmp_path, path)
+            self._counted(1, os.path.getsize(path))
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning("Could not make a %spx thumbnail of logo %s: %s", size, digest, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        return path
+
+    def prune(self) -> int:
+        """Forgets the logos no channel uses any more and deletes their files; returns the files deleted."""
+        live = self.store.prune_logos()
+        cutoff = time.time() - UNUSED_FILE_SECONDS
+        removed = 0
+        files = size = 0
+        for entry in os.scandir(self.folder):
+            digest = entry.name.split('-', 1)[0].split('.', 1)[0]
+            try:
+                stat = entry.stat()
+                if digest not in live and stat.st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+                    continue
+            except FileNotFoundError:
+                continue
+            files += 1
+            size += stat.st_size
+        # The scan also picks up the files other processes wrote since the last one
+        with self._lock:
+            self._files, self._bytes = files, size
+        return removed
+
+    def _count(self) -> tuple:
+        """Scans the folder; returns its number of files and their total size."""
+        files = 0
+        size = 0
+        for entry in os.scandir(self.folder):
+            try:
+                size += entry.stat().st_size
+            except FileNotFoundError:
+                continue
+            files += 1
+        return files, size
+
+    def _counted(self, files: int, size: int):
+        with self._lock:
+            self._files += files
+            self._bytes += size
+
+    def stats(self) -> dict:
+        """Returns the files and bytes in the cache, as of this process's last write or prune()."""
+        with self._lock:
+            return {'files': self._files, 'bytes': self._bytes}
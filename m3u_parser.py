@@ -1,23 +1,75 @@
+import io
 import re
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Matches key="value" pairs or key=value (unquoted) pairs in an #EXTINF line.
+# Compiled once at import; it captures:
+# group 1: key (e.g., tvg-id)
+# group 2: quoted value (e.g., value from "value"), empty if unquoted
+# group 3: unquoted value (e.g., value from value), empty if quoted
+ATTR_PATTERN = re.compile(r'([a-zA-Z0-9\-]+)=(?:"([^"]*)"|([^\s,]+))')
+
+# Maps the EXTINF attributes that are kept to their stream dictionary keys
+ATTR_FIELDS = {
+    "tvg-id": "tvg_id",
+    "tvg-name": "tvg_name",
+    "tvg-logo": "tvg_logo",
+    "group-title": "group_title",
+}
+
+EXTM3U_HEADER = "#EXTM3U"
+EXTINF_PREFIX = "#EXTINF:"
+EXTVLCOPT_PREFIX = "#EXTVLCOPT:"
+EXTGRP_PREFIX = "#EXTGRP:"
+
+
+def _split_title(line_content: str) -> tuple:
+    """
+    Splits EXTINF content at the comma that starts the channel title.
+
+    Commas inside quoted attribute values (e.g. a quoted user-agent) are skipped;
+    the title itself may contain any number of commas. Returns (head, title),
+    where title is None if there is no separating comma.
+    """
+    comma = line_content.find(',')
+    quote = line_content.find('"')
+    while comma != -1 and quote != -1 and quote < comma:
+        # The comma may sit inside the quoted value that starts at `quote`
+        closing = line_content.find('"', quote + 1)
+        if closing == -1:
+            break
+        comma = line_content.find(',', closing + 1)
+        quote = line_content.find('"', closing + 1)
+    if comma == -1:
+        return line_content, None
+    return line_content[:comma], line_content[comma + 1:]
+
+
 class M3UParser:
     """
     Parses M3U and M3U8 playlists.
     
     The parser extracts stream information including duration, attributes (tvg-id, 
-    tvg-name, tvg-logo, group-title), channel title, and stream URL.
+    tvg-name, tvg-logo, group-title, plus any others such as catchup), channel title,
+    #EXTVLCOPT options, #EXTGRP groups and stream URL.
     It is designed to be resilient to extra whitespace and common M3U format variations.
+
+    Use parse() for content already in memory, or iter_parse() to stream entries
+    from a file object line by line with flat memory use.
     """
     def __init__(self):
         """Initializes the M3UParser."""
+        self.header_attributes = {}
         self.reset()
 
     def reset(self):
         """Resets the parser's internal state for parsing a new M3U content."""
         self._streams = []
+        # Attributes of the #EXTM3U header line (e.g. x-tvg-url, the playlist's guide URL).
+        # Cleared in place, so a reference taken before iter_parse() sees the new values.
+        self.header_attributes.clear()
         # Holds data for the current #EXTINF line before its associated URL is found.
         # Cleared after a stream (EXTINF + URL) is successfully parsed and stored.
         self._current_stream_info = {} 
@@ -29,81 +81,69 @@ class M3UParser:
         Example line: #EXTINF:-1 tvg-id="id" tvg-name="name" group-title="group",Channel Title
         """
         # Remove the #EXTINF: prefix and strip whitespace
-        line_content = line[len("#EXTINF:"):].strip()
+        line_content = line[len(EXTINF_PREFIX):].strip()
 
         # Initialize default values for the current stream's information
         duration = -1
-        tvg_id = None
-        tvg_name = None
-        tvg_logo = None
-        group_title = None
         name = None  # This is the channel title, found after the first comma
 
-        # Split the line_content by the first comma.
+        # Split the line_content at the first comma outside quoted attribute values.
         # The part before the comma contains duration and key-value attributes.
         # The part after the comma is the channel name/title.
-        parts = line_content.split(',', 1)
-        duration_and_attributes_str = parts[0].strip()
+        duration_and_attributes_str, title = _split_title(line_content)
+        duration_and_attributes_str = duration_and_attributes_str.strip()
         
-        if len(parts) > 1:
-            name = parts[1].strip() 
+        if title is not None:
+            name = title.strip() 
         # If no comma exists, 'name' remains None, indicating no explicit title in the EXTINF line.
 
         # From the duration_and_attributes_str, extract the duration first.
         # Duration is expected to be the first token, separated by a space from attributes.
         sub_parts = duration_and_attributes_str.split(' ', 1)
-        duration_str = sub_parts[0].strip()
-
-        try:
-            if duration_str:  # Ensure it's not an empty string
-                # Convert to float first to handle potential decimal values (e.g., "0.0")
-                # then to int.
-                duration = int(float(duration_str))
-        except ValueError:
-            logger.warning(
-                f"Invalid duration '{duration_str}' in EXTINF line: '{line}'. Using default -1."
-            )
-            # duration remains -1 (the default initialized value)
+        duration_str = sub_parts[0]
+
+        if duration_str:  # Ensure it's not an empty string
+            try:
+                duration = int(duration_str)
+            except ValueError:
+                try:
+                    # Fall back to float to handle decimal values (e.g., "0.0"), then to int.
+                    duration = int(float(duration_str))
+                except ValueError:
+                    logger.warning(
+                        "Invalid duration '%s' in EXTINF line: '%s'. Using default -1.", duration_str, line
+                    )
+                    # duration remains -1 (the default initialized value)
 
-        attributes_str = ""
-        if len(sub_parts) > 1:
-            attributes_str = sub_parts[1].strip()
-
-        if attributes_str:
-            # Regex to find all key="value" pairs or key=value (unquoted) pairs.
-            # It captures:
-            # group 1: key (e.g., tvg-id)
-            # group 2: full value assignment (e.g., "value" or value)
-            # group 3: quoted value (e.g., value from "value")
-            # group 4: unquoted value (e.g., value from value)
-            attr_pattern = re.compile(r'([a-zA-Z0-9\-]+)=("([^"]*)"|([^\s,]+))')
-            for match in attr_pattern.finditer(attributes_str):
-                key = match.group(1).lower().strip()
-                # Prioritize quoted value (group 3), fallback to unquoted (group 4)
-                value = match.group(3) if match.group(3) is not None else match.group(4)
-                value = value.strip() # Clean the extracted value
-
-                if key == "tvg-id":
-                    tvg_id = value
-                elif key == "tvg-name":
-                    tvg_name = value
-                elif key == "tvg-logo":
-                    tvg_logo = value
-                elif key == "group-title":
-                    group_title = value
-        
         # Store the parsed information. The URL will be added by the main parse loop
         # when it encounters the next non-directive line.
-        self._current_stream_info = {
+        info = {
             "name": name,
             "url": None, 
             "duration": duration,
-            "tvg_id": tvg_id,
-            "tvg_name": tvg_name,
-            "tvg_logo": tvg_logo,
-            "group_title": group_title,
+            "tvg_id": None,
+            "tvg_name": None,
+            "tvg_logo": None,
+            "group_title": None,
+            "attributes": {},
+            "vlc_options": {},
         }
 
+        if len(sub_parts) > 1:
+            attributes = info["attributes"]
+            for key, quoted, unquoted in ATTR_PATTERN.findall(sub_parts[1]):
+                key = key.lower()
+                # Exactly one of the quoted/unquoted groups is non-empty (a quoted value may be "")
+                value = (unquoted or quoted).strip()
+                field = ATTR_FIELDS.get(key)
+                if field:
+                    info[field] = value
+                else:
+                    # Everything else (catchup, catchup-source, tvg-chno, user-agent, ...)
+                    attributes[key] = value
+        
+        self._current_stream_info = info
+
     def parse(self, content: str) -> list[dict]:
         """
         Parses the M3U/M3U8 content string and returns a list of stream information.
@@ -114,73 +154,120 @@ class M3UParser:
         Returns:
             A list of dictionaries, where each dictionary represents a stream
             and contains keys: 'name', 'url', 'duration', 'tvg_id', 
-            'tvg_name', 'tvg_logo', 'group_title'.
+            'tvg_name', 'tvg_logo', 'group_title', 'attributes' (all other EXTINF
+            attributes) and 'vlc_options' (from #EXTVLCOPT:key=value lines).
+            An #EXTGRP line following the EXTINF supplies 'group_title' when the
+            EXTINF has no group-title attribute.
+
+        Raises:
+            ValueError: If the M3U content is invalid (e.g., missing #EXTM3U header).
+        """
+        self._streams = list(self.iter_parse(io.StringIO(content)))
+        return self._streams
+
+    def iter_parse(self, fileobj):
+        """
+        Parses an M3U/M3U8 playlist from a file object, yielding each stream as it is completed.
+
+        Lines are read one at a time, so memory use does not grow with the size of
+        the playlist. Binary file objects are decoded as UTF-8, ignoring errors.
+
+        Args:
+            fileobj: A text or binary file object (or any iterable of lines).
+
+        Yields:
+            Dictionaries with the same keys as the ones returned by parse().
+            The attributes of the #EXTM3U line are in header_attributes once
+            the first entry has been yielded.
 
         Raises:
             ValueError: If the M3U content is invalid (e.g., missing #EXTM3U header).
         """
         self.reset() # Ensure parser is in a clean state
-        lines = content.splitlines()
+        debug = logger.isEnabledFor(logging.DEBUG)
 
-        # Check for the #EXTM3U header
-        if not lines or lines[0].strip() != "#EXTM3U":
+        if isinstance(fileobj, (io.RawIOBase, io.BufferedIOBase)):
+            # Decoding in bulk is much cheaper than decoding each line
+            fileobj = io.TextIOWrapper(fileobj, encoding='utf-8', errors='ignore')
+        lines = iter(fileobj)
+
+        # Check for the #EXTM3U header (a UTF-8 BOM is tolerated), which may carry
+        # attributes such as x-tvg-url="..." url-tvg="..."
+        header = next(lines, '')
+        if isinstance(header, bytes):
+            header = header.decode('utf-8', errors='ignore')
+        header = header.strip().lstrip('\ufeff')
+        if header != EXTM3U_HEADER and not (header.startswith(EXTM3U_HEADER) and header[len(EXTM3U_HEADER)].isspace()):
             raise ValueError("Invalid M3U file: Missing or incorrect #EXTM3U header.")
+        for key, quoted, unquoted in ATTR_PATTERN.findall(header[len(EXTM3U_HEADER):]):
+            self.header_attributes[key.lower()] = (unquoted or quoted).strip()
 
-        for line_number, line_text in enumerate(lines):
+        for line_number, line_text in enumerate(lines, 2):
+            if isinstance(line_text, bytes):
+                line_text = line_text.decode('utf-8', errors='ignore')
             line = line_text.strip()
 
             if not line:  # Skip empty lines
                 continue
 
-            if line.startswith("#EXTINF:"):
+            if line[0] != "#":
+                # Not a directive or empty line, so it should be a URL.
+                # Check if we have pending stream information from a preceding #EXTINF.
+                # "duration" being not None implies _parse_extinf_line was successfully called.
+                if self._current_stream_info.get("duration") is not None:
+                    self._current_stream_info["url"] = line
+                    yield self._current_stream_info
+                    self._current_stream_info = {} # Reset for the next stream entry
+                else:
+                    # This URL does not follow an #EXTINF line or the #EXTINF line was malformed
+                    # to the point that _current_stream_info was not properly set up.
+                    logger.warning(
+                        "Found URL '%s' at line %d without a valid preceding "
+                        "#EXTINF directive. Ignoring this URL.", line, line_number
+                    )
+
+            elif line.startswith(EXTINF_PREFIX):
                 # If _current_stream_info has data from a previous #EXTINF line 
                 # but no URL was found for it, that #EXTINF was orphaned.
                 # Log this situation and discard the orphaned data before parsing the new line.
                 # "duration" is a reliable indicator that _parse_extinf_line was called.
-                if self._current_stream_info.get("duration") is not None and \
-                   self._current_stream_info.get("url") is None:
+                if self._current_stream_info.get("duration") is not None:
                     logger.warning(
-                        f"Orphaned #EXTINF data (no URL followed, found at line {line_number+1}): "
-                        f"{self._current_stream_info}"
+                        "Orphaned #EXTINF data (no URL followed, found at line %d): %s",
+                        line_number, self._current_stream_info
                     )
                 
                 self._parse_extinf_line(line) # Sets _current_stream_info
 
-            elif line.startswith("#"):
-                # This is some other M3U directive (e.g., #EXTGRP, #EXTVLCOPT) or a comment.
-                # As per requirements, these are logged and ignored if not #EXTINF.
+            elif line.startswith(EXTVLCOPT_PREFIX):
+                # Player options for the pending stream, e.g. #EXTVLCOPT:http-user-agent=...
+                if self._current_stream_info.get("duration") is not None:
+                    key, _, value = line[len(EXTVLCOPT_PREFIX):].partition("=")
+                    self._current_stream_info["vlc_options"][key.strip()] = value.strip()
+
+            elif line.startswith(EXTGRP_PREFIX):
+                # Group of the pending stream; an explicit group-title attribute wins
+                info = self._current_stream_info
+                if info.get("duration") is not None and not info["group_title"]:
+                    info["group_title"] = line[len(EXTGRP_PREFIX):].strip() or None
+
+            elif debug:
+                # This is some other M3U directive or a comment.
+                # These are ignored if not #EXTINF, and only logged at DEBUG level since
+                # formatting a message per line dominates parse time on large playlists.
                 # This directive does not clear _current_stream_info, allowing an #EXTINF
                 # to be followed by other metadata lines before its URL.
-                logger.info(
-                    f"Ignoring M3U directive or comment at line {line_number+1}: '{line}'"
-                )
-            
-            else: # Not a directive or empty line, so it should be a URL
-                # Check if we have pending stream information from a preceding #EXTINF.
-                # "duration" being not None implies _parse_extinf_line was successfully called.
-                if self._current_stream_info.get("duration") is not None:
-                    self._current_stream_info["url"] = line
-                    self._streams.append(self._current_stream_info)
-                    self._current_stream_info = {} # Reset for the next stream entry
-                else:
-                    # This URL does not follow an #EXTINF line or the #EXTINF line was malformed
-                    # to the point that _current_stream_info was not properly set up.
-                    logger.warning(
-                        f"Found URL '{line}' at line {line_number+1} without a valid preceding "
-                        f"#EXTINF directive. Ignoring this URL."
-                    )
-        
+                logger.debug("Ignoring M3U directive or comment at line %d: '%s'", line_number, line)
+
+
         # After processing all lines, check if the last #EXTINF is orphaned 
         # (i.e., the file ended with an #EXTINF line without a subsequent URL).
-        if self._current_stream_info.get("duration") is not None and \
-           self._current_stream_info.get("url") is None:
+        if self._current_stream_info.get("duration") is not None:
             logger.warning(
-                f"Orphaned #EXTINF data at end of file (no URL followed): "
-                f"{self._current_stream_info}"
+                "Orphaned #EXTINF data at end of file (no URL followed): %s",
+                self._current_stream_info
             )
 
-        return self._streams
-
 # Example usage (can be uncommented for testing locally)
 # if __name__ == '__main__':
 #     logging.basicConfig(level=logging.INFO)
@@ -247,5 +334,3 @@ class M3UParser:
 #         # {'name': 'Channel Three', 'url': 'http://server.com/stream3', 'duration': -1, 'tvg_id': 'channel3', 'tvg_name': None, 'tvg_logo': None, 'group_title': None}
 #     except ValueError as e:
 #         print(f"Error parsing snippet: {e}")
-
-```
@@ -0,0 +1,259 @@
+import math
+import threading
+import time
+
+# Default latency buckets (seconds) of Histogram
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Label values beyond this many per metric are folded into OVERFLOW_LABEL,
+# so an unbounded label (e.g. a host name) can't grow the output without limit
+MAX_LABEL_SETS = 500
+OVERFLOW_LABEL = 'other'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """
+    Base of the metric types: a named family of samples keyed by label values.
+
+    Metrics register themselves in `registry` (REGISTRY by default) when
+    created, and are rendered in the Prometheus text exposition format by
+    Registry.render().
+
+    With `function`, the value is computed at render time instead (for
+    counts kept elsewhere, e.g. cache hits): the function returns a number, or
+    a dict mapping label values (a tuple, or a string for one label) to numbers.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry=None, function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        if key not in self._values and len(self._values) >= MAX_LABEL_SETS:
+            key = (OVERFLOW_LABEL,) * len(self.labelnames)
+        return key
+
+    def samples(self):
+        """Yields (suffix, label values, extra label, value) tuples."""
+        if self.function is not None:
+            value = self.function()
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    yield '', key if isinstance(key, tuple) else (key,), '', item
+            elif value is not None:
+                yield '', (), '', value
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', key, '', value
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Summary(Metric):
+    """Count and sum of observations (e.g. per-host latency, where a histogram per label would be too large)."""
+    kind = 'summary'
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            key = self._key(labels)
+            count, total = self._values.get(key, (0, 0.0))
+            self._values[key] = (count + 1, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, (count, total) in items:
+            yield '_count', key, '', count
+            yield '_sum', key, '', total
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, plus their count and sum."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry=None,
+                 buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            key = self._key(labels)
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += 1
+            entry[2] += value
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), count, total)) for key, (counts, count, total) in self._values.items()]
+        for key, (counts, count, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', key, f'le="{_format_value(float(bound))}"', cumulative
+            yield '_count', key, '', count
+            yield '_sum', key, '', total
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class StageTimer:
+    """
+    Times the stages of one operation (e.g. an ingest) and reports them to a Histogram with a 'stage' label.
+
+    stage(name) times a block; iterate(iterable, name) times how long a lazily
+    consumed iterable takes to produce its items. Streaming pipelines run
+    several stages at once (a store write pulls items from the parser), so
+    stage() can exclude the time of other stages that ran inside its block.
+    """
+    def __init__(self, histogram: Histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.timings = {}
+
+    def _add(self, name: str, seconds: float):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def stage(self, name: str, excluding: tuple = ()):
+        return _Stage(self, name, excluding)
+
+    def iterate(self, iterable, name: str):
+        iterator = iter(iterable)
+        clock = time.perf_counter
+        while True:
+            started = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._add(name, clock() - started)
+                return
+            self._add(name, clock() - started)
+            yield item
+
+    def observe(self) -> dict:
+        """Reports every stage to the histogram and returns the timings in seconds."""
+        for name, seconds in self.timings.items():
+            self.histogram.observe(seconds, stage=name, **self.labels)
+        return {name: round(seconds, 3) for name, seconds in self.timings.items()}
+
+
+class _Stage:
+    def __init__(self, timer: StageTimer, name: str, excluding: tuple):
+        self.timer = timer
+        self.name = name
+        self.excluding = excluding
+
+    def _excluded(self) -> float:
+        return sum(self.timer.timings.get(name, 0.0) for name in self.excluding)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.excluded = self._excluded()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started - (self._excluded() - self.excluded)
+        self.timer._add(self.name, elapsed)
+
+
+class Registry:
+    """The metrics exposed together on one /metrics endpoint."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
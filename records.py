@@ -0,0 +1,92 @@
+import sys
+
+from timestamps import format_timestamp
+
+_intern = sys.intern
+
+
+def intern_value(value):
+    """Interns a short, repeated string (channel id, category) so equal values share one object."""
+    return _intern(value) if value else value
+
+
+class Programme:
+    """
+    A single EPG programme.
+
+    Slotted, so an instance carries no per-object __dict__, and the channel id
+    and category are interned since a few values repeat across hundreds of
+    thousands of programmes (titles are free text, and would only grow the
+    process-wide intern table). Start and stop are UTC epoch seconds (stop may
+    be None); to_dict() formats them as ISO-8601 at the API boundary.
+    """
+    __slots__ = ('channel', 'start', 'stop', 'title', 'description', 'category', 'episode')
+
+    FIELDS = __slots__
+
+    def __init__(self, channel, start, stop=None, title='No Title', description='', category='', episode=''):
+        self.channel = _intern(channel)
+        self.start = start
+        self.stop = stop
+        self.title = title
+        self.description = description
+        self.category = intern_value(category)
+        self.episode = episode
+
+    def to_dict(self) -> dict:
+        return {
+            'start': format_timestamp(self.start),
+            'stop': format_timestamp(self.stop),
+            'channel': self.channel,
+            'title': self.title,
+            'description': self.description,
+            'category': self.category,
+            'episode': self.episode,
+        }
+
+    def __repr__(self):
+        return f"Programme({self.channel!r}, {self.start!r}, {self.title!r})"
+
+
+class Channel:
+    """
+    A playlist channel as parsed from an M3U entry.
+
+    Slotted like Programme. Channels are streamed into the store as they are
+    parsed and dropped, so nothing is interned.
+    """
+    __slots__ = ('name', 'url', 'logo', 'group', 'tvg_id', 'tvg_name', 'attributes', 'vlc_options', 'status')
+
+    def __init__(self, name, url, logo=None, group=None, tvg_id=None, tvg_name=None,
+                 attributes=None, vlc_options=None, status=None):
+        self.name = name
+        self.url = url
+        self.logo = logo
+        self.group = group
+        self.tvg_id = tvg_id
+        self.tvg_name = tvg_name
+        self.attributes = attributes or None
+        self.vlc_options = vlc_options or None
+        self.status = status
+
+    @classmethod
+    def from_stream(cls, stream: dict):
+        """Builds a Channel from an M3UParser stream dictionary."""
+        return cls(
+            stream['name'] or stream['tvg_name'] or 'Unnamed Channel',
+            stream['url'],
+            logo=stream['tvg_logo'],
+            group=stream['group_title'],
+            tvg_id=stream['tvg_id'],
+            tvg_name=stream['tvg_name'],
+            attributes=stream['attributes'],
+            vlc_options=stream['vlc_options'],
+        )
+
+    def get(self, key, default=None):
+        """Dict-style access, so records and dicts can be used interchangeably."""
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __repr__(self):
+        return f"Channel({self.name!r}, {self.url!r})"
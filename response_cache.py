@@ -0,0 +1,129 @@
+import gzip
+import json
+import logging
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:  # optional; without it responses are served as gzip or identity
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Payloads smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+class CachedResponse:
+    """
+    A serialized JSON payload together with its pre-compressed variants.
+
+    `encoded` maps a content coding ('br', 'gzip') to its compressed body; the
+    identity body is always available as `body`. Variants that would not be
+    smaller than the identity body are not kept.
+    """
+    __slots__ = ('version', 'body', 'encoded', 'built_ms')
+
+    def __init__(self, version, body: bytes, gzip_level: int = 6, brotli_quality: int = 5):
+        started = time.monotonic()
+        self.version = version
+        self.body = body
+        self.encoded = {}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            if brotli is not None:
+                self.encoded['br'] = brotli.compress(body, quality=brotli_quality)
+            self.encoded['gzip'] = gzip.compress(body, compresslevel=gzip_level, mtime=0)
+            self.encoded = {coding: data for coding, data in self.encoded.items() if len(data) < len(body)}
+        self.built_ms = int((time.monotonic() - started) * 1000)
+
+    @property
+    def encodings(self) -> list:
+        """Content codings available for this payload, most compact first."""
+        return list(self.encoded)
+
+    def select(self, encoding: str) -> bytes:
+        """Returns the body for a negotiated content coding, or the identity body."""
+        return self.encoded.get(encoding, self.body)
+
+
+class ResponseCache:
+    """
+    Per-version cache of serialized, pre-compressed JSON responses.
+
+    Each entry is keyed by a name (e.g. 'channels:position') and tagged with the
+    store version counter the payload was built from. A lookup with a newer
+    version misses, so entries never need to be invalidated for correctness;
+    invalidate() just drops payloads early once the data they describe has been
+    replaced. Payloads are serialized and compressed once, so serving a hit
+    costs no JSON encoding or compression at all.
+    """
+    def __init__(self, gzip_level: int = 6, brotli_quality: int = 5):
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def get(self, key: str, version):
+        """Returns the CachedResponse for `key` built at `version`, or None."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def put(self, key: str, version, payload) -> CachedResponse:
+        """Serializes and compresses `payload` and caches it as `key` at `version`."""
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        entry = CachedResponse(version, body, self.gzip_level, self.brotli_quality)
+        with self._lock:
+            self._entries[key] = entry
+        logger.debug("Cached %s at version %s: %d bytes, encodings %s, built in %d ms",
+                     key, version, len(body), entry.encodings, entry.built_ms)
+        return entry
+
+    def get_or_build(self, key: str, version, build) -> CachedResponse:
+        """
+        Returns the cached response for `key` at `version`, calling `build()` for the payload on a miss.
+
+        Builds are serialized, so concurrent misses on a cold entry produce one
+        payload instead of one per request.
+        """
+        entry = self.get(key, version)
+        if entry is not None:
+            return entry
+        with self._build_lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                return entry
+            return self.put(key, version, build())
+
+    def invalidate(self, prefix: str = ''):
+        """Drops every entry whose key starts with `prefix` (all entries by default)."""
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = {
+                key: {
+                    'version': entry.version,
+                    'bytes': len(entry.body),
+                    'encoded_bytes': {coding: len(data) for coding, data in entry.encoded.items()},
+                    'built_ms': entry.built_ms,
+                }
+                for key, entry in self._entries.items()
+            }
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'brotli': brotli is not None,
+        }
@@ -0,0 +1,50 @@
+// server-channels-tests.js
+function runServerChannelsTests() {
+    let results = [];
+    const serverChannels = new ServerChannels();
+
+    // --- Helper for assertions ---
+    function assert(condition, message, testName) {
+        if (condition) {
+            results.push({ name: testName, passed: true });
+        } else {
+            results.push({ name: testName, passed: false, error: message });
+        }
+    }
+
+    // --- Test Case 1: Stored HLS channels keep their relay URL ---
+    const testRelayUrl = () => {
+        // A channel as /api/channels returns it
+        const ch = serverChannels.toPlayerChannel({
+            id: 7, playlist: 'news.m3u', name: 'News 24', url: 'http://cdn.example/news/index.m3u8',
+            logo: 'http://cdn.example/news.png', group: 'News', tvg_id: 'news24.us', tvg_name: 'News 24',
+            status: null, relay_url: '/relay/index.m3u8?channel=7', logo_url: '/logo/7',
+        });
+        assert(ch.relay_url === '/relay/index.m3u8?channel=7', `Expected relay_url "/relay/index.m3u8?channel=7", got "${ch.relay_url}"`, "Stored Channel: Relay URL");
+        assert(ch.url === 'http://cdn.example/news/index.m3u8', `Expected the stream URL, got "${ch.url}"`, "Stored Channel: Stream URL");
+        assert(ch.tvg_id === 'news24.us', `Expected tvg_id "news24.us", got "${ch.tvg_id}"`, "Stored Channel: TVG ID");
+        assert(ch.tvg_logo === 'http://cdn.example/news.png', `Expected tvg_logo of the stored logo, got "${ch.tvg_logo}"`, "Stored Channel: TVG Logo");
+        assert(ch.group_title === 'News', `Expected group_title "News", got "${ch.group_title}"`, "Stored Channel: Group Title");
+        assert(ch.logo_url === '/logo/7', `Expected logo_url "/logo/7", got "${ch.logo_url}"`, "Stored Channel: Logo URL");
+    };
+    try { testRelayUrl(); } catch (e) { results.push({ name: "Relay URL Suite", passed: false, error: e.toString() }); }
+
+    // --- Test Case 2: Channels the server doesn't relay play directly ---
+    const testNoRelayUrl = () => {
+        const ch = serverChannels.toPlayerChannel({ id: 8, name: 'Radio', url: 'http://cdn.example/radio.mp3' });
+        assert(ch.relay_url === null, `Expected no relay_url, got "${ch.relay_url}"`, "Unrelayed Channel: No Relay URL");
+        assert(ch.logo_url === null, `Expected no logo_url, got "${ch.logo_url}"`, "Unrelayed Channel: No Logo URL");
+        assert(ch.tvg_id === null && ch.group_title === null, "Missing fields should be null", "Unrelayed Channel: Missing Fields");
+    };
+    try { testNoRelayUrl(); } catch (e) { results.push({ name: "No Relay URL Suite", passed: false, error: e.toString() }); }
+
+    // --- Test Case 3: Playlist names the server accepts ---
+    const testPlaylistName = () => {
+        assert(serverChannels.playlistName('us.m3u') === 'us.m3u', "File names keep their extension", "Playlist Name: File");
+        assert(serverChannels.playlistName('https://iptv-org.github.io/iptv/countries/us.m3u?v=2') === 'us.m3u', "URLs are named after their last path segment", "Playlist Name: URL");
+        assert(serverChannels.playlistName('http://example.com/get.php?type=m3u_plus') === 'get.php.m3u', "Names without a playlist extension get .m3u", "Playlist Name: No Extension");
+    };
+    try { testPlaylistName(); } catch (e) { results.push({ name: "Playlist Name Suite", passed: false, error: e.toString() }); }
+
+    return results;
+}
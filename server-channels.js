@@ -0,0 +1,73 @@
+/**
+ * server-channels.js
+ * Stores playlists on the server and loads their channels back from /api/channels,
+ * with the URLs the server serves them under (relay_url for HLS streams, logo_url for logos).
+ */
+class ServerChannels {
+    constructor(fetchFn = null, pageSize = 1000) {
+        this.fetch = fetchFn || ((...args) => fetch(...args));
+        this.pageSize = pageSize;
+    }
+
+    // Playlists are stored under a file name, whose extension tells the server what it is
+    playlistName(source) {
+        let name = String(source || '').split(/[?#]/)[0].split('/').pop() || 'playlist';
+        if (!/\.m3u8?$/i.test(name)) name += '.m3u';
+        return name;
+    }
+
+    // Converts a stored channel to the shape M3UParser produces, so the rest of the player can't tell them apart
+    toPlayerChannel(channel) {
+        return {
+            id: channel.id,
+            name: channel.name,
+            url: channel.url,
+            duration: -1,
+            tvg_id: channel.tvg_id || null,
+            tvg_name: channel.tvg_name || null,
+            tvg_logo: channel.logo || null,
+            group_title: channel.group || null,
+            relay_url: channel.relay_url || null,
+            logo_url: channel.logo_url || null,
+        };
+    }
+
+    async upload(name, content) {
+        const response = await this.fetch(`/api/upload/${encodeURIComponent(this.playlistName(name))}`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'audio/x-mpegurl' },
+            body: content,
+        });
+        const result = await response.json();
+        if (!response.ok || result.status !== 'success') {
+            throw new Error(result.message || `HTTP error! status: ${response.status}`);
+        }
+        return result;
+    }
+
+    async load(playlist) {
+        const channels = [];
+        let cursor = null;
+        do {
+            const params = new URLSearchParams({ playlist, limit: String(this.pageSize) });
+            if (cursor) params.set('cursor', cursor);
+            const response = await this.fetch(`/api/channels?${params}`);
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            const page = await response.json();
+            page.channels.forEach(channel => channels.push(this.toPlayerChannel(channel)));
+            cursor = page.next_cursor;
+        } while (cursor);
+        return channels;
+    }
+
+    // Uploads a playlist and returns its channels as the server stored them
+    async store(name, content) {
+        const result = await this.upload(name, content);
+        return this.load(result.filename);
+    }
+}
+
+// For Node.js environment / CommonJS modules (if run directly or for testing)
+if (typeof module !== 'undefined' && module.exports) {
+    module.exports = ServerChannels;
+}
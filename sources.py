@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+SOURCE_KINDS = ('playlist', 'epg')
+# Kinds by file extension, looked up after a trailing .gz (guide.xml.gz, playlist.m3u.gz)
+EPG_EXTENSIONS = ('.xml', '.xmltv')
+PLAYLIST_EXTENSIONS = ('.m3u', '.m3u8')
+CHUNK_BYTES = 256 * 1024
+# Store leases: one process polls for due sources, and each source is refreshed by one process at a time
+SCHEDULER_LEASE = 'source-scheduler'
+SOURCE_LEASE_PREFIX = 'source:'
+
+
+def source_name(url: str, name: str = None) -> str:
+    """Returns the store name of a source: `name`, or the last path segment of its URL, made filename-safe."""
+    if not name:
+        path = urlsplit(url).path.rstrip('/')
+        name = path.rsplit('/', 1)[-1] or urlsplit(url).hostname or 'source'
+    return secure_filename(name) or 'source'
+
+
+def guess_kind(url: str) -> str:
+    """Guesses whether a URL points at an XMLTV guide ('epg') or an M3U playlist ('playlist')."""
+    path = urlsplit(url).path.lower()
+    if path.endswith('.gz'):
+        path = path[:-3]
+    if path.endswith(EPG_EXTENSIONS):
+        return 'epg'
+    if path.endswith(PLAYLIST_EXTENSIONS):
+        return 'playlist'
+    return 'epg' if 'epg' in path or 'xmltv' in path else 'playlist'
+
+
+class SourceFetcher:
+    """
+    Downloads remote playlists and guides to disk with conditional requests.
+
+    One pooled aiohttp session is shared by all fetches. Requests carry the
+    ETag and Last-Modified validators of the previous download, so an
+    unchanged source costs a 304 instead of a full transfer. Bodies are
+    streamed to a temporary file and moved into place only once complete.
+
+    Responses are stored as sent: a gzip-encoded body stays compressed on disk
+    and is decompressed on the fly while it is parsed (the XMLTV and M3U
+    ingests both detect gzip by its magic bytes).
+    """
+    def __init__(self, folder: str, concurrency: int = 4, timeout: float = 300.0, connect_timeout: float = 10.0,
+                 max_bytes: int = 1024 * 1024 * 1024, user_agent: str = 'Mozilla/5.0 (IPTV source refresh)'):
+        self.folder = folder
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self.max_bytes = max_bytes
+        self.headers = {'User-Agent': user_agent, 'Accept-Encoding': 'gzip'}
+        self._session = None
+        self._semaphore = None
+        os.makedirs(folder, exist_ok=True)
+
+    async def open(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+            # Bodies are kept as sent; the parsers decompress them while reading
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                  headers=self.headers, auto_decompress=False)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def path_for(self, name: str) -> str:
+        return os.path.join(self.folder, name)
+
+    async def fetch(self, source: dict, force: bool = False) -> dict:
+        """
+        Fetches a source (a dict with 'name', 'url' and the 'etag' / 'last_modified' of the last download).
+
+        Returns a dict with 'status' ('modified', 'not_modified' or 'error'),
+        'http_status', 'error', 'path' (of the downloaded file), 'etag',
+        'last_modified', 'bytes' and 'elapsed_ms'. With force=True the
+        validators are not sent and the source is always downloaded.
+        """
+        await self.open()
+        headers = {}
+        if not force:
+            if source.get('etag'):
+                headers['If-None-Match'] = source['etag']
+            if source.get('last_modified'):
+                headers['If-Modified-Since'] = source['last_modified']
+
+        path = self.path_for(source['name'])
+        tmp_path = f"{path}.part"
+        result = {'status': 'error', 'http_status': None, 'error': None, 'path': None,
+                  'etag': source.get('etag'), 'last_modified': source.get('last_modified'), 'bytes': 0}
+        started = time.monotonic()
+        async with self._semaphore:
+            try:
+                async with self._session.get(source['url'], headers=headers, allow_redirects=True) as response:
+                    result['http_status'] = response.status
+                    if response.status == 304:
+                        result['status'] = 'not_modified'
+                    elif response.status >= 400:
+                        result['error'] = f'HTTP {response.status}'
+                    else:
+                        size = 0
+                        with open(tmp_path, 'wb') as f:
+                            async for chunk in response.content.iter_chunked(CHUNK_BYTES):
+                                size += len(chunk)
+                                if size > self.max_bytes:
+                                    raise ValueError(f'source is larger than {self.max_bytes} bytes')
+                                f.write(chunk)
+                        os.replace(tmp_path, path)
+                        result.update(status='modified', path=path, bytes=size,
+                                      etag=response.headers.get('ETag'),
+                                      last_modified=response.headers.get('Last-Modified'))
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+                result['error'] = str(e) or type(e).__name__
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        result['elapsed_ms'] = int((time.monotonic() - started) * 1000)
+        return result
+
+
+class SourceScheduler:
+    """
+    Refreshes registered sources when they are due, on a BackgroundLoop.
+
+    Every `poll_interval` seconds the store is asked for sources whose refresh
+    interval has elapsed, and each one is refreshed through `refresh(source)`
+    (a callable scheduling the fetch and ingest, typically as a job).
+
+    Several server processes can share one database: only the process holding
+    the scheduler lease polls, and claim() / release() take a per-source lease
+    so a source is never refreshed twice at the same time, by any process.
+    """
+    def __init__(self, store, background, refresh, poll_interval: float = 60.0, refresh_timeout: float = 3600.0,
+                 owner: str = None):
+        self.store = store
+        self.background = background
+        self.refresh = refresh
+        self.poll_interval = poll_interval
+        # A refresh whose process died stops blocking its source after this long
+        self.refresh_timeout = refresh_timeout
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+        self._future = None
+
+    def start(self):
+        if self._future is None:
+            self._future = self.background.submit(self._run())
+
+    def stop(self):
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+            self.store.release_lease(SCHEDULER_LEASE, self.owner)
+
+    def claim(self, name: str) -> bool:
+        """Marks source `name` as being refreshed by this process; False if it already is (by any process)."""
+        return self.store.acquire_lease(SOURCE_LEASE_PREFIX + name, self.owner, self.refresh_timeout)
+
+    def release(self, name: str):
+        self.store.release_lease(SOURCE_LEASE_PREFIX + name, self.owner)
+
+    def refreshing(self) -> set:
+        """Names of the sources being refreshed right now."""
+        return {name[len(SOURCE_LEASE_PREFIX):] for name in self.store.active_leases(SOURCE_LEASE_PREFIX)}
+
+    async def _run(self):
+        while True:
+            try:
+                # The lease outlives a few missed polls, so another process takes over if this one dies
+                if await asyncio.to_thread(self.store.acquire_lease, SCHEDULER_LEASE, self.owner,
+                                           3 * self.poll_interval):
+                    await self.poll()
+            except Exception:
+                logger.exception("Source refresh poll failed")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll(self):
+        for source in await asyncio.to_thread(self.store.due_sources, time.time()):
+            # refresh() skips sources already being refreshed
+            await asyncio.to_thread(self.refresh, source)
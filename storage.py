@@ -0,0 +1,1160 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from records import Programme
+from timestamps import format_timestamp, parse_iso_time, parse_xmltv_time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    name TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    id INTEGER PRIMARY KEY,
+    playlist TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    url TEXT,
+    logo TEXT,
+    grp TEXT,
+    tvg_id TEXT,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_channels_playlist ON channels(playlist, position);
+CREATE INDEX IF NOT EXISTS idx_channels_group ON channels(grp);
+CREATE INDEX IF NOT EXISTS idx_channels_tvg_id ON channels(tvg_id);
+
+CREATE TABLE IF NOT EXISTS epg_sources (
+    name TEXT PRIMARY KEY,
+    total_programs INTEGER NOT NULL DEFAULT 0,
+    total_channels INTEGER NOT NULL DEFAULT 0,
+    last_updated TEXT
+);
+CREATE TABLE IF NOT EXISTS epg_channels (
+    source TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT,
+    icon TEXT,
+    PRIMARY KEY (source, id)
+);
+CREATE TABLE IF NOT EXISTS programmes (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    stop INTEGER,
+    title TEXT,
+    description TEXT,
+    category TEXT,
+    episode TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_programmes_channel_start ON programmes(source, channel, start);
+CREATE INDEX IF NOT EXISTS idx_programmes_start ON programmes(start);
+
+CREATE TABLE IF NOT EXISTS epg_matches (
+    channel_id INTEGER PRIMARY KEY,
+    playlist TEXT NOT NULL,
+    source TEXT NOT NULL,
+    epg_channel TEXT NOT NULL,
+    method TEXT NOT NULL,
+    score REAL
+);
+CREATE INDEX IF NOT EXISTS idx_epg_matches_playlist ON epg_matches(playlist);
+
+CREATE TABLE IF NOT EXISTS sources (
+    name TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    refresh_interval INTEGER NOT NULL,
+    enabled INTEGER NOT NULL DEFAULT 1,
+    etag TEXT,
+    last_modified TEXT,
+    last_checked REAL,
+    last_changed REAL,
+    last_status TEXT,
+    last_error TEXT,
+    bytes INTEGER
+);
+
+-- State shared by the server's worker processes
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    state TEXT NOT NULL,
+    snapshot TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS link_health (
+    url TEXT PRIMARY KEY,
+    expires REAL NOT NULL,
+    result TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_link_health_updated ON link_health(updated_at);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+-- Channel logos cached on disk, by the sha256 digest of their content (see logo_cache.py)
+CREATE TABLE IF NOT EXISTS logos (
+    url TEXT PRIMARY KEY,
+    digest TEXT,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    checked_at REAL NOT NULL,
+    failures INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+"""
+
+# Columns added after the initial schema, created on start-up when missing.
+CHANNEL_MIGRATIONS = (
+    ('ttfb_ms', 'INTEGER'),
+    ('startup_ms', 'INTEGER'),
+    ('bitrate', 'INTEGER'),
+    ('variant_count', 'INTEGER'),
+    ('probed_at', 'REAL'),
+    ('tvg_name', 'TEXT'),
+    # Compact JSON of the remaining EXTINF attributes and #EXTVLCOPT options
+    ('extras', 'TEXT'),
+)
+PLAYLIST_MIGRATIONS = (
+    # JSON of the #EXTM3U header attributes (e.g. x-tvg-url)
+    ('attributes', 'TEXT'),
+)
+MIGRATION_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_channels_startup ON channels(playlist, startup_ms);
+"""
+# Earlier versions stored programme times as ISO-8601 text in guide-local time
+# (the UTC offset was dropped); they are converted to epoch seconds once, taken as UTC.
+PROGRAMME_TIME_MIGRATION = (
+    'CREATE TABLE programmes_migrated (id INTEGER PRIMARY KEY, source TEXT NOT NULL, channel TEXT NOT NULL, '
+    'start INTEGER NOT NULL, stop INTEGER, title TEXT, description TEXT, category TEXT, episode TEXT)',
+    "INSERT INTO programmes_migrated SELECT id, source, channel, CAST(strftime('%s', start) AS INTEGER), "
+    "CAST(strftime('%s', NULLIF(stop, '')) AS INTEGER), title, description, category, episode "
+    "FROM programmes WHERE strftime('%s', start) IS NOT NULL",
+    'DROP TABLE programmes',
+    'ALTER TABLE programmes_migrated RENAME TO programmes',
+    'CREATE INDEX idx_programmes_channel_start ON programmes(source, channel, start)',
+    'CREATE INDEX idx_programmes_start ON programmes(start)',
+)
+
+# Full-text indexes over channel names/groups and programme text: external-content
+# FTS5 tables updated in the same transaction as the rows they index. Triggers
+# keep them in sync, except for programme inserts, which replace_epg() indexes
+# with one INSERT ... SELECT per ingest (several times faster than a trigger
+# firing once per row).
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS channels_fts USING fts5(
+    name, grp, content='channels', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS channels_fts_insert AFTER INSERT ON channels BEGIN
+    INSERT INTO channels_fts (rowid, name, grp) VALUES (new.id, new.name, new.grp);
+END;
+CREATE TRIGGER IF NOT EXISTS channels_fts_delete AFTER DELETE ON channels BEGIN
+    INSERT INTO channels_fts (channels_fts, rowid, name, grp) VALUES ('delete', old.id, old.name, old.grp);
+END;
+CREATE TRIGGER IF NOT EXISTS channels_fts_update AFTER UPDATE OF name, grp ON channels BEGIN
+    INSERT INTO channels_fts (channels_fts, rowid, name, grp) VALUES ('delete', old.id, old.name, old.grp);
+    INSERT INTO channels_fts (rowid, name, grp) VALUES (new.id, new.name, new.grp);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS programmes_fts USING fts5(
+    title, description, category, content='programmes', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS programmes_fts_delete AFTER DELETE ON programmes BEGIN
+    INSERT INTO programmes_fts (programmes_fts, rowid, title, description, category)
+    VALUES ('delete', old.id, old.title, old.description, old.category);
+END;
+CREATE TRIGGER IF NOT EXISTS programmes_fts_update AFTER UPDATE OF title, description, category ON programmes BEGIN
+    INSERT INTO programmes_fts (programmes_fts, rowid, title, description, category)
+    VALUES ('delete', old.id, old.title, old.description, old.category);
+    INSERT INTO programmes_fts (rowid, title, description, category)
+    VALUES (new.id, new.title, new.description, new.category);
+END;
+"""
+FTS_TABLES = ('channels_fts', 'programmes_fts')
+# Ranked searches score at most this many matches, so that very common words
+# still answer in milliseconds
+MAX_SEARCH_CANDIDATES = 5000
+# bm25() column weights: a hit in a name or title outranks one in a group or description
+CHANNEL_SEARCH_WEIGHTS = (10.0, 2.0)
+PROGRAMME_SEARCH_WEIGHTS = (10.0, 1.0, 3.0)
+
+# Deep-probe metrics stored alongside a channel's status
+PROBE_FIELDS = ('ttfb_ms', 'startup_ms', 'bitrate', 'variant_count')
+
+# Maps channel columns to the keys used by the API (`group` is an SQL keyword).
+CHANNEL_FIELDS = (('id', 'id'), ('name', 'name'), ('url', 'url'), ('logo', 'logo'),
+                  ('grp', 'group'), ('tvg_id', 'tvg_id'), ('tvg_name', 'tvg_name'),
+                  ('status', 'status')) + tuple((field, field) for field in PROBE_FIELDS)
+# Channel dict keys stored together in the `extras` column
+EXTRA_FIELDS = ('attributes', 'vlc_options')
+CHANNEL_COLUMNS = ', '.join(column for column, _ in CHANNEL_FIELDS) + ', extras'
+CHANNEL_ORDERS = {
+    'position': 'position',
+    # Channels without probe results sort last
+    'startup': 'startup_ms IS NULL, startup_ms, position',
+    'ttfb': 'ttfb_ms IS NULL, ttfb_ms, position',
+    'bitrate': 'bitrate IS NULL, bitrate DESC, position',
+}
+
+# Version counters bumped by every write, used for ETags and cache invalidation
+CHANNELS_VERSION = 'channels_version'
+EPG_VERSION = 'epg_version'
+
+
+def epg_source_version(source: str) -> str:
+    """Returns the key of the version counter bumped whenever one EPG source changes."""
+    return f'{EPG_VERSION}:{source}'
+
+
+# Number of rows buffered before each executemany() during streaming inserts
+BATCH_SIZE = 5000
+
+
+class Store:
+    """
+    SQLite-backed storage for playlists, channels and EPG programmes.
+
+    Each upload only touches the rows of the playlist or guide being replaced, and
+    reads go through indexes on (playlist, position), group, tvg-id and
+    (source, channel, start), so nothing has to be loaded wholesale at start-up.
+
+    Connections are per thread; writes are serialized with a lock and the database
+    runs in WAL mode so readers are never blocked by an ingest in progress.
+
+    Every write to channels or programmes bumps a version counter in the same
+    transaction (see version()), so readers can tell cheaply whether anything
+    changed since they last looked.
+
+    Channel names and groups and programme titles, descriptions and categories
+    are full-text indexed (see FTS_SCHEMA) when SQLite has FTS5.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._write_lock:
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+
+    def _migrate(self):
+        for table, migrations in (('channels', CHANNEL_MIGRATIONS), ('playlists', PLAYLIST_MIGRATIONS)):
+            existing = {row['name'] for row in self._conn.execute(f'PRAGMA table_info({table})')}
+            for column, column_type in migrations:
+                if column not in existing:
+                    try:
+                        self._conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+                    except sqlite3.OperationalError as e:
+                        # Another process (e.g. a second server worker) migrated the database first
+                        if 'duplicate column' not in str(e):
+                            raise
+        self._conn.executescript(MIGRATION_INDEXES)
+        self._migrate_programme_times()
+
+        # Indexes created on an existing database are filled from the current rows once
+        tables = {row[0] for row in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            logger.warning("SQLite has no FTS5 support (%s); search falls back to substring matching", e)
+            self.fts = False
+            return
+        self.fts = True
+        for table in FTS_TABLES:
+            if table not in tables:
+                self._conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+                self._conn.commit()
+
+    def _programme_times_are_text(self) -> bool:
+        row = self._conn.execute("SELECT type FROM pragma_table_info('programmes') WHERE name = 'start'").fetchone()
+        return row[0].upper() == 'TEXT'
+
+    def _migrate_programme_times(self):
+        if not self._programme_times_are_text():
+            return
+        conn = self._conn
+        # IMMEDIATE, so a second server process starting at the same time waits and then finds nothing to do
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if self._programme_times_are_text():
+                total = conn.execute('SELECT COUNT(*) FROM programmes').fetchone()[0]
+                for statement in PROGRAMME_TIME_MIGRATION:
+                    conn.execute(statement)
+                # Ids are kept, so the full-text index stays valid unless rows were dropped
+                dropped = total - conn.execute('SELECT COUNT(*) FROM programmes').fetchone()[0]
+                if dropped and conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'programmes_fts'").fetchone():
+                    conn.execute("INSERT INTO programmes_fts (programmes_fts) VALUES ('rebuild')")
+                self._bump(conn, EPG_VERSION)
+                logger.info("Converted %d programme times to epoch seconds (%d without a valid start dropped)",
+                            total - dropped, dropped)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def version(self, key: str) -> int:
+        """Returns the current value of a version counter (CHANNELS_VERSION or EPG_VERSION)."""
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _bump(conn, key: str):
+        conn.execute('INSERT INTO meta (key, value) VALUES (?, 1) '
+                     'ON CONFLICT(key) DO UPDATE SET value = value + 1', (key,))
+
+    # Playlists
+
+    def replace_playlist(self, name: str, channels, attributes: dict = None) -> int:
+        """
+        Replaces the channels of one playlist with `channels` (an iterable of dicts).
+
+        `attributes` (the playlist's #EXTM3U header attributes) are stored once
+        `channels` has been consumed, so a streaming parser's header_attributes
+        can be passed before they are filled in. Returns the number of
+        channels stored. Other playlists are not touched.
+        """
+        rows = (
+            (name, position, channel.get('name', ''), channel.get('url'), channel.get('logo'),
+             channel.get('group'), channel.get('tvg_id'), channel.get('tvg_name'), channel.get('status'),
+             _encode_extras(channel))
+            for position, channel in enumerate(channels)
+        )
+        with self._write_lock, self._conn as conn:
+            conn.execute('DELETE FROM channels WHERE playlist = ?', (name,))
+            conn.execute('DELETE FROM epg_matches WHERE playlist = ?', (name,))
+            conn.executemany(
+                'INSERT INTO channels (playlist, position, name, url, logo, grp, tvg_id, tvg_name, status, extras) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            conn.execute(
+                'INSERT INTO playlists (name, updated_at, attributes) VALUES (?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET updated_at = excluded.updated_at, attributes = excluded.attributes',
+                (name, time.time(), json.dumps(attributes) if attributes else None)
+            )
+            self._bump(conn, CHANNELS_VERSION)
+            return conn.execute('SELECT COUNT(*) FROM channels WHERE playlist = ?', (name,)).fetchone()[0]
+
+    def has_playlist(self, name: str) -> bool:
+        return self._conn.execute('SELECT 1 FROM playlists WHERE name = ?', (name,)).fetchone() is not None
+
+    def playlist_names(self) -> list:
+        return [row[0] for row in self._conn.execute('SELECT name FROM playlists ORDER BY rowid')]
+
+    def get_channels(self, playlist: str, order: str = 'position') -> list:
+        """Returns a playlist's channels in playlist order, or sorted by one of CHANNEL_ORDERS."""
+        cursor = self._conn.execute(
+            f'SELECT {CHANNEL_COLUMNS} FROM channels WHERE playlist = ? ORDER BY {CHANNEL_ORDERS[order]}',
+            (playlist,)
+        )
+        return [_channel_dict(row) for row in cursor]
+
+    def has_channel_url(self, url: str) -> bool:
+        """Tells whether any playlist has a channel streaming from `url`."""
+        return self._conn.execute('SELECT 1 FROM channels WHERE url = ? LIMIT 1', (url,)).fetchone() is not None
+
+    def channel_url(self, channel_id: int):
+        row = self._conn.execute('SELECT url FROM channels WHERE id = ?', (channel_id,)).fetchone()
+        return row[0] if row else None
+
+    def playlist_attributes(self, name: str) -> dict:
+        """Returns the #EXTM3U header attributes of a playlist (e.g. 'x-tvg-url')."""
+        row = self._conn.execute('SELECT attributes FROM playlists WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def get_playlist(self, name: str, order: str = 'position') -> dict:
+        return {'name': name, 'attributes': self.playlist_attributes(name), 'channels': self.get_channels(name, order)}
+
+    def all_playlists(self, order: str = 'position') -> dict:
+        return {name: self.get_playlist(name, order) for name in self.playlist_names()}
+
+    def set_channel_statuses(self, statuses):
+        """Stores link-check results given as (channel_id, status) pairs."""
+        with self._write_lock, self._conn as conn:
+            conn.executemany('UPDATE channels SET status = ? WHERE id = ?',
+                             ((status, channel_id) for channel_id, status in statuses))
+            self._bump(conn, CHANNELS_VERSION)
+
+    def set_probe_results(self, results):
+        """Stores deep-probe results given as (channel_id, status, metrics dict) tuples."""
+        now = time.time()
+        rows = ((status, *(metrics.get(field) for field in PROBE_FIELDS), now, channel_id)
+                for channel_id, status, metrics in results)
+        with self._write_lock, self._conn as conn:
+            conn.executemany(
+                'UPDATE channels SET status = ?, ttfb_ms = ?, startup_ms = ?, bitrate = ?, variant_count = ?, '
+                'probed_at = ? WHERE id = ?',
+                rows
+            )
+            self._bump(conn, CHANNELS_VERSION)
+
+    def delete_channels_with_status(self, playlist: str, status: str) -> int:
+        """Deletes the channels of a playlist with the given status and returns how many were removed."""
+        with self._write_lock, self._conn as conn:
+            removed = conn.execute('DELETE FROM channels WHERE playlist = ? AND status = ?',
+                                   (playlist, status)).rowcount
+            conn.execute('DELETE FROM epg_matches WHERE playlist = ? AND channel_id NOT IN '
+                         '(SELECT id FROM channels WHERE playlist = ?)', (playlist, playlist))
+            self._bump(conn, CHANNELS_VERSION)
+            return removed
+
+    def query_channels(self, playlists=None, groups=None, tvg_ids=None, ids=None, statuses=None,
+                       order: str = 'position', offset: int = 0, limit: int = 100, after: tuple = None) -> tuple:
+        """
+        Returns one page of channels across playlists, and the total number matching the filters.
+
+        Each filter is an optional list of accepted values; in `statuses`,
+        'unchecked' matches channels that were never checked. Channels are
+        ordered by (playlist, position), or by one of CHANNEL_ORDERS within that.
+        `after` is a (playlist, position) keyset cursor and is only valid with the
+        default order, where it avoids the cost of large offsets.
+
+        Returns (channels, total); each channel dict also carries its 'playlist'
+        and 'position'.
+        """
+        clauses = []
+        params = []
+        for column, values in (('playlist', playlists), ('grp', groups), ('tvg_id', tvg_ids), ('id', ids)):
+            if values:
+                clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        if statuses:
+            checked = [status for status in statuses if status != 'unchecked']
+            alternatives = []
+            if checked:
+                alternatives.append(f"status IN ({', '.join('?' * len(checked))})")
+                params.extend(checked)
+            if len(checked) != len(statuses):
+                alternatives.append('status IS NULL')
+            clauses.append(f"({' OR '.join(alternatives)})")
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        total = self._conn.execute(f'SELECT COUNT(*) FROM channels {where}', params).fetchone()[0]
+
+        if after is not None:
+            if order != 'position':
+                raise ValueError('Cursors are only supported with the default order')
+            where = f"{where} AND (playlist, position) > (?, ?)" if where else 'WHERE (playlist, position) > (?, ?)'
+            params = params + list(after)
+            offset = 0
+        cursor = self._conn.execute(
+            f'SELECT {CHANNEL_COLUMNS}, playlist, position FROM channels {where} '
+            f'ORDER BY playlist, {CHANNEL_ORDERS[order]} LIMIT ? OFFSET ?',
+            params + [limit, offset]
+        )
+        channels = []
+        for row in cursor:
+            channel = _channel_dict(row)
+            channel['playlist'] = row['playlist']
+            channel['position'] = row['position']
+            channels.append(channel)
+        return channels, total
+
+    def count_channels(self, playlist: str) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM channels WHERE playlist = ?', (playlist,)).fetchone()[0]
+
+    # EPG
+
+    def replace_epg(self, source: str, events) -> dict:
+        """
+        Replaces an EPG source from a stream of ('channel', dict) / ('programme', Programme) events.
+
+        Rows are inserted in batches inside a single transaction, so memory stays
+        bounded by BATCH_SIZE and readers keep seeing the previous guide until the
+        new one is committed. Programmes referencing an undeclared channel get a
+        basic channel entry named after the id.
+
+        Returns a dict with 'programs_count' and 'channels_count'.
+        """
+        channel_ids = set()
+        programme_count = 0
+        batch = []
+
+        with self._write_lock, self._conn as conn:
+            conn.execute('DELETE FROM programmes WHERE source = ?', (source,))
+            conn.execute('DELETE FROM epg_channels WHERE source = ?', (source,))
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM programmes').fetchone()[0]
+
+            def flush():
+                conn.executemany(
+                    'INSERT INTO programmes (source, start, stop, channel, title, description, category, episode) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    batch
+                )
+                batch.clear()
+
+            for kind, item in events:
+                if kind == 'channel':
+                    conn.execute(
+                        'INSERT OR REPLACE INTO epg_channels (source, id, name, icon) VALUES (?, ?, ?, ?)',
+                        (source, item['id'], item.get('name'), item.get('icon', ''))
+                    )
+                    channel_ids.add(item['id'])
+                    continue
+
+                channel_id = item.channel
+                if channel_id not in channel_ids:
+                    conn.execute(
+                        'INSERT OR IGNORE INTO epg_channels (source, id, name, icon) VALUES (?, ?, ?, ?)',
+                        (source, channel_id, channel_id, '')
+                    )
+                    channel_ids.add(channel_id)
+                batch.append((source, item.start, item.stop, item.channel, item.title, item.description,
+                              item.category, item.episode))
+                programme_count += 1
+                if len(batch) >= BATCH_SIZE:
+                    flush()
+            if batch:
+                flush()
+            self._index_programmes(conn, last_id)
+
+            conn.execute(
+                'INSERT INTO epg_sources (name, total_programs, total_channels, last_updated) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET total_programs = excluded.total_programs, '
+                'total_channels = excluded.total_channels, last_updated = excluded.last_updated',
+                (source, programme_count, len(channel_ids), datetime.now().isoformat())
+            )
+            self._bump(conn, EPG_VERSION)
+            self._bump(conn, epg_source_version(source))
+
+        return {'programs_count': programme_count, 'channels_count': len(channel_ids)}
+
+    def merge_epg(self, source: str, events, retention_hours: float = None) -> dict:
+        """
+        Updates an EPG source in place from a fresh copy of its guide, writing only what changed.
+
+        The incoming programmes are staged in a temporary table and diffed
+        against the stored ones by (channel, start) in SQL:
+        - New programmes are inserted.
+        - Programmes whose stop, title, description, category or episode
+          changed are updated.
+        - Stored programmes missing from the guide are deleted, but only
+          those at or after the first start the guide has for their channel.
+          Older ones are kept as history until they fall out of the
+          retention window.
+        With `retention_hours`, programmes that ended longer ago than that
+        are pruned. The window ends at the guide's own last programme when
+        that lies in the past (an archived or lagging feed), so a refresh
+        never prunes everything the guide just delivered; such a guide is
+        reported as 'stale'. A guide without programmes prunes nothing.
+
+        The EPG version is only bumped if something changed, so caches keyed
+        on it stay valid across no-op refreshes.
+
+        Returns a dict with 'programs_count', 'channels_count', 'stale' and
+        'changes' ('inserted', 'updated', 'deleted', 'pruned', 'unchanged',
+        'channels').
+        """
+        channel_ids = set()
+        channel_changes = 0
+        batch = []
+
+        with self._write_lock, self._conn as conn:
+            conn.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS incoming_programmes (channel TEXT NOT NULL, start INTEGER NOT NULL, '
+                'stop INTEGER, title TEXT, description TEXT, category TEXT, episode TEXT, PRIMARY KEY (channel, start))'
+            )
+            conn.execute('DELETE FROM incoming_programmes')
+
+            def flush():
+                conn.executemany('INSERT OR REPLACE INTO incoming_programmes VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+                batch.clear()
+
+            for kind, item in events:
+                if kind == 'channel':
+                    channel_changes += conn.execute(
+                        'INSERT INTO epg_channels (source, id, name, icon) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT(source, id) DO UPDATE SET name = excluded.name, icon = excluded.icon '
+                        'WHERE name IS NOT excluded.name OR icon IS NOT excluded.icon',
+                        (source, item['id'], item.get('name'), item.get('icon', ''))
+                    ).rowcount
+                    channel_ids.add(item['id'])
+                    continue
+
+                if item.channel not in channel_ids:
+                    channel_changes += conn.execute(
+                        'INSERT OR IGNORE INTO epg_channels (source, id, name, icon) VALUES (?, ?, ?, ?)',
+                        (source, item.channel, item.channel, '')
+                    ).rowcount
+                    channel_ids.add(item.channel)
+                batch.append((item.channel, item.start, item.stop, item.title, item.description,
+                              item.category, item.episode))
+                if len(batch) >= BATCH_SIZE:
+                    flush()
+            if batch:
+                flush()
+            incoming = conn.execute('SELECT COUNT(*) FROM incoming_programmes').fetchone()[0]
+
+            updated = conn.execute(
+                'UPDATE programmes SET stop = i.stop, title = i.title, description = i.description, '
+                'category = i.category, episode = i.episode FROM incoming_programmes i '
+                'WHERE programmes.source = ? AND programmes.channel = i.channel AND programmes.start = i.start '
+                'AND (programmes.stop IS NOT i.stop OR programmes.title IS NOT i.title '
+                'OR programmes.description IS NOT i.description OR programmes.category IS NOT i.category '
+                'OR programmes.episode IS NOT i.episode)',
+                (source,)
+            ).rowcount
+            deleted = conn.execute(
+                'DELETE FROM programmes WHERE id IN ('
+                'SELECT p.id FROM (SELECT channel, MIN(start) AS first FROM incoming_programmes GROUP BY channel) c '
+                'JOIN programmes p ON p.source = ? AND p.channel = c.channel AND p.start >= c.first '
+                'WHERE NOT EXISTS (SELECT 1 FROM incoming_programmes i WHERE i.channel = p.channel AND i.start = p.start))',
+                (source,)
+            ).rowcount
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM programmes').fetchone()[0]
+            inserted = conn.execute(
+                'INSERT INTO programmes (source, channel, start, stop, title, description, category, episode) '
+                'SELECT ?, i.channel, i.start, i.stop, i.title, i.description, i.category, i.episode '
+                'FROM incoming_programmes i WHERE NOT EXISTS '
+                '(SELECT 1 FROM programmes p WHERE p.source = ? AND p.channel = i.channel AND p.start = i.start)',
+                (source, source)
+            ).rowcount
+            self._index_programmes(conn, last_id)
+
+            pruned = 0
+            stale = False
+            guide_end = conn.execute('SELECT MAX(COALESCE(stop, start)) FROM incoming_programmes').fetchone()[0]
+            if retention_hours is not None and guide_end is not None:
+                now = time.time()
+                stale = guide_end < now - retention_hours * 3600
+                if stale:
+                    logger.warning("EPG source %s ends at %s, outside the %sh retention window; "
+                                   "keeping the last %sh of the guide", source,
+                                   format_timestamp(guide_end), retention_hours,
+                                   retention_hours)
+                cutoff = int(min(now, guide_end) - retention_hours * 3600)
+                pruned = conn.execute(
+                    'DELETE FROM programmes WHERE source = ? AND COALESCE(stop, start) < ?',
+                    (source, cutoff)
+                ).rowcount
+            # Channels dropped from the guide go once none of their programmes are left
+            dropped = [row[0] for row in conn.execute(
+                'SELECT id FROM epg_channels c WHERE source = ? AND NOT EXISTS '
+                '(SELECT 1 FROM programmes p WHERE p.source = c.source AND p.channel = c.id)',
+                (source,)
+            ) if row[0] not in channel_ids]
+            conn.executemany('DELETE FROM epg_channels WHERE source = ? AND id = ?', ((source, id_) for id_ in dropped))
+            channel_changes += len(dropped)
+            conn.execute('DELETE FROM incoming_programmes')
+
+            programme_count = conn.execute('SELECT COUNT(*) FROM programmes WHERE source = ?', (source,)).fetchone()[0]
+            channel_count = conn.execute('SELECT COUNT(*) FROM epg_channels WHERE source = ?', (source,)).fetchone()[0]
+            conn.execute(
+                'INSERT INTO epg_sources (name, total_programs, total_channels, last_updated) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET total_programs = excluded.total_programs, '
+                'total_channels = excluded.total_channels, last_updated = excluded.last_updated',
+                (source, programme_count, channel_count, datetime.now().isoformat())
+            )
+            if inserted or updated or deleted or pruned or channel_changes:
+                self._bump(conn, EPG_VERSION)
+                self._bump(conn, epg_source_version(source))
+
+        return {
+            'programs_count': programme_count,
+            'channels_count': channel_count,
+            'stale': stale,
+            'changes': {
+                'inserted': inserted,
+                'updated': updated,
+                'deleted': deleted,
+                'pruned': pruned,
+                'unchanged': incoming - inserted - updated,
+                'channels': channel_changes,
+            },
+        }
+
+    def has_epg_source(self, name: str) -> bool:
+        return self._conn.execute('SELECT 1 FROM epg_sources WHERE name = ?', (name,)).fetchone() is not None
+
+    def _index_programmes(self, conn, after_id: int):
+        """Adds the programmes inserted after row `after_id` to the full-text index."""
+        if self.fts:
+            conn.execute(
+                'INSERT INTO programmes_fts (rowid, title, description, category) '
+                'SELECT id, title, description, category FROM programmes WHERE id > ?',
+                (after_id,)
+            )
+
+    def epg_sources(self) -> list:
+        return [dict(row) for row in self._conn.execute('SELECT * FROM epg_sources ORDER BY rowid')]
+
+    def epg_channels(self, source: str) -> list:
+        cursor = self._conn.execute('SELECT id, name, icon FROM epg_channels WHERE source = ?', (source,))
+        return [dict(row) for row in cursor]
+
+    def iter_programmes(self, source: str, order_by_channel: bool = False):
+        """Yields the programmes of a source as Programme records, sorted by start (or by channel, then start)."""
+        order = 'channel, start' if order_by_channel else 'start'
+        cursor = self._conn.execute(
+            f'SELECT channel, start, stop, title, description, category, episode '
+            f'FROM programmes WHERE source = ? ORDER BY {order}',
+            (source,)
+        )
+        for row in cursor:
+            yield Programme(*row)
+
+    def all_epg_channels(self) -> list:
+        """Returns the channels of every EPG source as dicts with 'source', 'id' and 'name', oldest source first."""
+        cursor = self._conn.execute(
+            'SELECT c.source, c.id, c.name FROM epg_channels c JOIN epg_sources s ON s.name = c.source '
+            'ORDER BY s.rowid'
+        )
+        return [dict(row) for row in cursor]
+
+    # Playlist-to-guide matches
+
+    def replace_epg_matches(self, playlist: str, matches) -> int:
+        """
+        Replaces the guide matches of a playlist's channels.
+
+        `matches` is an iterable of (channel_id, source, epg_channel, method,
+        score) tuples as produced by EPGMatcher.match_all. Returns the number
+        of channels matched.
+        """
+        rows = ((channel_id, playlist, source, epg_channel, method, score)
+                for channel_id, source, epg_channel, method, score in matches)
+        with self._write_lock, self._conn as conn:
+            conn.execute('DELETE FROM epg_matches WHERE playlist = ?', (playlist,))
+            conn.executemany(
+                'INSERT OR REPLACE INTO epg_matches (channel_id, playlist, source, epg_channel, method, score) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            return conn.execute('SELECT COUNT(*) FROM epg_matches WHERE playlist = ?', (playlist,)).fetchone()[0]
+
+    def epg_matches(self, playlist: str) -> list:
+        """Returns the guide match of every matched channel of a playlist, in playlist order."""
+        cursor = self._conn.execute(
+            'SELECT m.channel_id, c.name, c.tvg_id, m.source, m.epg_channel, m.method, m.score '
+            'FROM epg_matches m JOIN channels c ON c.id = m.channel_id '
+            'WHERE m.playlist = ? ORDER BY c.position',
+            (playlist,)
+        )
+        return [dict(row) for row in cursor]
+
+    def now_playing(self, playlist: str, at: int) -> list:
+        """
+        Returns what is airing at `at` (UTC epoch seconds) on every matched channel of a playlist, in one query.
+
+        Each row is a dict with 'channel_id', 'source', 'epg_channel' and 'now' /
+        'next' programme dicts (title, start, stop, description) or None. Both
+        programmes are found through the (source, channel, start) index.
+        """
+        cursor = self._conn.execute(
+            """
+            WITH slots AS (
+                SELECT m.channel_id, m.source, m.epg_channel, c.position,
+                    (SELECT id FROM programmes p WHERE p.source = m.source AND p.channel = m.epg_channel
+                        AND p.start <= :at ORDER BY p.start DESC LIMIT 1) AS now_id,
+                    (SELECT id FROM programmes p WHERE p.source = m.source AND p.channel = m.epg_channel
+                        AND p.start > :at ORDER BY p.start LIMIT 1) AS next_id
+                FROM epg_matches m JOIN channels c ON c.id = m.channel_id
+                WHERE m.playlist = :playlist
+            )
+            SELECT s.channel_id, s.source, s.epg_channel,
+                n.title AS now_title, n.start AS now_start, n.stop AS now_stop, n.description AS now_description,
+                x.title AS next_title, x.start AS next_start, x.stop AS next_stop, x.description AS next_description
+            FROM slots s
+            LEFT JOIN programmes n ON n.id = s.now_id AND (n.stop IS NULL OR n.stop > :at)
+            LEFT JOIN programmes x ON x.id = s.next_id
+            ORDER BY s.position
+            """,
+            {'playlist': playlist, 'at': at}
+        )
+        rows = []
+        for row in cursor:
+            entry = {'channel_id': row['channel_id'], 'source': row['source'], 'epg_channel': row['epg_channel']}
+            for slot in ('now', 'next'):
+                entry[slot] = None if row[f'{slot}_start'] is None else {
+                    'title': row[f'{slot}_title'],
+                    'start': format_timestamp(row[f'{slot}_start']),
+                    'stop': format_timestamp(row[f'{slot}_stop']),
+                    'description': row[f'{slot}_description'],
+                }
+            rows.append(entry)
+        return rows
+
+    # Remote sources
+
+    def upsert_source(self, name: str, kind: str, url: str, refresh_interval: int, enabled: bool = True):
+        """Registers a remote playlist or guide; changing its URL forgets the validators of the old one."""
+        with self._write_lock, self._conn as conn:
+            conn.execute(
+                'INSERT INTO sources (name, kind, url, refresh_interval, enabled) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET kind = excluded.kind, refresh_interval = excluded.refresh_interval, '
+                'enabled = excluded.enabled, '
+                'etag = CASE WHEN url = excluded.url THEN etag END, '
+                'last_modified = CASE WHEN url = excluded.url THEN last_modified END, '
+                'url = excluded.url',
+                (name, kind, url, refresh_interval, int(enabled))
+            )
+
+    def get_source(self, name: str) -> dict:
+        row = self._conn.execute('SELECT * FROM sources WHERE name = ?', (name,)).fetchone()
+        return dict(row) if row else None
+
+    def list_sources(self) -> list:
+        return [dict(row) for row in self._conn.execute('SELECT * FROM sources ORDER BY rowid')]
+
+    def delete_source(self, name: str) -> bool:
+        with self._write_lock, self._conn as conn:
+            return conn.execute('DELETE FROM sources WHERE name = ?', (name,)).rowcount > 0
+
+    def due_sources(self, now: float) -> list:
+        """Returns the enabled sources never fetched, or last fetched longer ago than their refresh interval."""
+        cursor = self._conn.execute(
+            'SELECT * FROM sources WHERE enabled AND (last_checked IS NULL OR last_checked + refresh_interval <= ?) '
+            'ORDER BY last_checked IS NOT NULL, last_checked',
+            (now,)
+        )
+        return [dict(row) for row in cursor]
+
+    def record_fetch(self, name: str, result: dict):
+        """Stores the outcome of a fetch (see sources.SourceFetcher.fetch) and the new validators."""
+        now = time.time()
+        with self._write_lock, self._conn as conn:
+            conn.execute(
+                'UPDATE sources SET last_checked = ?, last_status = ?, last_error = ?, etag = ?, last_modified = ?, '
+                'last_changed = CASE WHEN ? THEN ? ELSE last_changed END, bytes = COALESCE(?, bytes) WHERE name = ?',
+                (now, result['status'], result.get('error'), result.get('etag'), result.get('last_modified'),
+                 result['status'] == 'modified', now, result.get('bytes') or None, name)
+            )
+
+    # Channel logos
+
+    def channel_logo(self, channel_id: int):
+        row = self._conn.execute('SELECT logo FROM channels WHERE id = ?', (channel_id,)).fetchone()
+        return row[0] if row else None
+
+    def has_channel_logo(self, url: str) -> bool:
+        """Tells whether any playlist has a channel with the logo `url`."""
+        return self._conn.execute('SELECT 1 FROM channels WHERE logo = ? LIMIT 1', (url,)).fetchone() is not None
+
+    def playlist_logos(self, playlist: str) -> list:
+        """Returns the distinct http(s) logo URLs of a playlist's channels."""
+        cursor = self._conn.execute(
+            "SELECT DISTINCT logo FROM channels WHERE playlist = ? AND (logo LIKE 'http://%' OR logo LIKE 'https://%')",
+            (playlist,)
+        )
+        return [row[0] for row in cursor]
+
+    def get_logo(self, url: str) -> dict:
+        row = self._conn.execute('SELECT * FROM logos WHERE url = ?', (url,)).fetchone()
+        return dict(row) if row else None
+
+    def get_logos(self, urls: list) -> dict:
+        """Returns the logo rows of `urls` (those known) keyed by URL."""
+        logos = {}
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            cursor = self._conn.execute(
+                f"SELECT * FROM logos WHERE url IN ({', '.join('?' * len(chunk))})", chunk)
+            logos.update((row['url'], dict(row)) for row in cursor)
+        return logos
+
+    def record_logo(self, url: str, result: dict):
+        """
+        Stores the outcome of a logo fetch (see logo_cache.LogoCache.fetch).
+
+        A failed fetch keeps the digest and validators of the last successful one, so a logo
+        whose origin is down is still served from the cache.
+        """
+        with self._write_lock, self._conn as conn:
+            if result['status'] == 'error':
+                conn.execute(
+                    'INSERT INTO logos (url, checked_at, failures, error) VALUES (?, ?, 1, ?) '
+                    'ON CONFLICT(url) DO UPDATE SET checked_at = excluded.checked_at, '
+                    'failures = failures + 1, error = excluded.error',
+                    (url, result['checked_at'], result.get('error'))
+                )
+            else:
+                conn.execute(
+                    'INSERT INTO logos (url, digest, content_type, etag, last_modified, checked_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT(url) DO UPDATE SET digest = excluded.digest, content_type = excluded.content_type, '
+                    'etag = excluded.etag, last_modified = excluded.last_modified, '
+                    'checked_at = excluded.checked_at, failures = 0, error = NULL',
+                    (url, result['digest'], result['content_type'], result.get('etag'), result.get('last_modified'),
+                     result['checked_at'])
+                )
+
+    def prune_logos(self) -> set:
+        """Forgets the logos no channel uses any more; returns the digests still in use."""
+        with self._write_lock, self._conn as conn:
+            conn.execute('DELETE FROM logos WHERE url NOT IN (SELECT logo FROM channels WHERE logo IS NOT NULL)')
+            return {row[0] for row in conn.execute('SELECT DISTINCT digest FROM logos WHERE digest IS NOT NULL')}
+
+    # Shared state of the server's worker processes
+
+    def save_job(self, snapshot: dict):
+        """Stores (or updates) the snapshot of a background job, see jobs.Job.snapshot()."""
+        with self._write_lock, self._conn as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, state, snapshot, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET state = excluded.state, snapshot = excluded.snapshot, '
+                'updated_at = excluded.updated_at',
+                (snapshot['id'], snapshot['kind'], snapshot['state'], json.dumps(snapshot),
+                 snapshot['created_at'], time.time())
+            )
+
+    def add_job_results(self, job_id: str, start: int, results: list):
+        """Appends results of a job, numbered from `start`."""
+        with self._write_lock, self._conn as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO job_results (job_id, seq, result) VALUES (?, ?, ?)',
+                ((job_id, start + i, json.dumps(result)) for i, result in enumerate(results))
+            )
+
+    def get_job(self, job_id: str) -> dict:
+        row = self._conn.execute('SELECT snapshot FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def job_results(self, job_id: str, start: int = 0) -> list:
+        cursor = self._conn.execute('SELECT result FROM job_results WHERE job_id = ? AND seq >= ? ORDER BY seq',
+                                    (job_id, start))
+        return [json.loads(row[0]) for row in cursor]
+
+    def prune_jobs(self, keep: int):
+        """Deletes the oldest finished jobs (and their results) beyond the newest `keep`."""
+        with self._write_lock, self._conn as conn:
+            stale = [row[0] for row in conn.execute(
+                "SELECT id FROM jobs WHERE state IN ('done', 'failed') AND id NOT IN "
+                "(SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?)",
+                (keep,)
+            )]
+            conn.executemany('DELETE FROM job_results WHERE job_id = ?', ((job_id,) for job_id in stale))
+            conn.executemany('DELETE FROM jobs WHERE id = ?', ((job_id,) for job_id in stale))
+
+    def put_link_health(self, entries):
+        """Stores link-check results given as (normalized url, expires, result) tuples."""
+        now = time.time()
+        with self._write_lock, self._conn as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO link_health (url, expires, result, updated_at) VALUES (?, ?, ?, ?)',
+                ((url, expires, json.dumps(result), now) for url, expires, result in entries)
+            )
+            conn.execute('DELETE FROM link_health WHERE expires <= ?', (now,))
+
+    def link_health(self, since: float = None) -> list:
+        """
+        Returns unexpired link-check results as (url, expires, result) tuples, oldest first.
+
+        With `since`, only the results stored after that time are returned.
+        """
+        cursor = self._conn.execute(
+            'SELECT url, expires, result FROM link_health WHERE expires > ? AND updated_at > ? ORDER BY updated_at',
+            (time.time(), since or 0)
+        )
+        return [(url, expires, json.loads(result)) for url, expires, result in cursor]
+
+    def clear_link_health(self):
+        with self._write_lock, self._conn as conn:
+            conn.execute('DELETE FROM link_health')
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Takes (or renews) the lease `name` for `owner` for `ttl` seconds.
+
+        Returns False while another owner holds an unexpired lease, so only
+        one process at a time runs the work the lease guards.
+        """
+        now = time.time()
+        with self._write_lock, self._conn as conn:
+            cursor = conn.execute(
+                'INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires '
+                'WHERE leases.owner = excluded.owner OR leases.expires <= ?',
+                (name, owner, now + ttl, now)
+            )
+            return cursor.rowcount > 0
+
+    def release_lease(self, name: str, owner: str):
+        with self._write_lock, self._conn as conn:
+            conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+    def active_leases(self, prefix: str = '') -> dict:
+        """Returns {name: owner} of the unexpired leases whose name starts with `prefix`."""
+        cursor = self._conn.execute('SELECT name, owner FROM leases WHERE expires > ? AND substr(name, 1, ?) = ?',
+                                    (time.time(), len(prefix), prefix))
+        return dict(cursor.fetchall())
+
+    # Search
+
+    def search_channels(self, query: str, playlists=None, limit: int = 20) -> list:
+        """
+        Returns the channels whose name or group matches `query`, best match first.
+
+        Every word must match; the last one also matches as a prefix, so partial
+        input works for type-ahead. Only the first MAX_SEARCH_CANDIDATES matches
+        are ranked. Each result carries its 'playlist'.
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        params = []
+        where = ''
+        if playlists:
+            where = f"AND c.playlist IN ({', '.join('?' * len(playlists))})"
+            params.extend(playlists)
+        if self.fts:
+            sql = (f'SELECT {_prefixed(CHANNEL_COLUMNS, "c")}, c.playlist FROM ('
+                   f'SELECT f.rowid AS id, bm25(channels_fts, {", ".join(map(str, CHANNEL_SEARCH_WEIGHTS))}) AS score '
+                   f'FROM channels_fts f JOIN channels c ON c.id = f.rowid '
+                   f'WHERE channels_fts MATCH ? {where} LIMIT {MAX_SEARCH_CANDIDATES}'
+                   f') m JOIN channels c ON c.id = m.id ORDER BY m.score LIMIT ?')
+            params = [match] + params
+        else:
+            words = _like_terms(query)
+            sql = (f'SELECT {_prefixed(CHANNEL_COLUMNS, "c")}, c.playlist FROM channels c WHERE '
+                   f"{' AND '.join(['(c.name LIKE ? OR c.grp LIKE ?)'] * len(words))} {where} "
+                   f'ORDER BY c.playlist, c.position LIMIT ?')
+            params = [term for word in words for term in (word, word)] + params
+        channels = []
+        for row in self._conn.execute(sql, params + [limit]):
+            channel = _channel_dict(row)
+            channel['playlist'] = row['playlist']
+            channels.append(channel)
+        return channels
+
+    def search_programmes(self, query: str, sources=None, after: int = None, limit: int = 20) -> list:
+        """
+        Returns the programmes whose title, description or category matches `query`, best match first.
+
+        Matching works as in search_channels(). With `after` (UTC epoch
+        seconds), only programmes still airing or starting after that time are returned.
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        clauses = []
+        params = []
+        if sources:
+            clauses.append(f"p.source IN ({', '.join('?' * len(sources))})")
+            params.extend(sources)
+        if after is not None:
+            clauses.append('(p.stop > ? OR (p.stop IS NULL AND p.start >= ?))')
+            params.extend((after, after))
+        where = ''.join(f' AND {clause}' for clause in clauses)
+        columns = 'p.source, p.channel, p.start, p.stop, p.title, p.description, p.category, p.episode'
+        if self.fts:
+            sql = (f'SELECT {columns} FROM ('
+                   f'SELECT f.rowid AS id, bm25(programmes_fts, {", ".join(map(str, PROGRAMME_SEARCH_WEIGHTS))}) AS score '
+                   f'FROM programmes_fts f JOIN programmes p ON p.id = f.rowid '
+                   f'WHERE programmes_fts MATCH ?{where} LIMIT {MAX_SEARCH_CANDIDATES}'
+                   f') m JOIN programmes p ON p.id = m.id ORDER BY m.score LIMIT ?')
+            params = [match] + params
+        else:
+            words = _like_terms(query)
+            sql = (f'SELECT {columns} FROM programmes p WHERE '
+                   f"{' AND '.join(['(p.title LIKE ? OR p.description LIKE ? OR p.category LIKE ?)'] * len(words))}"
+                   f'{where} ORDER BY p.start LIMIT ?')
+            params = [term for word in words for term in (word, word, word)] + params
+        results = []
+        for row in self._conn.execute(sql, params + [limit]):
+            result = dict(row)
+            result['start'] = format_timestamp(result['start'])
+            result['stop'] = format_timestamp(result['stop'])
+            results.append(result)
+        return results
+
+    # Migration
+
+    def import_legacy_json(self, folder: str):
+        """Imports playlists.json / epg_data.json written by earlier versions, if the store is empty."""
+        playlists_path = os.path.join(folder, 'playlists.json')
+        if os.path.exists(playlists_path) and not self.playlist_names():
+            with open(playlists_path, 'r', encoding='utf-8') as f:
+                for name, playlist in json.load(f).items():
+                    self.replace_playlist(name, playlist.get('channels', []))
+            logger.info("Imported legacy playlists from %s", playlists_path)
+
+        epg_path = os.path.join(folder, 'epg_data.json')
+        if os.path.exists(epg_path) and not self.epg_sources():
+            with open(epg_path, 'r', encoding='utf-8') as f:
+                for name, epg in json.load(f).items():
+                    events = [('channel', c) for c in epg.get('channels', [])]
+                    for p in epg.get('programs', []):
+                        programme = Programme(**{field: p.get(field, '') for field in Programme.FIELDS})
+                        programme.start = _legacy_time(programme.start)
+                        programme.stop = _legacy_time(programme.stop)
+                        if programme.start is not None:
+                            events.append(('programme', programme))
+                    self.replace_epg(name, events)
+            logger.info("Imported legacy EPG data from %s", epg_path)
+
+
+def _legacy_time(value: str):
+    """Converts a programme time from epg_data.json (ISO-8601, or XMLTV if it couldn't be parsed) to epoch seconds."""
+    try:
+        return parse_iso_time(value)
+    except (TypeError, ValueError):
+        return parse_xmltv_time(value)
+
+
+def fts_query(text: str) -> str:
+    """
+    Turns free text into an FTS5 query: every word must match, the last one as a prefix.
+
+    Words are quoted, so operators and punctuation in user input are taken
+    literally. Returns '' when the text has no words.
+    """
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        return ''
+    return ' AND '.join(f'"{word}"' for word in words) + '*'
+
+
+def _like_terms(text: str) -> list:
+    return [f'%{word}%' for word in re.findall(r'\w+', text or '')]
+
+
+def _prefixed(columns: str, alias: str) -> str:
+    return ', '.join(f'{alias}.{column.strip()}' for column in columns.split(','))
+
+
+def _encode_extras(channel: dict) -> str:
+    extras = {key: channel.get(key) for key in EXTRA_FIELDS if channel.get(key)}
+    return json.dumps(extras, ensure_ascii=False, separators=(',', ':')) if extras else None
+
+
+def _channel_dict(row) -> dict:
+    """Converts a channel row to the API shape, omitting unset fields."""
+    channel = {key: row[column] for column, key in CHANNEL_FIELDS if row[column] is not None}
+    if row['extras']:
+        channel.update(json.loads(row['extras']))
+    return channel
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """
+    The Flask app module, imported in a scratch directory so its uploads folder and database start empty.
+
+    The app keeps relative paths (uploads/...), so the tests stay in that directory.
+    """
+    os.chdir(tmp_path_factory.mktemp('app'))
+    import app
+    return app
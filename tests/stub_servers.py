@@ -0,0 +1,60 @@
+"""Local aiohttp.web servers standing in for stream origins in the tests."""
+import asyncio
+import contextlib
+
+from aiohttp import web
+
+
+@contextlib.asynccontextmanager
+async def serve(app: web.Application):
+    """Runs `app` on a free local port and yields its base URL (http://127.0.0.1:<port>)."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        await runner.cleanup()
+
+
+class Recorder:
+    """Records the requests a stub received and how many ran at once, per Host header."""
+    def __init__(self):
+        self.requests = []
+        self.active = {}
+        self.max_active = {}
+
+    @contextlib.contextmanager
+    def track(self, request: web.Request):
+        loop = asyncio.get_running_loop()
+        host = request.headers.get('Host', '').rsplit(':', 1)[0]
+        self.requests.append((request.method, request.path, dict(request.headers), loop.time()))
+        self.active[host] = self.active.get(host, 0) + 1
+        self.max_active[host] = max(self.max_active.get(host, 0), self.active[host])
+        try:
+            yield
+        finally:
+            self.active[host] -= 1
+
+    def paths(self, prefix: str = '') -> list:
+        return [(method, path) for method, path, _, _ in self.requests if path.startswith(prefix)]
+
+
+class BackgroundServer:
+    """Runs an aiohttp.web app on its own event loop thread, for tests of code that isn't async itself."""
+    def __init__(self, app: web.Application):
+        from jobs import BackgroundLoop
+        self.app = app
+        self.loop = BackgroundLoop('stub-server')
+        self._context = None
+
+    def start(self) -> str:
+        """Starts serving and returns the base URL."""
+        self._context = serve(self.app)
+        return self.loop.submit(self._context.__aenter__()).result(10)
+
+    def stop(self):
+        self.loop.submit(self._context.__aexit__(None, None, None)).result(10)
+        self.loop.stop(5)
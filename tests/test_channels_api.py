@@ -0,0 +1,89 @@
+import pytest
+
+
+def playlist(count, prefix='Channel'):
+    lines = ['#EXTM3U']
+    for i in range(count):
+        group = 'News' if i % 2 else 'Sport'
+        lines += [f'#EXTINF:-1 tvg-id="ch{i}.us" group-title="{group}",{prefix} {i}',
+                  f'http://origin.invalid/{prefix.lower()}/{i}.ts']
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.fixture(scope='module')
+def client(app_module):
+    client = app_module.app.test_client()
+    response = client.put('/api/upload/paged.m3u', data=playlist(7).encode())
+    assert response.get_json()['total_channels'] == 7
+    return client
+
+
+def test_cursor_pages_through_every_channel_once(client):
+    names = []
+    cursor = None
+    pages = 0
+    while True:
+        query = {'playlist': 'paged.m3u', 'limit': 3}
+        if cursor:
+            query['cursor'] = cursor
+        page = client.get('/api/channels', query_string=query).get_json()
+        assert page['total'] == 7 and len(page['channels']) <= 3
+        names += [channel['name'] for channel in page['channels']]
+        pages += 1
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert names == [f'Channel {i}' for i in range(7)]
+    assert pages == 3
+
+
+def test_offset_pagination_matches_the_cursor(client):
+    page = client.get('/api/channels?playlist=paged.m3u&limit=2&offset=4').get_json()
+    assert page['offset'] == 4
+    assert [channel['name'] for channel in page['channels']] == ['Channel 4', 'Channel 5']
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('group=News', [1, 3, 5]),
+    ('group=News,Sport&tvg_id=ch0.us,ch1.us', [0, 1]),
+    ('tvg_id=ch2.us&tvg_id=ch6.us', [2, 6]),
+    ('status=unchecked&group=Sport', [0, 2, 4, 6]),
+    ('group=Weather', []),
+])
+def test_filters(client, query, expected):
+    page = client.get(f'/api/channels?playlist=paged.m3u&{query}').get_json()
+    assert [channel['name'] for channel in page['channels']] == [f'Channel {i}' for i in expected]
+    assert page['total'] == len(expected)
+
+
+def test_status_filter_and_field_projection(app_module, client):
+    channels = app_module.store.get_channels('paged.m3u')
+    app_module.store.set_channel_statuses([(channels[0]['id'], 'alive'), (channels[1]['id'], 'dead')])
+    page = client.get('/api/channels?playlist=paged.m3u&status=dead,unchecked&fields=name').get_json()
+    assert page['total'] == 6
+    assert page['channels'][0] == {'id': channels[1]['id'], 'playlist': 'paged.m3u', 'name': 'Channel 1'}
+
+
+@pytest.mark.parametrize('query', ['cursor=not-a-cursor', 'id=x', 'cursor=WyJhIiwgMV0=&sort=ttfb'])
+def test_invalid_pagination_is_a_bad_request(client, query):
+    response = client.get(f'/api/channels?playlist=paged.m3u&{query}')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('query', ['', '?playlist=paged.m3u&limit=3'])
+def test_if_none_match_is_answered_with_304_until_an_upload(client, query):
+    response = client.get(f'/api/channels{query}')
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and etag
+
+    cached = client.get(f'/api/channels{query}', headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.headers['ETag'] == etag and not cached.data
+
+    # Another query string gets another ETag
+    other = client.get('/api/channels?playlist=paged.m3u&limit=4').headers['ETag']
+    assert other != etag
+
+    client.put('/api/upload/etag.m3u', data=playlist(2, 'Extra').encode())
+    refreshed = client.get(f'/api/channels{query}', headers={'If-None-Match': etag})
+    assert refreshed.status_code == 200
+    assert refreshed.headers['ETag'] != etag
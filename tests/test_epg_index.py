@@ -0,0 +1,60 @@
+import pytest
+
+from epg_index import EPGIndex
+from records import Programme
+
+# Channel 'one': 10-20, 20-30, a gap, 40-50, then 50 with no stop
+SCHEDULE = [Programme('one', 40, 50, 'C'), Programme('one', 10, 20, 'A'), Programme('one', 20, 30, 'B'),
+            Programme('one', 50, None, 'D'), Programme('two', 0, 100, 'Other')]
+
+
+@pytest.fixture
+def index():
+    return EPGIndex(SCHEDULE)
+
+
+def titles(programmes):
+    return [p.title if p is not None else None for p in programmes]
+
+
+def test_programmes_are_grouped_by_channel_and_sorted(index):
+    assert sorted(index.channels()) == ['one', 'two']
+    assert len(index) == 5 and 'one' in index and 'three' not in index
+    assert titles(index.programmes('one')) == ['A', 'B', 'C', 'D']
+    assert index.programmes('three') == [] and index.window('three', 0, 10) == []
+
+
+@pytest.mark.parametrize('start, end, expected', [
+    (15, 25, ['A', 'B']),        # starts and ends mid-programme
+    (10, 20, ['A']),             # exactly one programme; B starts at the (exclusive) end
+    (20, 21, ['B']),             # A ended exactly at the start
+    (30, 40, []),                # the gap between B and C
+    (35, 45, ['C']),             # starts in the gap, ends mid-programme
+    (0, 10, []),                 # before the guide
+    (0, 11, ['A']),
+    (45, 55, ['C', 'D']),
+    (1000, 2000, ['D']),         # the programme with no stop is still airing
+    (None, 20, ['A']),           # open start
+    (25, None, ['B', 'C', 'D']), # open end
+    (None, None, ['A', 'B', 'C', 'D']),
+])
+def test_window(index, start, end, expected):
+    assert titles(index.window('one', start, end)) == expected
+
+
+@pytest.mark.parametrize('at, now, upcoming', [
+    (5, None, 'A'),
+    (10, 'A', 'B'),    # a programme starts exactly now
+    (19, 'A', 'B'),
+    (20, 'B', 'C'),    # the stop is exclusive, so the next one is on
+    (30, None, 'C'),   # B stopped exactly now
+    (35, None, 'C'),
+    (50, 'D', None),
+    (10 ** 9, 'D', None),
+])
+def test_now_next(index, at, now, upcoming):
+    assert titles(index.now_next('one', at)) == [now, upcoming]
+
+
+def test_now_next_of_an_unknown_channel(index):
+    assert index.now_next('three', 10) == (None, None)
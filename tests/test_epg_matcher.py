@@ -0,0 +1,70 @@
+import pytest
+
+from epg_matcher import EPGMatcher, country_of, normalize_id, normalize_name
+
+GUIDE = [
+    {'source': 'a.xml', 'id': 'DasErste.de', 'name': 'Das Erste'},
+    {'source': 'a.xml', 'id': '1TV.af', 'name': None},
+    {'source': 'a.xml', 'id': 'BBCOne.uk', 'name': 'BBC One'},
+    {'source': 'a.xml', 'id': 'Discovery.us', 'name': 'Discovery Channel'},
+    {'source': 'a.xml', 'id': 'Rai1.it', 'name': 'Rai 1'},
+    {'source': 'b.xml', 'id': 'BBCOne.uk', 'name': 'BBC One (b)'},
+    {'source': 'b.xml', 'id': 'bbcone.uk', 'name': 'BBC One lower'},
+]
+
+
+@pytest.fixture(scope='module')
+def matcher():
+    return EPGMatcher(GUIDE)
+
+
+@pytest.mark.parametrize('channel, expected', [
+    # Exact tvg-id, and the first source carrying it wins
+    ({'tvg_id': 'BBCOne.uk', 'name': 'Anything'}, ('a.xml', 'BBCOne.uk', 'exact', 1.0)),
+    # The exact id beats a normalized one that maps elsewhere
+    ({'tvg_id': 'bbcone.uk', 'name': 'Rai 1'}, ('b.xml', 'bbcone.uk', 'exact', 1.0)),
+    # Normalized id: case and '@' variant suffix ignored, before any name lookup
+    ({'tvg_id': 'DASERSTE.de@HD', 'name': 'Rai 1'}, ('a.xml', 'DasErste.de', 'id', 1.0)),
+    ({'tvg_id': '1tv.af@SD', 'name': '1TV'}, ('a.xml', '1TV.af', 'id', 1.0)),
+    # Name, tvg-name first, with annotations and quality markers dropped
+    ({'tvg_id': None, 'tvg_name': 'Das Erste', 'name': 'Rai 1'}, ('a.xml', 'DasErste.de', 'name', 1.0)),
+    ({'tvg_id': 'Unknown.de', 'name': 'Das Erste HD (1080p) [Geo-blocked]'}, ('a.xml', 'DasErste.de', 'name', 1.0)),
+    # Ids double as names for guide channels without a display name
+    ({'tvg_id': '', 'name': '1TV'}, ('a.xml', '1TV.af', 'name', 1.0)),
+    # Fuzzy, only after the exact steps fail
+    ({'name': 'Discovery Chanel'}, ('a.xml', 'Discovery.us', 'fuzzy', 0.968)),
+    # Country guard: '1TV.ge' must not match '1TV.af' by name or fuzzily
+    ({'tvg_id': '1TV.ge', 'name': '1TV'}, None),
+    ({'tvg_id': 'Discovery.ca', 'name': 'Discovery Chanel'}, None),
+    ({'tvg_id': 'Erste.at', 'name': 'Das Erste'}, None),
+    # Nothing close enough
+    ({'tvg_id': None, 'name': 'Weather Now'}, None),
+    ({'name': ''}, None),
+])
+def test_match_order_and_country_guard(matcher, channel, expected):
+    channel = {'tvg_id': None, 'tvg_name': None, **channel}
+    assert matcher.match(channel) == expected
+
+
+def test_threshold_limits_fuzzy_matches():
+    channel = {'tvg_id': None, 'tvg_name': None, 'name': 'Discovery Chanel'}
+    assert EPGMatcher(GUIDE, threshold=0.99).match(channel) is None
+
+
+def test_match_all_yields_only_matched_channels(matcher):
+    channels = [{'id': 1, 'tvg_id': 'BBCOne.uk', 'name': 'BBC'},
+                {'id': 2, 'tvg_id': '1TV.ge', 'name': '1TV'}]
+    assert list(matcher.match_all(channels)) == [(1, 'a.xml', 'BBCOne.uk', 'exact', 1.0)]
+
+
+@pytest.mark.parametrize('function, value, expected', [
+    (normalize_id, '1TV.af@SD', '1tv.af'),
+    (normalize_id, None, ''),
+    (country_of, '1TV.af@SD', 'af'),
+    (country_of, 'NoCountry', ''),
+    (normalize_name, 'Das Erste HD', 'daserste'),
+    (normalize_name, 'das-erste', 'daserste'),
+    (normalize_name, 'Télé & Co (720p)', 'teleandco'),
+])
+def test_keys(function, value, expected):
+    assert function(value) == expected
@@ -0,0 +1,26 @@
+import gzip
+import io
+
+import pytest
+
+from epg_parser import IngestProgress, XMLTVParser
+
+GUIDE = b'''<?xml version="1.0" encoding="UTF-8"?>
+<tv>
+  <channel id="one.uk"><display-name>One</display-name></channel>
+  <programme start="20260101120000 +0100" stop="20260101130000 +0100" channel="one.uk"><title>News</title></programme>
+</tv>
+'''
+
+
+@pytest.mark.parametrize('data', [GUIDE, gzip.compress(GUIDE)], ids=['plain', 'gzip'])
+def test_plain_and_gzipped_guides_parse_alike(data):
+    progress = IngestProgress('guide', total_bytes=len(data))
+    events = list(XMLTVParser().iter_parse(io.BytesIO(data), progress))
+    assert [kind for kind, _ in events] == ['channel', 'programme']
+    programme = events[1][1]
+    assert programme.title == 'News'
+    # 12:00 at +01:00 is 11:00 UTC
+    assert programme.start == 1767265200
+    # Progress counts bytes of the file as stored, not of the decompressed XML
+    assert progress.bytes_read == len(data)
@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from epg_parser import XMLTVParser
+from epg_pipeline import EPGPipeline, _mp_context
+
+
+def write_guide(path, channels: int = 20, programmes: int = 50):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<tv>\n')
+        for c in range(channels):
+            f.write(f'<channel id="c{c}"><display-name>Channel {c}</display-name></channel>\n')
+        for c in range(channels):
+            for p in range(programmes):
+                hour = 100 + p
+                f.write(f'<programme start="202601{1 + hour // 24:02d}{hour % 24:02d}0000 +0000" '
+                        f'channel="c{c}"><title>Show {p}</title></programme>\n')
+        f.write('</tv>\n')
+
+
+def test_workers_are_not_forked_from_the_server_process():
+    assert _mp_context().get_start_method() in ('forkserver', 'spawn')
+
+
+def test_parallel_parse_matches_the_streaming_parser(tmp_path):
+    path = str(tmp_path / 'guide.xml')
+    write_guide(path)
+    expected = list(XMLTVParser().parse_file(path))
+    # Small chunks, so the guide is split across the pool
+    pipeline = EPGPipeline(workers=2, chunk_bytes=16 * 1024)
+    assert len(pipeline._tasks(path)) > 2
+    events = list(pipeline.iter_file(path))
+    assert [kind for kind, _ in events].count('programme') == 1000
+    assert sorted(str(item) for _, item in events) == sorted(str(item) for _, item in expected)
+
+
+
+def test_chunks_in_flight_are_bounded_by_bytes_not_cores(tmp_path, monkeypatch):
+    path = str(tmp_path / 'guide.xml')
+    write_guide(path)
+    pipeline = EPGPipeline(workers=32, chunk_bytes=4 * 1024, max_inflight_bytes=12 * 1024)
+    assert pipeline.max_inflight() == 3
+    assert EPGPipeline(workers=2, chunk_bytes=4 * 1024, max_inflight_bytes=10 ** 9).max_inflight() == 4
+
+    counts = {'submitted': 0, 'collected': 0, 'most': 0}
+    pools = []
+
+    class Result:
+        def __init__(self, future):
+            self.future = future
+
+        def result(self):
+            counts['collected'] += 1
+            return self.future.result()
+
+    class CountingPool(ThreadPoolExecutor):
+        def submit(self, fn, *args):
+            counts['submitted'] += 1
+            counts['most'] = max(counts['most'], counts['submitted'] - counts['collected'])
+            return Result(super().submit(fn, *args))
+
+    def executor(workers=None):
+        pools.append(workers)
+        return CountingPool(max_workers=workers)
+    monkeypatch.setattr(pipeline, '_executor', executor)
+
+    events = list(pipeline.iter_file(path))
+    assert [kind for kind, _ in events].count('programme') == 1000
+    assert counts['submitted'] == len(pipeline._tasks(path)) > 3
+    assert counts['most'] == 3
+    # No more workers than chunks in flight
+    assert pools == [3]
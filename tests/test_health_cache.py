@@ -0,0 +1,114 @@
+import json
+
+import pytest
+
+import health_cache
+from health_cache import HealthCache, normalize_url
+from storage import Store
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(health_cache.time, 'time', clock)
+    return clock
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('HTTP://Example.COM', 'http://example.com/'),
+    ('http://example.com:80/live.m3u8', 'http://example.com/live.m3u8'),
+    ('https://example.com:443/a', 'https://example.com/a'),
+    ('https://example.com:8443/a', 'https://example.com:8443/a'),
+    ('http://example.com/a?token=1#frag', 'http://example.com/a?token=1'),
+    ('  http://user:pw@Example.com/a  ', 'http://user:pw@example.com/a'),
+    ('http://example.com/Path/Case', 'http://example.com/Path/Case'),
+    ('http://example.com:99999/a', 'http://example.com:99999/a'),
+])
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
+
+
+def test_alive_and_dead_results_expire_after_their_own_ttls(clock):
+    cache = HealthCache(alive_ttl=100, dead_ttl=10)
+    cache.put('http://a/', {'status': 'alive'})
+    cache.put('http://b/', {'status': 'dead'})
+    cache.put('http://c/', {'status': 'error'})
+    assert cache.get('http://c/') is None
+
+    clock.now += 9
+    assert cache.get('http://A:80/') == {'status': 'alive'}
+    assert cache.get('http://b/') == {'status': 'dead'}
+    clock.now += 2
+    assert cache.get('http://b/') is None
+    assert cache.get('http://a/') == {'status': 'alive'}
+    clock.now += 90
+    assert cache.get('http://a/') is None
+    assert len(cache) == 0
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 3
+
+
+def test_least_recently_used_entries_are_evicted_first(clock):
+    cache = HealthCache(max_entries=2)
+    cache.put('http://a/', {'status': 'alive'})
+    cache.put('http://b/', {'status': 'alive'})
+    assert cache.get('http://a/') is not None
+    cache.put('http://c/', {'status': 'dead'})
+    assert cache.get('http://b/') is None
+    assert cache.get('http://a/') is not None and cache.get('http://c/') is not None
+    assert cache.stats()['evictions'] == 1 and len(cache) == 2
+
+
+def test_file_round_trip_keeps_unexpired_entries_and_their_order(tmp_path, clock):
+    path = str(tmp_path / 'health.json')
+    cache = HealthCache(alive_ttl=100, dead_ttl=10, path=path)
+    cache.put('http://a/', {'status': 'alive'})
+    cache.put('http://b/', {'status': 'dead'})
+    cache.put('http://c/', {'status': 'alive'})
+    cache.get('http://a/')
+    cache.save()
+    with open(path) as f:
+        assert [key for key, _, _ in json.load(f)] == ['http://b/', 'http://c/', 'http://a/']
+
+    clock.now += 50
+    loaded = HealthCache(max_entries=1, path=path)
+    loaded.load()
+    # The dead entry expired on disk; of the rest only the most recently used fits
+    assert len(loaded) == 1 and loaded.get('http://a/') == {'status': 'alive'}
+    clock.now += 51
+    assert loaded.get('http://a/') is None
+
+
+def test_unreadable_file_is_ignored(tmp_path):
+    path = tmp_path / 'health.json'
+    path.write_text('{not json')
+    cache = HealthCache(path=str(path))
+    cache.load()
+    assert len(cache) == 0
+
+
+def test_store_round_trip_shares_results_between_caches(tmp_path, clock):
+    store = Store(str(tmp_path / 'iptv.db'))
+    first = HealthCache(store=store, alive_ttl=100)
+    second = HealthCache(store=Store(str(tmp_path / 'iptv.db')), alive_ttl=100)
+    first.put('http://a/', {'status': 'alive', 'code': 200})
+    first.save()
+
+    second.load()
+    assert second.get('http://a/') == {'status': 'alive', 'code': 200}
+    first.put('http://b/', {'status': 'dead'})
+    first.save()
+    second.refresh()
+    assert second.get('http://b/') == {'status': 'dead'}
+
+    first.clear()
+    third = HealthCache(store=store)
+    third.load()
+    assert len(third) == 0
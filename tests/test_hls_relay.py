@@ -0,0 +1,295 @@
+import io
+import os
+import threading
+import time
+
+import pytest
+from aiohttp import web
+
+from hls_relay import HLSRelay, RelayError, SegmentCache
+from jobs import BackgroundLoop
+from stub_servers import BackgroundServer, Recorder
+
+SEGMENT = bytes(range(256)) * 2048
+MEDIA_PLAYLIST = '''#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-TARGETDURATION:6
+#EXT-X-MEDIA-SEQUENCE:1
+#EXTINF:6.0,
+seg1.ts
+#EXTINF:4.0,
+http://cdn.example/seg2.ts
+'''
+
+
+def redirect_to(location: str):
+    async def handler(request):
+        raise web.HTTPFound(location)
+    return handler
+
+
+def playlist_of(recorder: Recorder, uri: str):
+    async def handler(request):
+        with recorder.track(request):
+            return web.Response(text=f'#EXTM3U\n#EXTINF:6.0,\n{uri}\n', content_type='application/vnd.apple.mpegurl')
+    return handler
+
+
+def hls_origin(recorder: Recorder, delay: float = 0.3) -> web.Application:
+    """A stub HLS origin: /live/index.m3u8, and slow /live/<name>.ts segments streamed in two halves."""
+    async def playlist(request):
+        with recorder.track(request):
+            return web.Response(text=MEDIA_PLAYLIST, content_type='application/vnd.apple.mpegurl')
+
+    async def segment(request):
+        import asyncio
+        with recorder.track(request):
+            response = web.StreamResponse(headers={'Content-Type': 'video/mp2t', 'Content-Length': str(len(SEGMENT))})
+            await response.prepare(request)
+            half = len(SEGMENT) // 2
+            await response.write(SEGMENT[:half])
+            await asyncio.sleep(delay)
+            await response.write(SEGMENT[half:])
+            return response
+
+    async def missing(request):
+        with recorder.track(request):
+            return web.Response(status=404)
+
+    app = web.Application()
+    app.router.add_get('/live/index.m3u8', playlist)
+    app.router.add_get('/live/missing.ts', missing)
+    app.router.add_get('/live/metadata.m3u8', redirect_to('http://169.254.169.254/latest/meta-data'))
+    app.router.add_get('/live/internal.m3u8', playlist_of(recorder, 'http://10.0.0.1/admin/seg.ts'))
+    app.router.add_get('/live/{name}.ts', segment)
+    return app
+
+
+@pytest.fixture
+def origin():
+    recorder = Recorder()
+    server = BackgroundServer(hls_origin(recorder))
+    base = server.start()
+    yield base, recorder
+    server.stop()
+
+
+@pytest.fixture
+def relay(tmp_path):
+    background = BackgroundLoop()
+    # The stub origin listens on 127.0.0.1
+    relay = HLSRelay(background, str(tmp_path / 'relay'), secret=b'test-secret', allow_private=True)
+    yield relay
+    background.submit(relay.close()).result(5)
+    background.stop(5)
+
+
+def read_body(source, body) -> bytes:
+    if source == 'memory':
+        return body
+    if source == 'disk':
+        with body:
+            return body.read()
+    return b''.join(body)
+
+
+def test_relay_urls_are_signed(relay):
+    path = relay.relay_url('s', 'http://cdn.example/seg1.ts', 18)
+    token = path.split('/')[2]
+    assert relay.resolve(token) == ('s', 'http://cdn.example/seg1.ts', 18)
+
+    encoded, signature = token.split('.')
+    forged = relay.relay_url('s', 'http://attacker.example/x.ts', 18).split('/')[2].split('.')[0]
+    assert relay.resolve(f'{forged}.{signature}') is None
+    assert relay.resolve(f'{encoded}.{signature[:-1]}A') is None
+    assert relay.resolve(encoded) is None
+    # Non-ASCII signatures are rejected rather than raising TypeError
+    assert relay.resolve(f'{encoded}.éé') is None
+    assert relay.resolve('é.é') is None
+    # A relay with another key doesn't accept the token
+    other = HLSRelay(None, relay.cache.folder, secret=b'other-secret')
+    assert other.resolve(token) is None
+
+
+def test_forged_relay_urls_are_refused(app_module):
+    client = app_module.app.test_client()
+    assert client.get('/relay/%C3%A9.%C3%A9/seg.ts').status_code == 403
+    assert client.get('/relay/aGVsbG8.AAAA/seg.ts').status_code == 403
+
+
+def test_playlists_are_rewritten_to_point_at_the_relay(origin, relay):
+    base, _ = origin
+    body = relay.playlist(f'{base}/live/index.m3u8')
+    uris = [line for line in body.splitlines() if line and not line.startswith('#')]
+    assert all(uri.startswith('/relay/') for uri in uris)
+    resolved = [relay.resolve(uri.split('/')[2]) for uri in uris]
+    # Segments are cached for three of their durations, at least MIN_SEGMENT_TTL
+    assert resolved == [('s', f'{base}/live/seg1.ts', 18), ('s', 'http://cdn.example/seg2.ts', 12)]
+
+
+def test_concurrent_viewers_share_one_segment_fetch(origin, relay):
+    base, recorder = origin
+    url = f'{base}/live/seg1.ts'
+    bodies = []
+    sources = []
+    lock = threading.Lock()
+
+    def view():
+        source, content_type, body, length = relay.segment(url, 30)
+        data = read_body(source, body)
+        with lock:
+            bodies.append(data)
+            sources.append((source, content_type, length))
+
+    viewers = [threading.Thread(target=view) for _ in range(8)]
+    for viewer in viewers:
+        viewer.start()
+    for viewer in viewers:
+        viewer.join(10)
+
+    assert len(bodies) == 8 and all(body == SEGMENT for body in bodies)
+    assert recorder.paths('/live/seg1.ts') == [('GET', '/live/seg1.ts')]
+    # Everyone joined the one download in progress and streamed it as it arrived
+    assert {source for source, _, _ in sources} == {'fill'}
+    assert {(content_type, length) for _, content_type, length in sources} == {('video/mp2t', len(SEGMENT))}
+
+    # Later viewers are served from the cache
+    source, _, body, length = relay.segment(url, 30)
+    assert source == 'memory' and body == SEGMENT and length == len(SEGMENT)
+    relay.cache._memory.clear()
+    relay.cache._memory_used = 0
+    source, _, body, _ = relay.segment(url, 30)
+    assert source == 'disk' and read_body(source, body) == SEGMENT
+    assert len(recorder.paths('/live/seg1.ts')) == 1
+
+
+def test_upstream_errors_are_passed_on_and_not_cached(origin, relay):
+    base, recorder = origin
+    for _ in range(2):
+        with pytest.raises(RelayError) as error:
+            relay.segment(f'{base}/live/missing.ts', 30)
+        assert error.value.status == 404
+        # Let the failed fill unregister, or the second request joins it
+        while relay._fills:
+            time.sleep(0.01)
+    assert len(recorder.paths('/live/missing.ts')) == 2
+    assert not [name for name in os.listdir(relay.cache.folder) if not name.endswith('.part')]
+
+
+def put(cache: SegmentCache, key: str, size: int, expires: float, keep_in_memory: bool = True):
+    with open(cache.path_for(key), 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(cache.path_for(key), (expires, expires))
+    cache.put(key, expires, 'video/mp2t', b'x' * size if keep_in_memory else None)
+
+
+def test_memory_tier_evicts_least_recently_used_segments(tmp_path):
+    cache = SegmentCache(str(tmp_path), memory_bytes=8000, disk_bytes=10 ** 6)
+    expires = time.time() + 60
+    for key in 'abc':
+        put(cache, key, 1000, expires)
+    assert cache.get('a')[0] == 'memory'
+    # Over an eighth of the budget: disk only
+    put(cache, 'big', 1001, expires)
+    assert cache.get('big')[0] == 'disk'
+    for key in 'defghi':
+        put(cache, key, 1000, expires)
+    assert cache.stats()['memory_bytes'] <= 8000
+    # 'b' was used least recently; 'a' was read after it was stored
+    assert cache.get('b')[0] == 'disk'
+    assert cache.get('a')[0] == 'memory'
+
+
+def test_disk_tier_drops_expired_then_soonest_expiring_segments(tmp_path):
+    cache = SegmentCache(str(tmp_path), memory_bytes=0, disk_bytes=5000)
+    now = time.time()
+    put(cache, 'expired', 1000, now - 1, keep_in_memory=False)
+    assert cache.get('expired') is None
+    for i in range(5):
+        put(cache, f's{i}', 1000, now + 60 + i, keep_in_memory=False)
+    assert cache.stats()['disk_bytes'] == 5000
+    # The write that goes over the budget trims the folder to 90% of it
+    put(cache, 's5', 1000, now + 70, keep_in_memory=False)
+    assert cache.stats()['disk_bytes'] == 4000
+    assert sorted(os.listdir(tmp_path)) == ['s2', 's3', 's4', 's5']
+    assert cache.get('s0') is None and cache.get('s5')[0] == 'disk'
+
+
+def test_only_hls_channels_get_a_relay_url(app_module):
+    content = ('#EXTM3U\n#EXTINF:-1,Live\nhttp://cdn.example/live/index.m3u8\n'
+               '#EXTINF:-1,Radio\nhttp://cdn.example/radio.mp3\n')
+    app_module.ingest_m3u(io.BytesIO(content.encode()), 'relay.m3u')
+    channels = {c['name']: c for c in app_module.build_channels_payload()['relay.m3u']['channels']}
+    assert channels['Live']['relay_url'] == f"/relay/index.m3u8?channel={channels['Live']['id']}"
+    assert 'relay_url' not in channels['Radio']
+
+
+def test_the_players_channel_query_returns_relay_urls(app_module):
+    # What server-channels.js does after the player loads a playlist: upload it, then page through it
+    client = app_module.app.test_client()
+    content = '#EXTM3U\n#EXTINF:-1 tvg-id="live.us",Live\nhttp://cdn.example/live/index.m3u8\n'
+    response = client.put('/api/upload/player.m3u', data=content.encode())
+    assert response.get_json()['filename'] == 'player.m3u'
+    page = client.get('/api/channels?playlist=player.m3u&limit=1000').get_json()
+    assert page['next_cursor'] is None
+    [channel] = page['channels']
+    assert channel['relay_url'] == f"/relay/index.m3u8?channel={channel['id']}"
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.1/live.m3u8', 'http://169.254.169.254/latest/meta-data', 'http://10.1.2.3/seg.ts',
+    'http://192.168.0.10:8080/seg.ts', 'http://[::1]/seg.ts', 'http://[::ffff:127.0.0.1]/seg.ts',
+    'http://0.0.0.0/seg.ts', 'file:///etc/passwd',
+])
+def test_relay_refuses_non_public_upstream_urls(url, tmp_path):
+    relay = HLSRelay(None, str(tmp_path), secret=b'test-secret')
+    with pytest.raises(RelayError) as error:
+        relay.check_upstream_url(url)
+    assert error.value.status == 403
+
+
+def test_relay_accepts_public_upstream_urls(tmp_path):
+    relay = HLSRelay(None, str(tmp_path), secret=b'test-secret')
+    # Host names are checked on connecting, by PublicResolver
+    for url in ('http://93.184.216.34/seg.ts', 'https://cdn.example/live/index.m3u8', 'http://[2606:4700::1111]/a.ts'):
+        relay.check_upstream_url(url)
+
+
+@pytest.fixture
+def public_relay(tmp_path, monkeypatch):
+    """A relay that refuses private addresses, except for the stub origin's 127.0.0.1."""
+    import hls_relay
+    is_public = hls_relay.is_public_address
+    monkeypatch.setattr(hls_relay, 'is_public_address', lambda host: host == '127.0.0.1' or is_public(host))
+    background = BackgroundLoop()
+    relay = HLSRelay(background, str(tmp_path / 'relay'), secret=b'test-secret')
+    yield relay
+    background.submit(relay.close()).result(5)
+    background.stop(5)
+
+
+def test_relay_refuses_redirects_and_uris_to_private_addresses(origin, public_relay):
+    base, recorder = origin
+    with pytest.raises(RelayError) as error:
+        public_relay.playlist(f'{base}/live/metadata.m3u8')
+    assert error.value.status == 403
+
+    body = public_relay.playlist(f'{base}/live/internal.m3u8')
+    [token] = [line.split('/')[2] for line in body.splitlines() if line.startswith('/relay/')]
+    kind, url, ttl = public_relay.resolve(token)
+    with pytest.raises(RelayError) as error:
+        public_relay.segment(url, ttl)
+    assert error.value.status == 403
+
+
+def test_relay_refuses_host_names_of_private_addresses(origin, tmp_path):
+    base, recorder = origin
+    background = BackgroundLoop()
+    relay = HLSRelay(background, str(tmp_path / 'relay'), secret=b'test-secret')
+    try:
+        with pytest.raises(RelayError):
+            relay.playlist(base.replace('127.0.0.1', 'localhost') + '/live/index.m3u8')
+        assert recorder.requests == []
+    finally:
+        background.submit(relay.close()).result(5)
+        background.stop(5)
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from aiohttp import web
+
+from jobs import BackgroundLoop, Job, JobManager, ShuttingDown, StoredJob
+from sources import SourceScheduler
+from storage import Store
+from stub_servers import BackgroundServer, Recorder
+
+
+@pytest.fixture
+def background():
+    loop = BackgroundLoop()
+    yield loop
+    loop.stop(5)
+
+
+def test_results_stream_to_readers_while_the_job_runs(background):
+    manager = JobManager(background)
+    step = threading.Event()
+
+    async def work(job):
+        for i in range(3):
+            job.add_result({'id': i, 'status': 'alive' if i else 'dead'})
+            await asyncio.to_thread(step.wait, 5)
+            step.clear()
+        return {'checked': 3}
+
+    job = Job('check-links', 3)
+    manager.submit(job, work)
+    results = job.iter_results(poll=0.05)
+    assert next(results) == {'id': 0, 'status': 'dead'}
+    assert job.snapshot()['state'] == 'running' and job.snapshot()['completed'] == 1
+    step.set()
+    assert next(r for r in results if r is not None) == {'id': 1, 'status': 'alive'}
+    step.set()
+    assert next(r for r in results if r is not None) == {'id': 2, 'status': 'alive'}
+    step.set()
+    assert list(r for r in results if r is not None) == []
+
+    snapshot = job.snapshot()
+    assert snapshot['state'] == 'done' and snapshot['summary'] == {'checked': 3}
+    assert snapshot['counts'] == {'dead': 1, 'alive': 2}
+    # A late reader gets everything, from any offset
+    assert [r['id'] for r in job.iter_results(1)] == [1, 2]
+    assert manager.get(job.id) is job
+
+
+def test_failed_jobs_and_draining(background):
+    manager = JobManager(background)
+
+    async def fail(job):
+        raise ValueError('no such playlist')
+
+    job = Job('check-links', 0)
+    manager.submit(job, fail)
+    assert job.wait(5)
+    assert job.snapshot()['state'] == 'failed' and job.snapshot()['error'] == 'no such playlist'
+
+    async def forever(job):
+        await asyncio.sleep(60)
+
+    stuck = Job('check-links', 0)
+    manager.submit(stuck, forever)
+    assert manager.drain(0.1) == [stuck]
+    with pytest.raises(ShuttingDown):
+        manager.submit(Job('check-links', 0), forever)
+
+
+def test_any_worker_can_answer_for_a_job_another_one_runs(tmp_path, background):
+    path = str(tmp_path / 'iptv.db')
+    # Two stores on one database stand in for two server processes
+    first = JobManager(background, store=Store(path), flush_interval=0.05)
+    # The second only answers requests, so it needs no loop of its own
+    second = JobManager(None, store=Store(path))
+    release = threading.Event()
+
+    async def work(job):
+        job.add_result({'id': 1, 'status': 'alive'})
+        await asyncio.to_thread(release.wait, 5)
+        job.add_result({'id': 2, 'status': 'dead'})
+        return {'checked': 2}
+
+    job = Job('check-links', 2, {'playlist': 'one.m3u'})
+    first.submit(job, work)
+    remote = second.get(job.id)
+    assert isinstance(remote, StoredJob)
+    assert remote.snapshot()['kind'] == 'check-links' and remote.snapshot()['params'] == {'playlist': 'one.m3u'}
+    remote.poll_interval = 0.02
+    results = remote.iter_results(poll=0.1)
+    assert next(results) == {'id': 1, 'status': 'alive'}
+    assert remote.snapshot()['state'] == 'running'
+
+    release.set()
+    assert [r for r in results if r is not None] == [{'id': 2, 'status': 'dead'}]
+    snapshot = remote.snapshot()
+    assert snapshot['state'] == 'done' and snapshot['summary'] == {'checked': 2} and snapshot['completed'] == 2
+    assert second.get('0123456789abcdef0123456789abcdef') is None
+
+    # Refreshing a source takes a lease that only one of them can hold at a time
+    schedulers = [SourceScheduler(manager.store, None, None, owner=f'worker-{i}')
+                  for i, manager in enumerate((first, second))]
+    assert [scheduler.claim('guide.xml') for scheduler in schedulers] == [True, False]
+    assert schedulers[1].refreshing() == {'guide.xml'}
+    schedulers[0].release('guide.xml')
+    assert [scheduler.claim('guide.xml') for scheduler in reversed(schedulers)] == [True, False]
+
+
+def link_origin(recorder: Recorder) -> web.Application:
+    async def alive(request):
+        with recorder.track(request):
+            return web.Response(text='#EXTM3U\n', content_type='application/vnd.apple.mpegurl')
+
+    async def gone(request):
+        with recorder.track(request):
+            return web.Response(status=404)
+
+    app = web.Application()
+    app.router.add_route('*', '/live/{name}.m3u8', alive)
+    app.router.add_route('*', '/gone/{name}.m3u8', gone)
+    return app
+
+
+def test_link_check_job_reports_progress_and_results_over_the_api(app_module):
+    recorder = Recorder()
+    server = BackgroundServer(link_origin(recorder))
+    base = server.start()
+    try:
+        client = app_module.app.test_client()
+        content = '#EXTM3U\n' + ''.join(
+            f'#EXTINF:-1,{name}\n{base}/{path}/{name}.m3u8\n'
+            for name, path in (('One', 'live'), ('Two', 'gone'), ('Three', 'live')))
+        client.put('/api/upload/checked.m3u', data=content.encode())
+
+        response = client.post('/api/check-links', json={'playlist': 'checked.m3u', 'refresh': True})
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+        deadline = time.monotonic() + 10
+        while True:
+            snapshot = client.get(f'/api/jobs/{job_id}').get_json()
+            assert snapshot['completed'] <= snapshot['total'] == 3
+            if snapshot['state'] in ('done', 'failed'):
+                break
+            assert time.monotonic() < deadline, 'the job did not finish'
+            time.sleep(0.05)
+
+        assert snapshot['state'] == 'done' and snapshot['kind'] == 'check-links'
+        assert snapshot['summary'] == {'total': 3, 'alive': 2, 'dead': 1}
+        assert snapshot['counts'] == {'alive': 2, 'dead': 1}
+
+        lines = client.get(f'/api/jobs/{job_id}/results').get_data(as_text=True).splitlines()
+        results = {result['name']: result['status'] for result in map(json.loads, lines)}
+        assert results == {'One': 'alive', 'Two': 'dead', 'Three': 'alive'}
+        events = client.get(f'/api/jobs/{job_id}/results?format=sse&offset=2').get_data(as_text=True)
+        assert events.count('data: ') == 2 and 'event: done' in events
+
+        statuses = {c['name']: c['status'] for c in app_module.store.get_channels('checked.m3u')}
+        assert statuses == results
+        assert client.get('/api/jobs/0123456789abcdef0123456789abcdef').status_code == 404
+    finally:
+        server.stop()
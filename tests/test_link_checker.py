@@ -0,0 +1,168 @@
+import asyncio
+import time
+
+from aiohttp import web
+
+from health_cache import HealthCache, normalize_url
+from link_checker import LinkChecker
+from stub_servers import Recorder, serve
+
+
+def stream_origin(recorder: Recorder, delay: float = 0.2, failures: int = 2) -> web.Application:
+    """
+    A stub stream origin:
+
+    /slow/<n>       answers after `delay` seconds
+    /no-head        rejects HEAD with 405, serves GET
+    /range-only     rejects HEAD with 501 and a GET without a Range header with 403
+    /flapping/<n>   answers 503 `failures` times, then 200
+    /down           always answers 503
+    """
+    attempts = {}
+
+    async def slow(request):
+        with recorder.track(request):
+            await asyncio.sleep(delay)
+            return web.Response(status=200)
+
+    async def no_head(request):
+        with recorder.track(request):
+            return web.Response(status=405 if request.method == 'HEAD' else 200)
+
+    async def range_only(request):
+        with recorder.track(request):
+            if request.method == 'HEAD':
+                return web.Response(status=501)
+            if request.headers.get('Range') != 'bytes=0-0':
+                return web.Response(status=403)
+            return web.Response(status=206, body=b'x', headers={'Content-Range': 'bytes 0-0/1000'})
+
+    async def flapping(request):
+        with recorder.track(request):
+            count = attempts[request.path] = attempts.get(request.path, 0) + 1
+            return web.Response(status=503 if count <= failures else 200)
+
+    async def down(request):
+        with recorder.track(request):
+            return web.Response(status=503)
+
+    app = web.Application()
+    app.router.add_route('*', '/slow/{n}', slow)
+    app.router.add_route('*', '/no-head', no_head)
+    app.router.add_route('*', '/range-only', range_only)
+    app.router.add_route('*', '/flapping/{n}', flapping)
+    app.router.add_route('*', '/down', down)
+    return app
+
+
+def test_connections_per_host_are_limited():
+    recorder = Recorder()
+
+    async def run():
+        async with serve(stream_origin(recorder)) as base:
+            port = base.rsplit(':', 1)[1]
+            # Two host names for the same server: the limit applies to each separately
+            urls = [f'http://{host}:{port}/slow/{i}' for host in ('127.0.0.1', 'localhost') for i in range(6)]
+            checker = LinkChecker(concurrency=16, per_host=2, retries=0)
+            results = await checker.check_many([{'url': url} for url in urls])
+        return results
+
+    started = time.monotonic()
+    results = asyncio.run(run())
+    elapsed = time.monotonic() - started
+    assert [result['status'] for result in results] == ['alive'] * 12
+    assert recorder.max_active == {'127.0.0.1': 2, 'localhost': 2}
+    # Six requests per host, two at a time, take three rounds of the delay
+    assert elapsed >= 3 * 0.2
+
+
+def test_transient_failures_are_retried_with_backoff():
+    recorder = Recorder()
+
+    async def run():
+        async with serve(stream_origin(recorder, failures=2)) as base:
+            checker = LinkChecker(retries=2, backoff=0.1)
+            return await checker.check_many([{'url': f'{base}/flapping/1'}])
+
+    result, = asyncio.run(run())
+    assert result['status'] == 'alive'
+    assert result['http_status'] == 200
+    times = [at for _, path, _, at in recorder.requests if path == '/flapping/1']
+    assert len(times) == 3
+    # Exponential backoff (0.1s, then 0.2s) plus up to 50% jitter; the upper bounds leave room for a slow machine
+    first, second = times[1] - times[0], times[2] - times[1]
+    assert 0.1 <= first < 0.5
+    assert 0.2 <= second < 0.6
+
+
+def test_retries_are_bounded():
+    recorder = Recorder()
+
+    async def run():
+        async with serve(stream_origin(recorder)) as base:
+            checker = LinkChecker(retries=2, backoff=0.01)
+            return await checker.check_many([{'url': f'{base}/down'}])
+
+    result, = asyncio.run(run())
+    assert result['status'] == 'dead'
+    assert result['http_status'] == 503
+    assert len(recorder.paths('/down')) == 3
+
+
+def test_rejected_head_falls_back_to_a_ranged_get():
+    recorder = Recorder()
+
+    async def run():
+        async with serve(stream_origin(recorder)) as base:
+            checker = LinkChecker(retries=0)
+            return await checker.check_many([{'url': f'{base}/no-head'}, {'url': f'{base}/range-only'}])
+
+    no_head, range_only = asyncio.run(run())
+    assert (no_head['status'], no_head['http_status']) == ('alive', 200)
+    assert (range_only['status'], range_only['http_status']) == ('alive', 206)
+    assert recorder.paths('/range-only') == [('HEAD', '/range-only'), ('GET', '/range-only')]
+    ranges = [headers.get('Range') for method, path, headers, _ in recorder.requests if method == 'GET']
+    assert ranges == ['bytes=0-0', 'bytes=0-0']
+
+
+def test_without_range_fallback_a_rejected_head_is_dead():
+    recorder = Recorder()
+
+    async def run():
+        async with serve(stream_origin(recorder)) as base:
+            checker = LinkChecker(retries=0, range_fallback=False)
+            return await checker.check_many([{'url': f'{base}/no-head'}])
+
+    result, = asyncio.run(run())
+    assert (result['status'], result['http_status']) == ('dead', 405)
+    assert recorder.paths() == [('HEAD', '/no-head')]
+
+
+def test_cached_and_concurrent_checks_share_requests():
+    recorder = Recorder()
+    cache = HealthCache()
+
+    async def run():
+        async with serve(stream_origin(recorder, delay=0.1)) as base:
+            checker = LinkChecker(retries=0, cache=cache)
+            # The same stream under two spellings of its URL is checked once
+            first = await checker.check_many([{'url': f'{base}/slow/1'}, {'url': f'{base}/slow/1#live'}])
+            again = await checker.check_many([{'url': f'{base}/slow/1'}])
+            return first, again
+
+    first, again = asyncio.run(run())
+    assert [result['status'] for result in first] == ['alive', 'alive']
+    assert again[0]['cached'] is True
+    assert recorder.paths('/slow') == [('HEAD', '/slow/1')]
+
+
+def test_health_cache_expires_dead_results_sooner():
+    cache = HealthCache(alive_ttl=60, dead_ttl=0.05)
+    cache.put('http://a.example/live', {'status': 'alive'})
+    cache.put('http://a.example/gone', {'status': 'dead'})
+    cache.put('http://a.example/udp', {'status': 'unknown'})
+    time.sleep(0.1)
+    assert cache.get('HTTP://A.EXAMPLE:80/live') == {'status': 'alive'}
+    assert cache.get('http://a.example/gone') is None
+    assert cache.get('http://a.example/udp') is None
+    assert normalize_url('HTTP://Host.Example:80?x=1#frag') == 'http://host.example/?x=1'
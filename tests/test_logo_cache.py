@@ -0,0 +1,135 @@
+import asyncio
+import io
+import os
+import time
+
+import pytest
+from aiohttp import web
+
+from jobs import BackgroundLoop
+from logo_cache import LogoCache
+from storage import Store
+from stub_servers import BackgroundServer, Recorder
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+
+
+def logo_origin(recorder: Recorder, delay: float = 0.5) -> web.Application:
+    """A stub logo origin: a slow /slow.png and a /missing.png that answers 404."""
+    async def slow(request):
+        with recorder.track(request):
+            await asyncio.sleep(delay)
+            return web.Response(body=PNG, content_type='image/png', headers={'ETag': '"v1"'})
+
+    async def missing(request):
+        with recorder.track(request):
+            return web.Response(status=404)
+
+    app = web.Application()
+    app.router.add_get('/slow.png', slow)
+    app.router.add_get('/missing.png', missing)
+    return app
+
+
+@pytest.fixture
+def origin():
+    recorder = Recorder()
+    server = BackgroundServer(logo_origin(recorder))
+    base = server.start()
+    yield base, recorder
+    server.stop()
+
+
+@pytest.fixture
+def logos(tmp_path):
+    background = BackgroundLoop()
+    cache = LogoCache(Store(str(tmp_path / 'iptv.db')), background, str(tmp_path / 'logos'))
+    yield cache
+    background.submit(cache.close()).result(5)
+    background.stop(5)
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.02)
+
+
+def test_lookup_of_an_uncached_logo_returns_at_once_and_fetches_it_in_the_background(origin, logos):
+    base, recorder = origin
+    url = f'{base}/slow.png'
+    started = time.monotonic()
+    assert [logos.lookup(url) for _ in range(5)] == [None] * 5
+    assert time.monotonic() - started < 0.3
+
+    wait_for(lambda: logos.lookup(url) is not None)
+    row = logos.lookup(url)
+    assert row['content_type'] == 'image/png' and row['etag'] == '"v1"'
+    with open(logos.path_for(row['digest']), 'rb') as f:
+        assert f.read() == PNG
+    # The lookups while it was being fetched joined that one fetch
+    assert recorder.paths('/slow.png') == [('GET', '/slow.png')]
+
+
+def test_stats_are_kept_up_to_date_without_scanning_the_folder(origin, logos, monkeypatch):
+    base, _ = origin
+    url = f'{base}/slow.png'
+    assert logos.stats() == {'files': 0, 'bytes': 0}
+    logos.lookup(url)
+    wait_for(lambda: logos.lookup(url) is not None)
+
+    def no_scandir(path):
+        raise AssertionError('stats() scanned the folder')
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'scandir', no_scandir)
+        assert logos.stats() == {'files': 1, 'bytes': len(PNG)}
+
+    # No channel uses the logo, and its file is old enough to go
+    path = logos.path_for(logos.lookup(url)['digest'])
+    os.utime(path, (time.time() - 2 * 3600, time.time() - 2 * 3600))
+    assert logos.prune() == 1
+    assert logos.stats() == {'files': 0, 'bytes': 0}
+
+
+def test_failed_logo_fetches_are_not_retried_on_every_lookup(origin, logos):
+    base, recorder = origin
+    url = f'{base}/missing.png'
+    assert logos.lookup(url) is None
+    wait_for(lambda: logos.store.get_logo(url) is not None)
+    assert logos.store.get_logo(url)['failures'] == 1
+    for _ in range(3):
+        assert logos.lookup(url) is None
+    time.sleep(0.1)
+    assert len(recorder.paths('/missing.png')) == 1
+
+
+def test_logo_view_redirects_to_the_origin_until_the_logo_is_cached(origin, app_module, monkeypatch):
+    base, recorder = origin
+    monkeypatch.setitem(app_module.app.config, 'LOGO_PREFETCH', False)
+    content = (f'#EXTM3U\n#EXTINF:-1 tvg-logo="{base}/slow.png",Logo\nhttp://cdn.example/a.ts\n'
+               '#EXTINF:-1 tvg-logo="logo.png",Local\nhttp://cdn.example/b.ts\n')
+    app_module.ingest_m3u(io.BytesIO(content.encode()), 'logos.m3u')
+    channels = {c['name']: c for c in app_module.build_channels_payload()['logos.m3u']['channels']}
+    assert 'logo_url' not in channels['Local']
+    logo_url = channels['Logo']['logo_url']
+    assert logo_url == f"/logo/{channels['Logo']['id']}"
+    # The page loads stored channels the same way (see server-channels.js)
+    page = app_module.app.test_client().get('/api/channels?playlist=logos.m3u&limit=1000').get_json()
+    assert [channel.get('logo_url') for channel in page['channels']] == [logo_url, None]
+
+    client = app_module.app.test_client()
+    started = time.monotonic()
+    response = client.get(logo_url)
+    assert time.monotonic() - started < 0.3
+    assert response.status_code == 302
+    assert response.headers['Location'] == f'{base}/slow.png'
+    assert response.headers['Cache-Control'] == 'no-store'
+    # Logos that aren't http(s) URLs are never fetched nor redirected to
+    assert client.get(f"/logo/{channels['Local']['id']}").status_code == 404
+
+    wait_for(lambda: app_module.store.get_logo(f'{base}/slow.png') is not None)
+    response = client.get(logo_url)
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png' and response.data == PNG
+    assert len(recorder.paths('/slow.png')) == 1
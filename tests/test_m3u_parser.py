@@ -0,0 +1,44 @@
+import io
+
+import pytest
+
+from m3u_parser import M3UParser
+
+ENTRY = '#EXTINF:-1 tvg-id="one.uk" group-title="News",One\nhttp://example.com/one.m3u8\n'
+
+
+@pytest.mark.parametrize('header', [
+    '#EXTM3U',
+    '\ufeff#EXTM3U',
+    '#EXTM3U x-tvg-url="http://example.com/guide.xml.gz" url-tvg="http://example.com/guide.xml.gz"',
+    '#EXTM3U\turl-tvg=http://example.com/guide.xml',
+])
+def test_header_is_accepted_with_or_without_attributes(header):
+    streams = M3UParser().parse(f'{header}\n{ENTRY}')
+    assert [stream['name'] for stream in streams] == ['One']
+
+
+@pytest.mark.parametrize('header', ['', '#EXTINF:-1,One', '#EXTM3Ux-tvg-url="a"', 'EXTM3U'])
+def test_invalid_header_is_rejected(header):
+    with pytest.raises(ValueError):
+        M3UParser().parse(f'{header}\n{ENTRY}')
+
+
+def test_header_attributes_are_kept():
+    parser = M3UParser()
+    attributes = parser.header_attributes
+    content = f'#EXTM3U x-tvg-url="http://example.com/guide.xml.gz" Refresh=3600\n{ENTRY}'
+    streams = list(parser.iter_parse(io.BytesIO(content.encode())))
+    assert len(streams) == 1
+    # The dict is filled in place, so a reference taken before parsing sees the values
+    assert attributes == {'x-tvg-url': 'http://example.com/guide.xml.gz', 'refresh': '3600'}
+
+
+def test_ingest_keeps_header_attributes_with_the_playlist(app_module):
+    content = f'#EXTM3U x-tvg-url="http://example.com/guide.xml"\n{ENTRY}'
+    result = app_module.ingest_m3u(io.BytesIO(content.encode()), 'header.m3u')
+    assert result['total_channels'] == 1
+    assert result['attributes'] == {'x-tvg-url': 'http://example.com/guide.xml'}
+    playlist = app_module.store.get_playlist('header.m3u')
+    assert playlist['attributes'] == {'x-tvg-url': 'http://example.com/guide.xml'}
+    assert [channel['name'] for channel in playlist['channels']] == ['One']
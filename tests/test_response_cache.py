@@ -0,0 +1,117 @@
+import gzip
+import json
+import os
+import zlib
+
+import pytest
+
+import response_cache
+from response_cache import MIN_COMPRESS_SIZE, CachedResponse, ResponseCache
+
+PAYLOAD = {'channels': [{'name': f'Channel {i}', 'url': f'http://origin.invalid/{i}.ts'} for i in range(100)]}
+
+
+class FakeBrotli:
+    """Stands in for the optional brotli package, so br negotiation is tested without it installed."""
+    @staticmethod
+    def compress(data, quality=5):
+        return b'br:' + zlib.compress(data, 9)
+
+    @staticmethod
+    def decompress(data):
+        return zlib.decompress(data[3:])
+
+
+@pytest.fixture
+def fake_brotli(monkeypatch):
+    monkeypatch.setattr(response_cache, 'brotli', FakeBrotli)
+
+
+def test_small_payloads_are_only_kept_as_identity():
+    entry = CachedResponse(1, b'{"status":"success"}')
+    assert entry.encodings == []
+    assert entry.select('gzip') == b'{"status":"success"}'
+
+
+def test_large_payloads_are_pre_compressed(fake_brotli):
+    body = json.dumps(PAYLOAD).encode()
+    assert len(body) >= MIN_COMPRESS_SIZE
+    entry = CachedResponse(1, body)
+    assert entry.encodings == ['br', 'gzip']
+    assert FakeBrotli.decompress(entry.select('br')) == body
+    assert gzip.decompress(entry.select('gzip')) == body
+    assert entry.select(None) == body and entry.select('deflate') == body
+
+
+def test_variants_that_do_not_shrink_the_body_are_dropped():
+    entry = CachedResponse(1, os.urandom(4 * MIN_COMPRESS_SIZE))
+    assert entry.encodings == []
+
+
+def test_real_brotli_round_trip():
+    brotli = pytest.importorskip('brotli')
+    body = json.dumps(PAYLOAD).encode()
+    assert brotli.decompress(CachedResponse(1, body).select('br')) == body
+
+
+def test_a_newer_version_misses_and_rebuilds():
+    cache = ResponseCache()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {'build': len(builds)}
+
+    assert cache.get_or_build('channels:position', 1, build).body == b'{"build":1}'
+    assert cache.get_or_build('channels:position', 1, build).body == b'{"build":1}'
+    assert cache.get('channels:position', 2) is None
+    assert cache.get_or_build('channels:position', 2, build).body == b'{"build":2}'
+    assert len(builds) == 2
+    assert cache.stats()['entries']['channels:position']['version'] == 2
+
+    cache.put('epg:full', 1, {})
+    cache.invalidate('channels:')
+    assert list(cache.stats()['entries']) == ['epg:full']
+
+
+@pytest.fixture
+def client(app_module, fake_brotli):
+    content = '#EXTM3U\n' + ''.join(f'#EXTINF:-1,Encoded {i}\nhttp://origin.invalid/encoded/{i}.ts\n'
+                                    for i in range(50))
+    client = app_module.app.test_client()
+    client.put('/api/upload/encoded.m3u', data=content.encode())
+    return client
+
+
+@pytest.mark.parametrize('accept, encoding', [
+    ('br, gzip', 'br'),
+    ('gzip;q=1.0, br;q=0.5', 'gzip'),
+    ('gzip', 'gzip'),
+    ('deflate', None),
+    ('', None),
+])
+def test_content_encoding_is_negotiated_from_accept_encoding(client, accept, encoding):
+    response = client.get('/api/channels', headers={'Accept-Encoding': accept})
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding') == encoding
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    body = response.get_data()
+    if encoding == 'br':
+        body = FakeBrotli.decompress(body)
+    elif encoding == 'gzip':
+        body = gzip.decompress(body)
+    assert 'encoded.m3u' in json.loads(body)
+
+
+def test_every_encoding_shares_one_etag_and_a_new_upload_misses(app_module, client):
+    identity = client.get('/api/channels')
+    compressed = client.get('/api/channels', headers={'Accept-Encoding': 'gzip'})
+    assert identity.headers['ETag'] == compressed.headers['ETag']
+
+    entry = app_module.response_cache.get('channels:position', app_module.store.version(app_module.CHANNELS_VERSION))
+    assert entry is not None and entry.encodings == ['br', 'gzip']
+
+    client.put('/api/upload/encoded2.m3u', data=b'#EXTM3U\n#EXTINF:-1,Late\nhttp://origin.invalid/late.ts\n')
+    refreshed = client.get('/api/channels', headers={'Accept-Encoding': 'gzip'})
+    assert refreshed.headers['ETag'] != identity.headers['ETag']
+    assert 'encoded2.m3u' in json.loads(gzip.decompress(refreshed.get_data()))
@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+from records import Programme
+from storage import Store, fts_query
+
+HOUR = 3600
+CHANNELS = [
+    {'name': 'Sky Sports News', 'url': 'http://origin.invalid/1', 'group': 'Sport'},
+    {'name': 'Sports Central', 'url': 'http://origin.invalid/2', 'group': 'Entertainment'},
+    {'name': 'Cartoon Network', 'url': 'http://origin.invalid/3', 'group': 'Sports'},
+    {'name': 'News 24', 'url': 'http://origin.invalid/4', 'group': 'News'},
+    {'name': 'Near "Quoted" TV', 'url': 'http://origin.invalid/5', 'group': 'Misc'},
+]
+
+
+@pytest.fixture(params=['fts', 'like'])
+def store(request, tmp_path):
+    store = Store(str(tmp_path / 'iptv.db'))
+    if request.param == 'fts':
+        assert store.fts
+    else:
+        store.fts = False
+    store.replace_playlist('search.m3u', CHANNELS)
+    now = int(time.time())
+    store.replace_epg('guide.xml', [
+        ('channel', {'id': 'one', 'name': 'One'}),
+        ('programme', Programme('one', now - 2 * HOUR, now - HOUR, 'Football Tonight', 'Highlights', 'Sports')),
+        ('programme', Programme('one', now, now + HOUR, 'Cooking Show', 'Football stars cook', 'Food')),
+        ('programme', Programme('one', now + HOUR, now + 2 * HOUR, 'Football Tonight', 'Live', 'Sports')),
+    ])
+    return store
+
+
+def names(channels):
+    return [channel['name'] for channel in channels]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('sky news', '"sky" AND "news"*'),
+    ('  sp ', '"sp"*'),
+    ('a"b', '"a" AND "b"*'),
+    ('NEAR(a b)', '"NEAR" AND "a" AND "b"*'),
+    ('-news *', '"news"*'),
+    ('"" - *', ''),
+])
+def test_fts_query_quotes_every_word(text, expected):
+    assert fts_query(text) == expected
+
+
+def test_last_word_matches_as_a_prefix(store):
+    assert names(store.search_channels('sky spo')) == ['Sky Sports News']
+    assert names(store.search_channels('cart')) == ['Cartoon Network']
+    assert store.search_channels('weather') == []
+
+
+def test_ranking_prefers_name_matches(store):
+    if not store.fts:
+        pytest.skip('substring matching is not ranked')
+    # 'Cartoon Network' only matches on its group; the shorter name ranks first
+    assert names(store.search_channels('sports')) == ['Sports Central', 'Sky Sports News', 'Cartoon Network']
+    assert names(store.search_channels('news')) == ['News 24', 'Sky Sports News']
+    # Title matches before description matches
+    assert [p['title'] for p in store.search_programmes('football')][-1] == 'Cooking Show'
+
+
+def test_search_is_narrowed_to_playlists(store):
+    store.replace_playlist('other.m3u', [{'name': 'Sky One', 'url': 'http://origin.invalid/6'}])
+    assert sorted(names(store.search_channels('sky'))) == ['Sky One', 'Sky Sports News']
+    assert names(store.search_channels('sky', playlists=['other.m3u'])) == ['Sky One']
+
+
+@pytest.mark.parametrize('query', ['"', 'a"b', '-news', 'news -sky', '*', 'NEAR(sky news)', 'sky AND', 'OR', '^sky',
+                                   'sky:', "'", '()', 'col:news'])
+def test_fts_syntax_in_the_query_is_taken_literally(store, query):
+    store.search_channels(query)
+    store.search_programmes(query)
+
+
+def test_quotes_and_operators_match_the_words_they_wrap(store):
+    assert names(store.search_channels('"quoted"')) == ['Near "Quoted" TV']
+    assert names(store.search_channels('near')) == ['Near "Quoted" TV']
+    assert names(store.search_channels('-news 24')) == ['News 24']
+
+
+def test_programme_search_filters_by_time(store):
+    now = int(time.time())
+    assert len(store.search_programmes('football')) == 3
+    titles = [p['title'] for p in store.search_programmes('football', after=now)]
+    assert sorted(titles) == ['Cooking Show', 'Football Tonight']
+    assert store.search_programmes('football', sources=['other.xml']) == []
+
+
+@pytest.mark.parametrize('query', ['"', 'a"b', '-', 'news -sky', 'NEAR(sky news)', '*', '"unterminated'])
+def test_api_search_does_not_fail_on_fts_syntax(app_module, query):
+    client = app_module.app.test_client()
+    client.put('/api/upload/search.m3u', data=b'#EXTM3U\n#EXTINF:-1,Sky News\nhttp://origin.invalid/sky\n')
+    response = client.get('/api/search', query_string={'q': query, 'playlist': 'search.m3u'})
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'success'
+
+
+def test_api_search(app_module):
+    client = app_module.app.test_client()
+    client.put('/api/upload/search.m3u', data=b'#EXTM3U\n#EXTINF:-1,Sky News\nhttp://origin.invalid/sky\n')
+    result = client.get('/api/search?q=sky%20ne&type=channels&playlist=search.m3u').get_json()
+    assert names(result['channels']) == ['Sky News'] and 'programmes' not in result
+    assert client.get('/api/search?q=').status_code == 400
+    assert client.get('/api/search?q=sky&type=films').status_code == 400
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from aiohttp import web
+
+from jobs import BackgroundLoop
+from sources import SourceFetcher, SourceScheduler, guess_kind
+from storage import Store
+from stub_servers import Recorder, serve
+
+PLAYLIST = b'#EXTM3U\n#EXTINF:-1,One\nhttp://example.com/one.m3u8\n'
+ETAG = '"v1"'
+LAST_MODIFIED = 'Thu, 01 Jan 2026 00:00:00 GMT'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Store(str(tmp_path / 'iptv.db'))
+
+
+@pytest.mark.parametrize('url, kind', [
+    ('http://example.com/guide.xml', 'epg'),
+    ('http://example.com/guide.xml.gz', 'epg'),
+    ('http://example.com/guide.xmltv.gz', 'epg'),
+    ('http://example.com/playlist.m3u', 'playlist'),
+    ('http://example.com/playlist.m3u.gz', 'playlist'),
+    ('http://example.com/live.m3u8.gz?token=1', 'playlist'),
+    ('http://example.com/epg/all.gz', 'epg'),
+    ('http://example.com/get.php?type=m3u_plus', 'playlist'),
+])
+def test_guess_kind(url, kind):
+    assert guess_kind(url) == kind
+
+
+def source_origin(recorder: Recorder) -> web.Application:
+    """A stub origin serving one playlist with an ETag and Last-Modified, honouring conditional requests."""
+    async def playlist(request):
+        with recorder.track(request):
+            if request.headers.get('If-None-Match') == ETAG or request.headers.get('If-Modified-Since') == LAST_MODIFIED:
+                return web.Response(status=304)
+            return web.Response(body=PLAYLIST, headers={'ETag': ETAG, 'Last-Modified': LAST_MODIFIED})
+
+    app = web.Application()
+    app.router.add_get('/playlist.m3u', playlist)
+    return app
+
+
+def test_unchanged_sources_are_skipped_with_conditional_requests(tmp_path):
+    recorder = Recorder()
+    fetcher = SourceFetcher(str(tmp_path / 'sources'))
+
+    async def run():
+        async with serve(source_origin(recorder)) as base:
+            source = {'name': 'playlist.m3u', 'url': f'{base}/playlist.m3u'}
+            try:
+                first = await fetcher.fetch(source)
+                again = await fetcher.fetch({**source, 'etag': first['etag'], 'last_modified': first['last_modified']})
+                forced = await fetcher.fetch({**source, 'etag': first['etag']}, force=True)
+            finally:
+                await fetcher.close()
+            return first, again, forced
+
+    first, again, forced = asyncio.run(run())
+    assert (first['status'], first['http_status'], first['bytes']) == ('modified', 200, len(PLAYLIST))
+    assert (first['etag'], first['last_modified']) == (ETAG, LAST_MODIFIED)
+    with open(first['path'], 'rb') as f:
+        assert f.read() == PLAYLIST
+
+    assert (again['status'], again['http_status'], again['bytes']) == ('not_modified', 304, 0)
+    _, _, headers, _ = recorder.requests[1]
+    assert headers.get('If-None-Match') == ETAG
+    assert headers.get('If-Modified-Since') == LAST_MODIFIED
+
+    assert forced['status'] == 'modified'
+    _, _, headers, _ = recorder.requests[2]
+    assert 'If-None-Match' not in headers and 'If-Modified-Since' not in headers
+
+
+def test_source_leases_are_exclusive_across_processes(tmp_path):
+    path = str(tmp_path / 'iptv.db')
+    # Two stores on one database stand in for two server processes
+    first = SourceScheduler(Store(path), None, None, refresh_timeout=0.5, owner='worker-1')
+    second = SourceScheduler(Store(path), None, None, refresh_timeout=0.5, owner='worker-2')
+
+    assert first.claim('playlist.m3u')
+    assert not second.claim('playlist.m3u')
+    assert second.claim('guide.xml')
+    assert first.refreshing() == {'playlist.m3u', 'guide.xml'}
+
+    first.release('playlist.m3u')
+    assert second.claim('playlist.m3u')
+    assert not first.claim('playlist.m3u')
+    # The lease of a process that died runs out after refresh_timeout
+    time.sleep(0.6)
+    assert first.claim('playlist.m3u')
+
+
+def test_scheduler_refreshes_due_sources_once_per_interval_in_one_process(tmp_path):
+    path = str(tmp_path / 'iptv.db')
+    Store(path).upsert_source('playlist.m3u', 'playlist', 'http://example.com/playlist.m3u', refresh_interval=1)
+    refreshes = []
+    lock = threading.Lock()
+    background = BackgroundLoop()
+    schedulers = []
+
+    def refresher(store, owner):
+        def refresh(source):
+            with lock:
+                refreshes.append((owner, source['name'], time.monotonic()))
+            store.record_fetch(source['name'], {'status': 'not_modified'})
+        return refresh
+
+    for owner in ('worker-1', 'worker-2'):
+        store = Store(path)
+        schedulers.append(SourceScheduler(store, background, refresher(store, owner), poll_interval=0.2, owner=owner))
+    started = time.monotonic()
+    try:
+        for scheduler in schedulers:
+            scheduler.start()
+        time.sleep(1.6)
+    finally:
+        for scheduler in schedulers:
+            scheduler.stop()
+        # Let the cancelled polling tasks finish before the loop stops
+        time.sleep(0.1)
+        background.stop(5)
+
+    # Due at once, then again a refresh interval later, always by the process holding the scheduler lease
+    assert len(refreshes) == 2
+    assert len({owner for owner, _, _ in refreshes}) == 1
+    assert refreshes[0][2] - started < 0.5
+    assert 1.0 <= refreshes[1][2] - refreshes[0][2] < 1.5
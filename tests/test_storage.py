@@ -0,0 +1,126 @@
+import time
+
+import pytest
+
+from records import Programme
+from storage import Store
+
+HOUR = 3600
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Store(str(tmp_path / 'iptv.db'))
+
+
+def guide(starts):
+    """Guide events with one hour-long programme on channel 'one' at each start."""
+    events = [('channel', {'id': 'one', 'name': 'One'})]
+    events += [('programme', Programme('one', start, start + HOUR, f'Show {start}')) for start in starts]
+    return events
+
+
+def stored_starts(store):
+    return [programme.start for programme in store.iter_programmes('guide.xml')]
+
+
+def test_merge_prunes_programmes_that_ended_before_the_retention_window(store):
+    now = int(time.time())
+    store.replace_epg('guide.xml', guide([now - 48 * HOUR, now - 2 * HOUR, now]))
+    result = store.merge_epg('guide.xml', guide([now - 2 * HOUR, now]), retention_hours=24)
+    assert result['changes']['pruned'] == 1
+    assert result['stale'] is False
+    assert stored_starts(store) == [now - 2 * HOUR, now]
+
+
+def test_merge_of_a_guide_that_ended_long_ago_keeps_its_last_programmes(store):
+    # An archived or lagging feed: every programme ended more than the retention window ago
+    end = int(time.time()) - 30 * 24 * HOUR
+    starts = [end - hours * HOUR for hours in (72, 48, 10, 1)]
+    store.replace_epg('guide.xml', guide(starts))
+    result = store.merge_epg('guide.xml', guide(starts), retention_hours=24)
+    assert result['stale'] is True
+    assert result['programs_count'] == 2
+    # The window ends at the guide's last programme instead of now
+    assert stored_starts(store) == [end - 10 * HOUR, end - HOUR]
+
+
+def test_merge_of_a_guide_without_programmes_prunes_nothing(store):
+    now = int(time.time())
+    store.replace_epg('guide.xml', guide([now - 48 * HOUR, now]))
+    result = store.merge_epg('guide.xml', guide([]), retention_hours=24)
+    assert result['changes']['pruned'] == 0
+    assert stored_starts(store) == [now - 48 * HOUR, now]
+
+
+def test_replacing_a_playlist_bumps_the_channels_version_and_leaves_others_alone(store):
+    from storage import CHANNELS_VERSION
+    assert store.version(CHANNELS_VERSION) == 0
+    store.replace_playlist('a.m3u', [{'name': 'One', 'url': 'http://a/1', 'group': 'News'},
+                                     {'name': 'Two', 'url': 'http://a/2', 'attributes': {'tvg-chno': '2'}}])
+    store.replace_playlist('b.m3u', [{'name': 'Other', 'url': 'http://b/1'}])
+    assert store.version(CHANNELS_VERSION) == 2
+
+    assert store.replace_playlist('a.m3u', iter([{'name': 'Three', 'url': 'http://a/3'}])) == 1
+    assert store.version(CHANNELS_VERSION) == 3
+    assert [c['name'] for c in store.get_channels('a.m3u')] == ['Three']
+    assert [c['name'] for c in store.get_channels('b.m3u')] == ['Other']
+    assert store.playlist_names() == ['a.m3u', 'b.m3u']
+
+
+def test_channels_keep_their_fields_and_extras(store):
+    store.replace_playlist('a.m3u', [{'name': 'One', 'url': 'udp://239.0.0.1:1234', 'logo': 'http://a/1.png',
+                                      'group': 'News', 'tvg_id': 'one.us', 'attributes': {'tvg-chno': '1'},
+                                      'vlc_options': ['http-user-agent=x']}])
+    [channel] = store.get_channels('a.m3u')
+    assert channel['url'] == 'udp://239.0.0.1:1234' and channel['logo'] == 'http://a/1.png'
+    assert channel['group'] == 'News' and channel['tvg_id'] == 'one.us'
+    assert channel['attributes'] == {'tvg-chno': '1'} and channel['vlc_options'] == ['http-user-agent=x']
+    assert 'status' not in channel
+
+
+def test_replacing_a_guide_bumps_its_versions(store):
+    from storage import EPG_VERSION, epg_source_version
+    store.replace_epg('guide.xml', guide([0, HOUR]))
+    store.replace_epg('other.xml', guide([0]))
+    assert store.version(EPG_VERSION) == 2
+    assert store.version(epg_source_version('guide.xml')) == 1
+
+    result = store.replace_epg('guide.xml', guide([2 * HOUR]) + [('programme', Programme('undeclared', 0, HOUR))])
+    assert result == {'programs_count': 2, 'channels_count': 2}
+    assert store.version(epg_source_version('guide.xml')) == 2
+    assert store.version(epg_source_version('other.xml')) == 1
+    assert sorted((p.channel, p.start) for p in store.iter_programmes('guide.xml')) == [('one', 2 * HOUR), ('undeclared', 0)]
+    # Programmes of channels the guide didn't declare get a basic entry
+    assert {c['id'] for c in store.epg_channels('guide.xml')} == {'one', 'undeclared'}
+
+
+def test_legacy_json_is_imported_into_an_empty_store(store, tmp_path):
+    import json
+    folder = tmp_path / 'uploads'
+    folder.mkdir()
+    (folder / 'playlists.json').write_text(json.dumps({
+        'old.m3u': {'channels': [{'name': 'One', 'url': 'http://a/1', 'group': 'News'}]},
+    }))
+    (folder / 'epg_data.json').write_text(json.dumps({
+        'old.xml': {
+            'channels': [{'id': 'one', 'name': 'One'}],
+            'programs': [
+                {'channel': 'one', 'start': '2024-01-05T06:00:00+00:00', 'stop': '2024-01-05T07:00:00+00:00',
+                 'title': 'Morning'},
+                # Times the old ingest couldn't parse were kept in XMLTV format
+                {'channel': 'one', 'start': '20240105070000 +0100', 'stop': '', 'title': 'Late'},
+                {'channel': 'one', 'start': 'garbage', 'title': 'Dropped'},
+            ],
+        },
+    }))
+    store.import_legacy_json(str(folder))
+    assert [c['name'] for c in store.get_channels('old.m3u')] == ['One']
+    programmes = list(store.iter_programmes('old.xml'))
+    assert [(p.title, p.start, p.stop) for p in programmes] == [
+        ('Morning', 1704434400, 1704438000), ('Late', 1704434400, None)]
+
+    # Only ever into an empty store: a second import doesn't duplicate anything
+    store.import_legacy_json(str(folder))
+    assert len(store.get_channels('old.m3u')) == 1
+    assert len(list(store.iter_programmes('old.xml'))) == 2
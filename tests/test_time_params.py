@@ -0,0 +1,43 @@
+import pytest
+
+from timestamps import parse_xmltv_time
+
+# 2024-01-05T00:00:00Z
+DAY = 1704412800
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('20240105', DAY),
+    ('2024010512', DAY + 12 * 3600),
+    ('202401051230', DAY + 12 * 3600 + 30 * 60),
+    ('20240105123045', DAY + 12 * 3600 + 30 * 60 + 45),
+    ('20240105120000 +0100', DAY + 11 * 3600),
+    ('2024-01-05T12:00:00+01:00', DAY + 11 * 3600),
+    ('2024-01-05T12:00:00', DAY + 12 * 3600),
+])
+def test_xmltv_and_iso_times(app_module, value, expected):
+    assert app_module.parse_time_param(value) == expected
+
+
+@pytest.mark.parametrize('value', ['1704412800', '1767225600', '0', '86400', '1999999999'])
+def test_epoch_seconds(app_module, value):
+    assert app_module.parse_time_param(value) == int(value)
+
+
+def test_truncated_xmltv_is_not_taken_for_epoch_seconds(app_module):
+    # Read as epoch seconds, this would be 1970-08-23
+    assert app_module.parse_time_param('20240105') != 20240105
+    assert app_module.parse_time_param('20240105') == parse_xmltv_time('20240105000000 +0000')
+
+
+@pytest.mark.parametrize('value', ['20241305', '202401051', '123456789012', 'yesterday'])
+def test_invalid_times_are_rejected(app_module, value):
+    with pytest.raises(ValueError):
+        app_module.parse_time_param(value)
+
+
+def test_api_accepts_both_forms(app_module):
+    client = app_module.app.test_client()
+    for value in ('20240105', str(DAY)):
+        assert client.get(f'/api/search?q=news&from={value}').status_code == 200, value
+    assert client.get('/api/search?q=news&from=20241305').status_code == 400
@@ -0,0 +1,95 @@
+import io
+import threading
+
+import pytest
+
+from uploads import ChunkedUploads, UploadError
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    return ChunkedUploads(str(tmp_path / 'chunks'), max_bytes=1024)
+
+
+class SlowStream:
+    """A request body that hands out its first read, then waits for `release` before ending."""
+    def __init__(self, data: bytes):
+        self.data = data
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def read(self, size):
+        if self.data:
+            data, self.data = self.data, b''
+            return data
+        self.reading.set()
+        self.release.wait(5)
+        return b''
+
+
+def test_chunks_are_appended_in_order_and_moved_into_place(uploads, tmp_path):
+    upload = uploads.create('guide.xml', 10)
+    assert uploads.append(upload['id'], 0, io.BytesIO(b'01234'))['offset'] == 5
+    status = uploads.append(upload['id'], 5, io.BytesIO(b'56789'))
+    assert status['offset'] == 10 and status['complete']
+    uploads.complete(upload['id'], str(tmp_path / 'guide.xml'))
+    assert (tmp_path / 'guide.xml').read_bytes() == b'0123456789'
+    with pytest.raises(UploadError) as error:
+        uploads.status(upload['id'])
+    assert error.value.status == 404
+
+
+def test_duplicate_and_out_of_order_chunks_are_rejected_with_the_offset(uploads):
+    upload = uploads.create('guide.xml', 10)
+    uploads.append(upload['id'], 0, io.BytesIO(b'01234'))
+    for offset, chunk in ((0, b'01234'), (7, b'789')):
+        with pytest.raises(UploadError) as error:
+            uploads.append(upload['id'], offset, io.BytesIO(chunk))
+        assert (error.value.status, error.value.offset) == (409, 5)
+    with open(uploads._paths(upload['id'])[0], 'rb') as f:
+        assert f.read() == b'01234'
+
+
+def test_a_chunk_sent_twice_at_once_is_written_once(uploads):
+    upload = uploads.create('guide.xml', 10)
+    first = SlowStream(b'01234')
+    writer = threading.Thread(target=uploads.append, args=(upload['id'], 0, first))
+    writer.start()
+    assert first.reading.wait(5)
+
+    # The retry arrives while the first copy is still being written
+    with pytest.raises(UploadError) as error:
+        uploads.append(upload['id'], 0, io.BytesIO(b'01234'))
+    assert error.value.status == 409
+    with pytest.raises(UploadError):
+        uploads.complete(upload['id'], '/nonexistent/guide.xml')
+
+    first.release.set()
+    writer.join(5)
+    with pytest.raises(UploadError) as error:
+        uploads.append(upload['id'], 0, io.BytesIO(b'01234'))
+    assert (error.value.status, error.value.offset) == (409, 5)
+    assert uploads.append(upload['id'], 5, io.BytesIO(b'56789'))['complete']
+    with open(uploads._paths(upload['id'])[0], 'rb') as f:
+        assert f.read() == b'0123456789'
+
+
+def test_chunks_past_the_upload_size_are_dropped(uploads):
+    upload = uploads.create('guide.xml', 4)
+    with pytest.raises(UploadError) as error:
+        uploads.append(upload['id'], 0, io.BytesIO(b'01234'))
+    assert (error.value.status, error.value.offset) == (413, 0)
+    assert uploads.status(upload['id'])['offset'] == 0
+
+
+def test_upload_api_rejects_a_repeated_chunk(app_module):
+    client = app_module.app.test_client()
+    content = b'#EXTM3U\n#EXTINF:-1,One\nhttp://cdn.example/one.ts\n'
+    upload = client.post('/api/uploads', json={'filename': 'chunked.m3u', 'size': len(content)}).get_json()['upload']
+    assert client.put(f"/api/uploads/{upload['id']}?offset=0", data=content[:20]).status_code == 200
+    response = client.put(f"/api/uploads/{upload['id']}?offset=0", data=content[:20])
+    assert response.status_code == 409 and response.get_json()['offset'] == 20
+    response = client.put(f"/api/uploads/{upload['id']}", data=content[20:],
+                          headers={'Content-Range': f'bytes 20-{len(content) - 1}/{len(content)}'})
+    assert response.get_json()['upload']['complete']
+    assert client.post(f"/api/uploads/{upload['id']}/complete").get_json()['total_channels'] == 1
@@ -0,0 +1,123 @@
+"""
+Conversion between XMLTV / ISO-8601 timestamps and the UTC epoch seconds the store keeps.
+
+Programme start and stop times are stored as integers, so sorting, window
+queries and retention pruning are plain integer comparisons that hold across
+guides in different time zones. Guides repeat the same few dates and offsets
+across hundreds of thousands of programmes (and many channels share the
+same start times), so parse_xmltv_time first looks the whole value up in a
+memo table, and otherwise slices the fixed-width fields and looks the date
+and offset up in their own memo tables, instead of going through
+datetime.strptime for every value.
+"""
+from datetime import date, datetime, timezone
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Memo tables are cleared when they grow past this many entries
+MAX_MEMO_ENTRIES = 10000
+MAX_MEMO_TIMES = 100000
+# Zone designators other than numeric offsets that guides use for UTC
+UTC_NAMES = {'Z', 'UTC', 'GMT', 'UT'}
+
+_times = {}
+_formatted = {}
+_date_seconds = {}
+_offset_seconds = {}
+
+
+def _day_start(value: str) -> int:
+    """Epoch seconds of midnight UTC of a 'YYYYMMDD' date."""
+    seconds = _date_seconds.get(value)
+    if seconds is None:
+        if not value.isdigit():
+            raise ValueError(f"Invalid date: {value!r}")
+        seconds = (date(int(value[:4]), int(value[4:6]), int(value[6:8])).toordinal() - EPOCH_ORDINAL) * 86400
+        if len(_date_seconds) >= MAX_MEMO_ENTRIES:
+            _date_seconds.clear()
+        _date_seconds[value] = seconds
+    return seconds
+
+
+def _utc_offset(value: str) -> int:
+    """Seconds east of UTC of a '+0100', '-05:30', '+01' or 'UTC' zone designator."""
+    seconds = _offset_seconds.get(value)
+    if seconds is None:
+        if value.upper() in UTC_NAMES:
+            seconds = 0
+        else:
+            digits = value[1:].replace(':', '')
+            if value[:1] not in '+-' or not digits.isdigit() or len(digits) not in (2, 4):
+                raise ValueError(f"Invalid UTC offset: {value!r}")
+            seconds = int(digits[:2]) * 3600 + int(digits[2:4] or 0) * 60
+            if value[0] == '-':
+                seconds = -seconds
+        if len(_offset_seconds) >= MAX_MEMO_ENTRIES:
+            _offset_seconds.clear()
+        _offset_seconds[value] = seconds
+    return seconds
+
+
+def parse_xmltv_time(value: str):
+    """
+    Converts an XMLTV timestamp ('YYYYMMDDhhmmss +hhmm') to UTC epoch seconds.
+
+    The time may be truncated (to minutes, hours or just the date) and the
+    offset may be missing, in which case the time is taken as UTC. Returns
+    None for an empty or malformed value.
+    """
+    seconds = _times.get(value)
+    if seconds is None and value:
+        seconds = _parse_xmltv_time(value)
+        if seconds is not None:
+            if len(_times) >= MAX_MEMO_TIMES:
+                _times.clear()
+            _times[value] = seconds
+    return seconds
+
+
+def _parse_xmltv_time(value: str):
+    stamp, _, zone = value.strip().partition(' ')
+    if len(stamp) > 14:
+        # Offsets written without a space ('20260101120000+0100')
+        stamp, zone = stamp[:14], stamp[14:]
+    try:
+        seconds = _day_start(stamp[:8])
+        if len(stamp) > 8:
+            if not stamp.isdigit() or len(stamp) % 2:
+                return None
+            hour = int(stamp[8:10])
+            minute = int(stamp[10:12] or 0)
+            second = int(stamp[12:14] or 0)
+            if hour > 23 or minute > 59 or second > 60:
+                return None
+            seconds += hour * 3600 + minute * 60 + second
+        zone = zone.strip()
+        if zone:
+            seconds -= _utc_offset(zone)
+    except ValueError:
+        return None
+    return seconds
+
+
+def parse_iso_time(value: str) -> int:
+    """
+    Converts an ISO-8601 timestamp to UTC epoch seconds; times without an offset are taken as UTC.
+
+    Raises:
+        ValueError: If the value is not an ISO-8601 timestamp.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def format_timestamp(seconds):
+    """Formats UTC epoch seconds as ISO-8601 ('2026-01-01T12:00:00Z'), passing None through."""
+    text = _formatted.get(seconds)
+    if text is None and seconds is not None:
+        text = datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        if len(_formatted) >= MAX_MEMO_TIMES:
+            _formatted.clear()
+        _formatted[seconds] = text
+    return text
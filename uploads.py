@@ -0,0 +1,137 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+COPY_BUFFER_BYTES = 1024 * 1024
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(Exception):
+    """A chunked upload request that can't be applied; `status` is the HTTP status to answer with."""
+    def __init__(self, message: str, status: int = 400, offset: int = None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class ChunkedUploads:
+    """
+    Resumable uploads assembled from sequential chunks on disk.
+
+    Each upload is a `<id>.part` file plus a small `<id>.json` descriptor in
+    `folder`, so an interrupted upload can be resumed (even by another worker
+    process or after a restart) from the offset reported by status(). Chunks
+    must be appended in order: a chunk whose offset doesn't match the bytes
+    received so far is rejected with the current offset. A chunk is written
+    under an exclusive lock on the part file, shared by all worker processes,
+    so a chunk sent twice at once (e.g. by a retrying client) is written only
+    once. Uploads not completed within `max_age` seconds are discarded.
+    """
+    def __init__(self, folder: str, max_bytes: int = None, max_age: float = 24 * 3600):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(folder, exist_ok=True)
+
+    def _paths(self, upload_id: str) -> tuple:
+        if not UPLOAD_ID_PATTERN.match(upload_id or ''):
+            raise UploadError('Upload not found', 404)
+        base = os.path.join(self.folder, upload_id)
+        return f'{base}.part', f'{base}.json'
+
+    def create(self, filename: str, size: int = None) -> dict:
+        """Starts an upload of `filename` (`size` bytes, if known) and returns its status."""
+        if size is not None and self.max_bytes and size > self.max_bytes:
+            raise UploadError(f'Uploads are limited to {self.max_bytes} bytes', 413)
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        part_path, meta_path = self._paths(upload_id)
+        open(part_path, 'wb').close()
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'filename': filename, 'size': size, 'created_at': time.time()}, f)
+        return self.status(upload_id)
+
+    def status(self, upload_id: str) -> dict:
+        part_path, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            offset = os.path.getsize(part_path)
+        except (OSError, ValueError):
+            raise UploadError('Upload not found', 404)
+        return {'id': upload_id, 'filename': meta['filename'], 'size': meta['size'], 'offset': offset,
+                'complete': meta['size'] is not None and offset >= meta['size']}
+
+    def _lock(self, f, upload_id: str):
+        """Locks an open part file, or raises UploadError if another request is writing to it."""
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError('Another chunk of this upload is being written', 409, self.status(upload_id)['offset'])
+
+    def append(self, upload_id: str, offset: int, stream) -> dict:
+        """Appends the bytes of `stream` at `offset`, which must equal the bytes received so far."""
+        status = self.status(upload_id)
+        part_path, _ = self._paths(upload_id)
+        limit = status['size'] if status['size'] is not None else self.max_bytes
+        try:
+            f = open(part_path, 'r+b')
+        except FileNotFoundError:
+            raise UploadError('Upload not found', 404)
+        with f:
+            self._lock(f, upload_id)
+            # The size read under the lock, after any chunk written concurrently
+            received = os.fstat(f.fileno()).st_size
+            if offset != received:
+                raise UploadError(f"Expected a chunk at offset {received}", 409, received)
+            f.seek(received)
+            written = received
+            while True:
+                data = stream.read(COPY_BUFFER_BYTES)
+                if not data:
+                    break
+                written += len(data)
+                if limit and written > limit:
+                    f.truncate(received)
+                    raise UploadError(f'Chunk goes past the upload size of {limit} bytes', 413, received)
+                f.write(data)
+        return self.status(upload_id)
+
+    def complete(self, upload_id: str, destination: str) -> dict:
+        """Moves the assembled file to `destination` (no copy) and forgets the upload."""
+        status = self.status(upload_id)
+        if status['size'] is not None and status['offset'] != status['size']:
+            raise UploadError(f"Upload is incomplete: {status['offset']} of {status['size']} bytes received",
+                              409, status['offset'])
+        part_path, meta_path = self._paths(upload_id)
+        # Not while a chunk is still being written
+        with open(part_path, 'rb') as f:
+            self._lock(f, upload_id)
+            shutil.move(part_path, destination)
+            os.remove(meta_path)
+        return status
+
+    def abort(self, upload_id: str):
+        for path in self._paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def expire(self):
+        """Removes uploads that received no data for max_age seconds."""
+        cutoff = time.time() - self.max_age
+        for entry in os.scandir(self.folder):
+            upload_id = entry.name[:-len('.json')]
+            if not entry.name.endswith('.json') or not UPLOAD_ID_PATTERN.match(upload_id):
+                continue
+            part_path, _ = self._paths(upload_id)
+            last_activity = os.path.getmtime(part_path) if os.path.exists(part_path) else entry.stat().st_mtime
+            if last_activity < cutoff:
+                logger.info("Discarding stale upload %s", upload_id)
+                self.abort(upload_id)